@@ -0,0 +1,201 @@
+# Стоимость вспомогательных функций в расчете на строку: прежние версии на
+# PL/pgSQL против SQL-версий (IMMUTABLE/STABLE, PARALLEL SAFE) и пакетных
+# set-returning функций.
+#
+# Прежние версии calculate_due_date, check_book_availability и
+# calculate_overdue_fine создаются в pg_temp сеанса прогона (*_plpgsql),
+# поэтому сравнение идет на одной базе и одних данных. Для каждой функции
+# запрос вызывает ее для --rows строк; время — медиана по --repeat
+# запускам после прогревочного, стоимость строки — за вычетом запроса без
+# функции (base).
+#
+#     python bench_helpers.py --scale medium --rows 100000 -o helpers.json
+#
+# Требуется psycopg 3 (pip install psycopg); без --dsn используется
+# временный кластер, как в bench_procedures.py.
+
+import argparse
+import json
+import statistics
+import sys
+import time
+
+import psycopg
+
+from bench_procedures import SCALES, TempCluster, git_revision, scale_database
+
+# Версии функций до перевода на SQL
+LEGACY_SQL = """
+CREATE FUNCTION pg_temp.calculate_due_date_plpgsql(
+    reader_type_param VARCHAR(20),
+    loan_date_param DATE DEFAULT CURRENT_DATE
+) RETURNS DATE AS $$
+BEGIN
+    RETURN loan_date_param +
+        CASE reader_type_param
+            WHEN 'студент' THEN INTERVAL '14 days'
+            WHEN 'преподаватель' THEN INTERVAL '30 days'
+            WHEN 'сотрудник' THEN INTERVAL '21 days'
+            ELSE INTERVAL '7 days'
+        END;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION pg_temp.check_book_availability_plpgsql(book_id_param INTEGER)
+RETURNS TABLE(
+    available BOOLEAN,
+    copies_available INTEGER,
+    copies_total INTEGER
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        COALESCE(s.copies_available, 0) > 0 AS available,
+        COALESCE(s.copies_available, 0),
+        b.copies_total
+    FROM books b
+    LEFT JOIN v_book_stock s ON s.book_id = b.book_id
+    WHERE b.book_id = book_id_param;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION pg_temp.calculate_overdue_fine_plpgsql(loan_id_param INTEGER)
+RETURNS DECIMAL(10,2) AS $$
+DECLARE
+    days_overdue INTEGER;
+    fine_per_day DECIMAL(10,2) := 10.00;
+    max_fine DECIMAL(10,2) := 1000.00;
+BEGIN
+    SELECT GREATEST(0, CURRENT_DATE - due_date)
+    INTO days_overdue
+    FROM loans
+    WHERE loan_id = loan_id_param AND status != 'возвращена';
+
+    RETURN LEAST(days_overdue * fine_per_day, max_fine);
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# {n} — число строк. Варианты одной функции дают одинаковый результат
+LOANS = ('(SELECT l.loan_id, l.loan_date, r.reader_type FROM loans l '
+         'JOIN readers r ON r.reader_id = l.reader_id LIMIT {n})')
+BOOKS = '(SELECT book_id FROM books ORDER BY book_id LIMIT {n})'
+OPEN_LOANS = "(SELECT loan_id FROM loans WHERE status != 'возвращена' LIMIT {n})"
+
+CASES = {
+    'calculate_due_date': {
+        'base': f'SELECT count(x.loan_date) FROM {LOANS} x',
+        'plpgsql': 'SELECT sum(pg_temp.calculate_due_date_plpgsql(x.reader_type, x.loan_date) '
+                   f'- x.loan_date) FROM {LOANS} x',
+        'sql': f'SELECT sum(calculate_due_date(x.reader_type, x.loan_date) - x.loan_date) FROM {LOANS} x',
+    },
+    'check_book_availability': {
+        'base': f'SELECT count(*) FROM {BOOKS} b',
+        'plpgsql': f'SELECT count(*) FILTER (WHERE a.available) FROM {BOOKS} b '
+                   'CROSS JOIN LATERAL pg_temp.check_book_availability_plpgsql(b.book_id) a',
+        'sql': f'SELECT count(*) FILTER (WHERE a.available) FROM {BOOKS} b '
+               'CROSS JOIN LATERAL check_book_availability(b.book_id) a',
+        'set': 'SELECT count(*) FILTER (WHERE available) '
+               f'FROM check_books_availability(ARRAY(SELECT book_id FROM {BOOKS} b))',
+    },
+    'calculate_overdue_fine': {
+        'base': f'SELECT count(*) FROM {OPEN_LOANS} x',
+        'plpgsql': f'SELECT sum(pg_temp.calculate_overdue_fine_plpgsql(x.loan_id)) FROM {OPEN_LOANS} x',
+        'sql': f'SELECT sum(calculate_overdue_fine(x.loan_id)) FROM {OPEN_LOANS} x',
+        'set': 'SELECT sum(fine_amount) '
+               f'FROM calculate_overdue_fines(ARRAY(SELECT loan_id FROM {OPEN_LOANS} x))',
+    },
+}
+
+
+def timed(conn, query, repeat):
+    conn.execute(query)  # прогрев: кэш планов и буферы
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        row = conn.execute(query).fetchone()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times), row[0]
+
+
+def measure(dsn, rows, repeat):
+    results = []
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute('SET search_path TO library, public')
+        conn.execute('SET jit = off')
+        conn.execute(LEGACY_SQL)
+        for function, variants in CASES.items():
+            base_seconds, count = timed(conn, variants['base'].format(n=rows), repeat)
+            legacy = None
+            for variant, query in variants.items():
+                if variant == 'base':
+                    continue
+                seconds, value = timed(conn, query.format(n=rows), repeat)
+                per_row = max(seconds - base_seconds, 0) / count * 1e6 if count else None
+                legacy = per_row if variant == 'plpgsql' else legacy
+                results.append({
+                    'function': function,
+                    'variant': variant,
+                    'rows': count,
+                    'median_ms': round(seconds * 1000, 3),
+                    'base_ms': round(base_seconds * 1000, 3),
+                    'us_per_row': round(per_row, 3) if per_row is not None else None,
+                    'speedup': round(legacy / per_row, 1) if legacy and per_row else None,
+                    'result': float(value) if value is not None else None,
+                })
+                r = results[-1]
+                print(f'  {function:<24} {variant:<8} {count:>8} стр. {r["median_ms"]:>10.2f} мс '
+                      f'{r["us_per_row"] or 0:>9.3f} мкс/стр.', file=sys.stderr)
+    return results
+
+
+def print_results(results):
+    print(f'{"функция":<24} {"вариант":<8} {"строк":>8} {"мс":>10} {"мкс/стр.":>9} {"ускор.":>7}')
+    for r in results:
+        speedup = f'{r["speedup"]:>6.1f}x' if r['speedup'] else f'{"—":>7}'
+        print(f'{r["function"]:<24} {r["variant"]:<8} {r["rows"]:>8} {r["median_ms"]:>10.2f} '
+              f'{r["us_per_row"] or 0:>9.3f} {speedup}')
+    for function in CASES:
+        values = {r['result'] for r in results if r['function'] == function}
+        if len(values) > 1:
+            print(f"✗ {function}: варианты дают разные результаты: {sorted(values, key=str)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Стоимость вспомогательных функций на строку')
+    parser.add_argument('--dsn', help='сервер для базы прогона (по умолчанию — временный кластер)')
+    parser.add_argument('--pg-bin', help='каталог initdb и pg_ctl для временного кластера')
+    parser.add_argument('--locale', default='C.UTF-8', help='локаль временного кластера')
+    parser.add_argument('--scale', default='medium', choices=sorted(SCALES))
+    parser.add_argument('--rows', type=int, default=100_000, help='строк на запрос')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--jobs', type=int, default=4, help='соединений для сборки индексов')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--keep', action='store_true', help='не удалять базу прогона')
+    parser.add_argument('-o', '--output', help='сохранить результаты в JSON')
+    args = parser.parse_args(argv)
+    if args.rows < 1 or args.repeat < 1:
+        parser.error('--rows и --repeat должны быть положительными')
+
+    report = {'git_revision': git_revision(), 'scale': args.scale, 'rows': args.rows,
+              'repeat': args.repeat}
+
+    def run_on(admin_dsn):
+        with scale_database(admin_dsn, args.scale, args.seed, args.jobs, args.keep) as (dsn, _):
+            report['results'] = measure(dsn, args.rows, args.repeat)
+
+    if args.dsn:
+        run_on(args.dsn)
+    else:
+        with TempCluster(args.pg_bin, args.locale) as cluster:
+            run_on(cluster.dsn)
+
+    print_results(report['results'])
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'✓ Результаты: {args.output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+# Нагрузочный тест выдачи одной популярной книги
+#
+# Каждый клиент в своем соединении повторяет выдачу и возврат одной и той
+# же книги: INSERT в loans (триггер занимает экземпляр в book_copies),
+# пауза --hold-ms внутри транзакции (остальная работа оформления выдачи),
+# COMMIT; затем возврат отдельной транзакцией. Число клиентов растет по
+# шагам --clients, для каждого шага печатаются выдачи в секунду и
+# задержка транзакции выдачи.
+#
+# Режим --mode row добавляет в обе транзакции прежнее обновление
+# books.copies_available: клиенты снова ждут одну строку books, и
+# сравнение с режимом copies показывает выигрыш от book_copies.
+#
+# Пример:
+#     python bench_hot_book.py --dsn "dbname=library_management" \
+#         --clients 1,2,4,8,16,32 --copies 64 --mode copies
+#
+# Для теста создаются отдельная книга с --copies экземплярами и по
+# читателю на клиента; после теста они удаляются вместе с выдачами.
+# Требуется psycopg 3 (pip install psycopg).
+
+import argparse
+import sys
+import threading
+import time
+
+import psycopg
+
+from bench_procedures import percentile
+
+MODES = ('copies', 'row')
+
+
+def setup(conn, copies, readers):
+    """Создает тестовую книгу и читателей, возвращает (book_id, [reader_id])."""
+    with conn.transaction():
+        book_id = conn.execute(
+            "INSERT INTO books (title, copies_total, copies_available, category_id) "
+            "SELECT 'Нагрузочный тест: популярная книга', %s, %s, MIN(category_id) "
+            "FROM categories RETURNING book_id", (copies, copies)).fetchone()[0]
+        reader_ids = [row[0] for row in conn.execute(
+            "INSERT INTO readers (last_name, first_name, reader_type) "
+            "SELECT 'Нагрузочный', 'Клиент ' || n, 'сотрудник' "
+            "FROM generate_series(1, %s) AS n RETURNING reader_id", (readers,)).fetchall()]
+    return book_id, reader_ids
+
+
+def cleanup(conn, book_id, reader_ids):
+    with conn.transaction():
+        conn.execute("DELETE FROM loans WHERE book_id = %s", (book_id,))
+        conn.execute("DELETE FROM books WHERE book_id = %s", (book_id,))
+        conn.execute("DELETE FROM readers WHERE reader_id = ANY(%s)", (reader_ids,))
+
+
+def client(dsn, book_id, reader_id, mode, hold, start, stop_at, latencies, errors):
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute('SET search_path TO library, public')
+        start.wait()
+        while time.perf_counter() < stop_at[0]:
+            started = time.perf_counter()
+            try:
+                with conn.transaction():
+                    loan_id, loan_date = conn.execute(
+                        "INSERT INTO loans (reader_id, book_id, notes) VALUES (%s, %s, 'bench') "
+                        "RETURNING loan_id, loan_date", (reader_id, book_id)).fetchone()
+                    if mode == 'row':
+                        conn.execute("UPDATE books SET copies_available = copies_available - 1 "
+                                     "WHERE book_id = %s", (book_id,))
+                    if hold:
+                        time.sleep(hold)
+                latencies.append(time.perf_counter() - started)
+                with conn.transaction():
+                    conn.execute("UPDATE loans SET status = 'возвращена', return_date = CURRENT_DATE "
+                                 "WHERE loan_id = %s AND loan_date = %s", (loan_id, loan_date))
+                    if mode == 'row':
+                        conn.execute("UPDATE books SET copies_available = copies_available + 1 "
+                                     "WHERE book_id = %s", (book_id,))
+            except psycopg.Error as e:
+                errors.append(e)
+
+
+def run_step(dsn, book_id, reader_ids, mode, hold, duration):
+    """Один шаг: len(reader_ids) клиентов в течение duration секунд."""
+    start = threading.Barrier(len(reader_ids) + 1)
+    stop_at = [float('inf')]
+    latencies, errors = [], []
+    threads = [threading.Thread(target=client,
+                                args=(dsn, book_id, r, mode, hold, start, stop_at, latencies, errors))
+               for r in reader_ids]
+    for t in threads:
+        t.start()
+    start.wait()
+    began = time.perf_counter()
+    stop_at[0] = began + duration
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - began
+    latencies.sort()
+    return {
+        'issues_per_sec': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'errors': len(errors),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочный тест выдачи одной популярной книги')
+    parser.add_argument('--dsn', required=True, help='строка подключения PostgreSQL')
+    parser.add_argument('--clients', default='1,2,4,8,16,32',
+                        help='число клиентов на шагах теста, через запятую')
+    parser.add_argument('--copies', type=int, default=64, help='экземпляров тестовой книги')
+    parser.add_argument('--mode', choices=MODES, default='copies',
+                        help='copies — только book_copies; row — плюс обновление строки books')
+    parser.add_argument('--hold-ms', type=float, default=2.0,
+                        help='пауза внутри транзакции выдачи, мс')
+    parser.add_argument('--duration', type=float, default=10.0, help='длительность шага, с')
+    args = parser.parse_args(argv)
+    try:
+        steps = [int(n) for n in args.clients.split(',') if n.strip()]
+    except ValueError:
+        parser.error('--clients: ожидаются целые числа через запятую')
+    if not steps or min(steps) < 1:
+        parser.error('--clients: число клиентов должно быть положительным')
+    if args.copies < max(steps):
+        parser.error('--copies должно быть не меньше наибольшего числа клиентов')
+
+    with psycopg.connect(args.dsn, autocommit=True) as conn:
+        conn.execute('SET search_path TO library, public')
+        book_id, reader_ids = setup(conn, args.copies, max(steps))
+        try:
+            print(f'Режим: {args.mode}, экземпляров: {args.copies}, пауза: {args.hold_ms} мс')
+            print(f'{"клиенты":>8} {"выдач/с":>10} {"p50, мс":>9} {"p95, мс":>9} {"ошибки":>7}')
+            for n in steps:
+                result = run_step(args.dsn, book_id, reader_ids[:n], args.mode,
+                                  args.hold_ms / 1000, args.duration)
+                print(f'{n:>8} {result["issues_per_sec"]:>10.1f} {result["p50_ms"]:>9.2f} '
+                      f'{result["p95_ms"]:>9.2f} {result["errors"]:>7}')
+                sys.stdout.flush()
+        finally:
+            cleanup(conn, book_id, reader_ids)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+# Массовые операции над loans: триггеры учета экземпляров уровня строки
+# против уровня оператора с таблицами переходов
+#
+# Сценарии по --rows строк одним оператором:
+#   insert  — INSERT выдач на свободные экземпляры;
+#   return  — UPDATE status = 'возвращена' у открытых выдач;
+#   notes   — UPDATE примечаний (учет экземпляров ничего не делает).
+# Вариант row восстанавливает прежний триггер FOR EACH ROW на любой
+# INSERT или UPDATE loans, вариант statement — текущие триггеры схемы.
+# Каждый запуск идет в транзакции, которая откатывается, поэтому все
+# запуски видят одни данные; время — медиана по --repeat запускам. После
+# оператора снимается число свободных экземпляров по книгам: варианты
+# одного сценария должны совпадать.
+#
+#     python bench_loan_triggers.py --scale large --rows 100000 -o triggers.json
+#
+# Остальные триггеры loans (статистика читателей, дневные итоги,
+# уведомления) работают в обоих вариантах. Требуется psycopg 3
+# (pip install psycopg); без --dsn используется временный кластер, как в
+# bench_procedures.py.
+
+import argparse
+import json
+import statistics
+import sys
+import time
+
+import psycopg
+
+from bench_procedures import SCALES, TempCluster, git_revision, scale_database
+
+# Прежний триггер уровня строки; создается и удаляется в откатываемой
+# транзакции запуска
+LEGACY_SQL = """
+DROP TRIGGER tr_update_book_availability_insert ON loans;
+DROP TRIGGER tr_update_book_availability_update ON loans;
+DROP TRIGGER tr_set_loan_status ON loans;
+
+CREATE FUNCTION update_book_availability_row()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE book_copies c
+        SET loan_id = NEW.loan_id
+        FROM (SELECT copy_no FROM book_copies
+              WHERE book_id = NEW.book_id AND loan_id IS NULL
+              LIMIT 1
+              FOR UPDATE SKIP LOCKED) free
+        WHERE c.book_id = NEW.book_id AND c.copy_no = free.copy_no;
+
+        IF NOT FOUND THEN
+            UPDATE book_copies c
+            SET loan_id = NEW.loan_id
+            FROM (SELECT copy_no FROM book_copies
+                  WHERE book_id = NEW.book_id AND loan_id IS NULL
+                  LIMIT 1
+                  FOR UPDATE) free
+            WHERE c.book_id = NEW.book_id AND c.copy_no = free.copy_no;
+        END IF;
+
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'Книга с ID % недоступна для выдачи', NEW.book_id;
+        END IF;
+
+        RETURN NEW;
+
+    ELSIF TG_OP = 'UPDATE' THEN
+        IF OLD.status != 'возвращена' AND NEW.status = 'возвращена' THEN
+            UPDATE book_copies
+            SET loan_id = NULL
+            WHERE loan_id = NEW.loan_id;
+
+            IF NEW.return_date IS NULL THEN
+                NEW.return_date := CURRENT_DATE;
+            END IF;
+        END IF;
+
+        IF OLD.status = 'выдана' AND NEW.due_date < CURRENT_DATE AND NEW.status = 'выдана' THEN
+            NEW.status := 'просрочена';
+        END IF;
+
+        RETURN NEW;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER tr_update_book_availability
+    AFTER INSERT OR UPDATE ON loans
+    FOR EACH ROW
+    EXECUTE FUNCTION update_book_availability_row();
+"""
+
+VARIANTS = ('row', 'statement')
+
+# %(rows)s — число строк оператора
+SCENARIOS = {
+    'insert': """
+        INSERT INTO loans (reader_id, book_id, notes)
+        SELECT r.ids[1 + c.n %% cardinality(r.ids)], c.book_id, 'bench'
+        FROM (SELECT book_id, row_number() OVER () AS n
+              FROM book_copies WHERE loan_id IS NULL LIMIT %(rows)s) c
+        CROSS JOIN (SELECT array_agg(reader_id) AS ids FROM readers WHERE is_active) r
+    """,
+    'return': """
+        UPDATE loans SET status = 'возвращена', return_date = CURRENT_DATE
+        WHERE loan_id IN (SELECT loan_id FROM loans WHERE status != 'возвращена'
+                          ORDER BY loan_id LIMIT %(rows)s)
+    """,
+    'notes': """
+        UPDATE loans SET notes = 'bench'
+        WHERE loan_id IN (SELECT loan_id FROM loans ORDER BY loan_id LIMIT %(rows)s)
+    """,
+}
+
+# Свободные экземпляры по книгам одной строкой-хэшем
+STOCK_SQL = """
+SELECT md5(string_agg(book_id || ':' || free, ',' ORDER BY book_id))
+FROM (SELECT book_id, count(*) FILTER (WHERE loan_id IS NULL) AS free
+      FROM book_copies GROUP BY book_id) s
+"""
+
+
+def run_once(conn, variant, query, rows):
+    with conn.transaction(force_rollback=True):
+        if variant == 'row':
+            conn.execute(LEGACY_SQL)
+        started = time.perf_counter()
+        count = conn.execute(query, {'rows': rows}).rowcount
+        seconds = time.perf_counter() - started
+        stock = conn.execute(STOCK_SQL).fetchone()[0]
+    return seconds, count, stock
+
+
+def measure(dsn, scenarios, rows, repeat):
+    results = []
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute('SET search_path TO library, public')
+        conn.execute('SET jit = off')
+        conn.execute('VACUUM ANALYZE')
+        for scenario in scenarios:
+            legacy = None
+            for variant in VARIANTS:
+                run_once(conn, variant, SCENARIOS[scenario], rows)  # прогрев
+                runs = [run_once(conn, variant, SCENARIOS[scenario], rows) for _ in range(repeat)]
+                seconds = statistics.median(r[0] for r in runs)
+                legacy = seconds if variant == 'row' else legacy
+                results.append({
+                    'scenario': scenario,
+                    'variant': variant,
+                    'rows': runs[-1][1],
+                    'median_ms': round(seconds * 1000, 1),
+                    'us_per_row': round(seconds / runs[-1][1] * 1e6, 2) if runs[-1][1] else None,
+                    'speedup': round(legacy / seconds, 1) if variant != 'row' and seconds else None,
+                    'stock': runs[-1][2],
+                })
+                r = results[-1]
+                print(f'  {scenario:<8} {variant:<10} {r["rows"]:>8} стр. '
+                      f'{r["median_ms"]:>10.1f} мс', file=sys.stderr)
+    return results
+
+
+def print_results(results):
+    print(f'{"сценарий":<8} {"вариант":<10} {"строк":>8} {"мс":>10} {"мкс/стр.":>9} {"ускор.":>7}')
+    for r in results:
+        speedup = f'{r["speedup"]:>6.1f}x' if r['speedup'] else f'{"—":>7}'
+        print(f'{r["scenario"]:<8} {r["variant"]:<10} {r["rows"]:>8} {r["median_ms"]:>10.1f} '
+              f'{r["us_per_row"] or 0:>9.2f} {speedup}')
+    for scenario in dict.fromkeys(r['scenario'] for r in results):
+        if len({r['stock'] for r in results if r['scenario'] == scenario}) > 1:
+            print(f'✗ {scenario}: варианты оставляют разное число свободных экземпляров')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Триггеры loans на массовых операциях')
+    parser.add_argument('--dsn', help='сервер для базы прогона (по умолчанию — временный кластер)')
+    parser.add_argument('--pg-bin', help='каталог initdb и pg_ctl для временного кластера')
+    parser.add_argument('--locale', default='C.UTF-8', help='локаль временного кластера')
+    parser.add_argument('--scale', default='large', choices=sorted(SCALES))
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='сценарии через запятую')
+    parser.add_argument('--rows', type=int, default=100_000, help='строк на оператор')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--jobs', type=int, default=4, help='соединений для сборки индексов')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--keep', action='store_true', help='не удалять базу прогона')
+    parser.add_argument('-o', '--output', help='сохранить результаты в JSON')
+    args = parser.parse_args(argv)
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'неизвестные сценарии: {", ".join(sorted(unknown))}')
+    if args.rows < 1 or args.repeat < 1:
+        parser.error('--rows и --repeat должны быть положительными')
+
+    report = {'git_revision': git_revision(), 'scale': args.scale, 'rows': args.rows,
+              'repeat': args.repeat}
+
+    def run_on(admin_dsn):
+        with scale_database(admin_dsn, args.scale, args.seed, args.jobs, args.keep) as (dsn, _):
+            report['results'] = measure(dsn, scenarios, args.rows, args.repeat)
+
+    if args.dsn:
+        run_on(args.dsn)
+    else:
+        with TempCluster(args.pg_bin, args.locale) as cluster:
+            run_on(cluster.dsn)
+
+    print_results(report['results'])
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'✓ Результаты: {args.output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,409 @@
+# Нагрузочные измерения процедур и представлений схемы library
+#
+# Для каждого масштаба данных создается отдельная база, схема и данные
+# загружаются фазами bulk_load.py, затем каждая нагрузка выполняется
+# --duration секунд с каждым числом клиентов из --clients:
+#   issue_book, return_book      — CALL процедур;
+#   calculate_overdue_fine       — вызов функции по случайной выдаче;
+#   view:<имя>                   — SELECT из каждого представления v_*
+#                                  (по ключу book_id/reader_id, если он есть).
+# Для каждого шага сохраняются операции в секунду и задержки p50/p95/p99.
+#
+# Без --dsn запускается временный кластер (initdb + pg_ctl во временном
+# каталоге, fsync=off), который удаляется после прогона. Пример:
+#     python bench_procedures.py run --scales small,medium --clients 1,4,16 \
+#         -o before.json
+#     ... изменение схемы ...
+#     python bench_procedures.py run --scales small,medium --clients 1,4,16 \
+#         -o after.json
+#     python bench_procedures.py compare before.json after.json --threshold 10
+#
+# Требуется psycopg 3 (pip install psycopg); для временного кластера —
+# initdb и pg_ctl в PATH или в каталоге --pg-bin.
+
+import argparse
+import collections
+import contextlib
+import datetime as dt
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import psycopg
+from psycopg import sql
+from psycopg.conninfo import make_conninfo
+
+import bulk_load
+import data_generator
+
+# Масштабы данных: параметры GeneratorConfig
+SCALES = {
+    'small': dict(readers=1_000, authors=300, books=2_000, loans=10_000),
+    'medium': dict(readers=10_000, authors=2_000, books=20_000, loans=100_000),
+    'large': dict(readers=100_000, authors=20_000, books=200_000, loans=2_000_000),
+}
+
+# Столбцы, по которым представление читается точечно
+VIEW_KEYS = ('book_id', 'reader_id', 'loan_id')
+VIEW_LIMIT = 100
+
+
+# ---------------------------------------------------------------------
+# ВРЕМЕННЫЙ КЛАСТЕР
+# ---------------------------------------------------------------------
+
+class TempCluster:
+    """Кластер PostgreSQL во временном каталоге, доступный через сокет."""
+
+    def __init__(self, pg_bin=None, locale='C.UTF-8'):
+        self.pg_bin = pg_bin
+        # Локаль с UTF-8 нужна для регистра кириллицы в полнотекстовом
+        # и триграммном поиске
+        self.locale = locale
+        self.root = None
+        self.port = None
+
+    def _tool(self, name):
+        return os.path.join(self.pg_bin, name) if self.pg_bin else name
+
+    def __enter__(self):
+        self.root = tempfile.mkdtemp(prefix='library_bench_')
+        data = os.path.join(self.root, 'data')
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.port = s.getsockname()[1]
+        subprocess.run([self._tool('initdb'), '-D', data, '-U', 'postgres', '-A', 'trust',
+                        '-E', 'UTF8', f'--locale={self.locale}', '--no-sync'],
+                       check=True, stdout=subprocess.DEVNULL)
+        options = f"-p {self.port} -k {self.root} -c listen_addresses='' -c fsync=off"
+        subprocess.run([self._tool('pg_ctl'), '-D', data, '-o', options,
+                        '-l', os.path.join(self.root, 'postgres.log'), '-w', 'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+        return self
+
+    def __exit__(self, *exc):
+        subprocess.run([self._tool('pg_ctl'), '-D', os.path.join(self.root, 'data'),
+                        '-m', 'fast', '-w', 'stop'], stdout=subprocess.DEVNULL)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    @property
+    def dsn(self):
+        return f'host={self.root} port={self.port} user=postgres dbname=postgres'
+
+
+def database_dsn(dsn, dbname):
+    return make_conninfo(dsn, dbname=dbname)
+
+
+# ---------------------------------------------------------------------
+# НАГРУЗКИ
+# ---------------------------------------------------------------------
+
+class Workload:
+    """Один вид операции: SQL и генератор параметров.
+
+    prepare() выбирает из базы ключи для параметров; params() возвращает
+    None, когда ключи исчерпаны (например, все открытые выдачи закрыты).
+    """
+
+    def __init__(self, name, statement, prepare, make_params):
+        self.name = name
+        self.statement = statement
+        self._prepare = prepare
+        self._make_params = make_params
+        self.keys = None
+        self.lock = threading.Lock()
+
+    def prepare(self, conn):
+        self.keys = self._prepare(conn)
+
+    def params(self, rng):
+        with self.lock:
+            return self._make_params(self.keys, rng)
+
+
+def column(conn, query):
+    return [row[0] for row in conn.execute(query).fetchall()]
+
+
+def choose(keys, rng):
+    return (rng.choice(keys),) if keys else None
+
+
+def pop_left(keys, rng):
+    return (keys.popleft(),) if keys else None
+
+
+def standard_workloads():
+    return [
+        Workload(
+            'calculate_overdue_fine', 'SELECT calculate_overdue_fine(%s)',
+            lambda conn: column(conn, "SELECT loan_id FROM loans "
+                                      "WHERE status IN ('выдана', 'просрочена') LIMIT 10000"),
+            choose),
+        Workload(
+            'issue_book', "CALL issue_book(%s, %s, 'bench')",
+            lambda conn: (
+                column(conn, "SELECT r.reader_id FROM readers r "
+                             "LEFT JOIN reader_loan_stats s ON s.reader_id = r.reader_id "
+                             "WHERE r.is_active AND COALESCE(s.overdue_loans, 0) = 0 LIMIT 10000"),
+                column(conn, "SELECT book_id FROM v_book_stock "
+                             "ORDER BY copies_available DESC LIMIT 1000")),
+            lambda keys, rng: (rng.choice(keys[0]), rng.choice(keys[1])) if all(keys) else None),
+        # Возвраты в срок: каждую выдачу можно закрыть один раз
+        Workload(
+            'return_book', 'CALL return_book(%s)',
+            lambda conn: collections.deque(column(
+                conn, "SELECT loan_id FROM loans "
+                      "WHERE status = 'выдана' AND due_date >= CURRENT_DATE")),
+            pop_left),
+    ]
+
+
+def view_workloads(conn):
+    """Нагрузка на каждое представление v_* схемы library."""
+    workloads = []
+    views = column(conn, "SELECT table_name FROM information_schema.views "
+                         "WHERE table_schema = 'library' AND table_name LIKE 'v\\_%' "
+                         "ORDER BY table_name")
+    for view in views:
+        names = column(conn, sql.SQL(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = 'library' AND table_name = {}").format(view))
+        key = next((k for k in VIEW_KEYS if k in names), None)
+        if key:
+            statement = sql.SQL('SELECT * FROM {} WHERE {} = %s').format(
+                sql.Identifier(view), sql.Identifier(key))
+            table = {'book_id': 'books', 'reader_id': 'readers', 'loan_id': 'loans'}[key]
+            prepare = (lambda conn, key=key, table=table: column(conn, sql.SQL(
+                'SELECT {} FROM {} LIMIT 10000').format(sql.Identifier(key), sql.Identifier(table))))
+            workloads.append(Workload(f'view:{view}', statement, prepare, choose))
+        else:
+            statement = sql.SQL('SELECT * FROM {} LIMIT {}').format(
+                sql.Identifier(view), sql.Literal(VIEW_LIMIT))
+            workloads.append(Workload(f'view:{view}', statement,
+                                      lambda conn: None, lambda keys, rng: ()))
+    return workloads
+
+
+def client(dsn, workload, seed, start, stop_at, latencies, errors):
+    rng = random.Random(seed)
+    with psycopg.connect(dsn, autocommit=True, prepare_threshold=0) as conn:
+        conn.execute('SET search_path TO library, public')
+        start.wait()
+        while time.perf_counter() < stop_at[0]:
+            params = workload.params(rng)
+            if params is None:
+                return
+            started = time.perf_counter()
+            try:
+                conn.execute(workload.statement, params)
+            except psycopg.Error as e:
+                errors.append(e.diag.message_primary or str(e))
+                continue
+            latencies.append(time.perf_counter() - started)
+
+
+def percentile(sorted_values, p):
+    """p-й процентиль по отсортированному списку (ближайший ранг)."""
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def run_workload(dsn, workload, clients, duration, seed):
+    start = threading.Barrier(clients + 1)
+    stop_at = [float('inf')]
+    latencies, errors = [], []
+    threads = [threading.Thread(target=client,
+                                args=(dsn, workload, seed + i, start, stop_at, latencies, errors))
+               for i in range(clients)]
+    for t in threads:
+        t.start()
+    start.wait()
+    began = time.perf_counter()
+    stop_at[0] = began + duration
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - began
+    latencies.sort()
+    return {
+        'workload': workload.name,
+        'clients': clients,
+        'ops': len(latencies),
+        'errors': len(errors),
+        'error_samples': sorted(set(errors))[:3],
+        'seconds': round(elapsed, 3),
+        'ops_per_sec': round(len(latencies) / elapsed, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+# ---------------------------------------------------------------------
+# ПРОГОН
+# ---------------------------------------------------------------------
+
+@contextlib.contextmanager
+def scale_database(admin_dsn, scale, seed, jobs, keep=False):
+    """База library_bench_<масштаб> с данными; отдает (dsn, секунд загрузки)."""
+    dbname = f'library_bench_{scale}'
+    with psycopg.connect(admin_dsn, autocommit=True) as conn:
+        conn.execute(sql.SQL('DROP DATABASE IF EXISTS {}').format(sql.Identifier(dbname)))
+        conn.execute(sql.SQL("CREATE DATABASE {} ENCODING 'UTF8' TEMPLATE template0").format(
+            sql.Identifier(dbname)))
+    dsn = database_dsn(admin_dsn, dbname)
+    try:
+        config = data_generator.GeneratorConfig(seed=seed, **SCALES[scale])
+        started = time.perf_counter()
+        bulk_load.run_phases(dsn, bulk_load.PHASES, config, jobs)
+        yield dsn, time.perf_counter() - started
+    finally:
+        if not keep:
+            with psycopg.connect(admin_dsn, autocommit=True) as conn:
+                conn.execute(sql.SQL('DROP DATABASE IF EXISTS {} WITH (FORCE)').format(
+                    sql.Identifier(dbname)))
+
+
+def bench_scale(admin_dsn, scale, args):
+    with scale_database(admin_dsn, scale, args.seed, args.jobs, args.keep) as (dsn, load_seconds):
+        with psycopg.connect(dsn, autocommit=True) as conn:
+            conn.execute('SET search_path TO library, public')
+            workloads = view_workloads(conn) + standard_workloads()
+        if args.workloads:
+            wanted = set(args.workloads.split(','))
+            workloads = [w for w in workloads if w.name in wanted]
+
+        results = []
+        for workload in workloads:
+            for clients in args.clients:
+                with psycopg.connect(dsn, autocommit=True) as conn:
+                    conn.execute('SET search_path TO library, public')
+                    workload.prepare(conn)
+                result = run_workload(dsn, workload, clients, args.duration, args.seed)
+                result['scale'] = scale
+                results.append(result)
+                print(f'  {scale:>7} {workload.name:<28} {clients:>3} кл. '
+                      f'{result["ops_per_sec"]:>10.1f} оп/с  p95 {result["p95_ms"]:>8.2f} мс'
+                      f'  ошибок {result["errors"]}', file=sys.stderr)
+        return {'scale': scale, 'config': SCALES[scale], 'load_seconds': round(load_seconds, 1)}, results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    report = {
+        'started_at': dt.datetime.now().isoformat(timespec='seconds'),
+        'git_revision': git_revision(),
+        'clients': args.clients,
+        'duration': args.duration,
+        'seed': args.seed,
+        'scales': [],
+        'results': [],
+    }
+
+    def bench_all(admin_dsn):
+        with psycopg.connect(admin_dsn) as conn:
+            report['server_version'] = conn.execute('SHOW server_version').fetchone()[0]
+        for scale in args.scales:
+            info, results = bench_scale(admin_dsn, scale, args)
+            report['scales'].append(info)
+            report['results'].extend(results)
+
+    if args.dsn:
+        bench_all(args.dsn)
+    else:
+        with TempCluster(args.pg_bin, args.locale) as cluster:
+            bench_all(cluster.dsn)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'✓ Результаты: {args.output}', file=sys.stderr)
+
+
+def compare(args):
+    """Сравнение двух прогонов; код выхода 1 при регрессии сверх порога."""
+    with open(args.before, encoding='utf-8') as f:
+        before = {(r['scale'], r['workload'], r['clients']): r for r in json.load(f)['results']}
+    with open(args.after, encoding='utf-8') as f:
+        after = {(r['scale'], r['workload'], r['clients']): r for r in json.load(f)['results']}
+
+    def change(old, new):
+        return (new - old) / old * 100 if old else 0.0
+
+    regressions = 0
+    print(f'{"масштаб":>7} {"нагрузка":<28} {"кл.":>3} {"оп/с, %":>9} {"p95, %":>8}')
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        throughput = change(old['ops_per_sec'], new['ops_per_sec'])
+        p95 = change(old['p95_ms'], new['p95_ms'])
+        regressed = throughput < -args.threshold or p95 > args.threshold
+        regressions += regressed
+        mark = '  ✗ регрессия' if regressed else ''
+        print(f'{key[0]:>7} {key[1]:<28} {key[2]:>3} {throughput:>+9.1f} {p95:>+8.1f}{mark}')
+    missing = sorted(before.keys() - after.keys())
+    for key in missing:
+        print(f'{key[0]:>7} {key[1]:<28} {key[2]:>3}  нет в новом прогоне')
+    return 1 if regressions else 0
+
+
+def int_list(text):
+    return [int(n) for n in text.split(',') if n.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочные измерения схемы library')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('run', help='загрузить данные и измерить нагрузки')
+    p.add_argument('--dsn', help='сервер для баз прогона (по умолчанию — временный кластер)')
+    p.add_argument('--pg-bin', help='каталог initdb и pg_ctl для временного кластера')
+    p.add_argument('--locale', default='C.UTF-8', help='локаль временного кластера')
+    p.add_argument('--scales', default='small',
+                   help=f'масштабы через запятую из {", ".join(SCALES)}')
+    p.add_argument('--clients', type=int_list, default=[1, 4, 16],
+                   help='число клиентов на шагах, через запятую')
+    p.add_argument('--duration', type=float, default=10.0, help='длительность шага, с')
+    p.add_argument('--workloads', help='только эти нагрузки, через запятую (например view:v_active_loans)')
+    p.add_argument('--jobs', type=int, default=4, help='соединений для сборки индексов')
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--keep', action='store_true', help='не удалять базы прогона')
+    p.add_argument('-o', '--output', default='bench_results.json')
+
+    p = commands.add_parser('compare', help='сравнить два прогона')
+    p.add_argument('before')
+    p.add_argument('after')
+    p.add_argument('--threshold', type=float, default=10.0,
+                   help='допустимое ухудшение оп/с и p95, %%')
+
+    args = parser.parse_args(argv)
+    if args.command == 'compare':
+        raise SystemExit(compare(args))
+
+    args.scales = [s.strip() for s in args.scales.split(',') if s.strip()]
+    unknown = set(args.scales) - set(SCALES)
+    if unknown:
+        parser.error(f'неизвестные масштабы: {", ".join(sorted(unknown))}')
+    if not args.clients or min(args.clients) < 1:
+        parser.error('--clients: число клиентов должно быть положительным')
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
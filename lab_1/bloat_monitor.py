@@ -0,0 +1,402 @@
+# Мониторинг раздувания и HOT-обновлений таблиц и индексов схемы library
+#
+# Каждая выдача и возврат обновляют строку экземпляра в book_copies,
+# статус в loans и счетчики читателя в reader_loan_stats; books при этом
+# не переписывается. book_copies.loan_id и loans.status входят в
+# частичные индексы (idx_book_copies_free, idx_book_copies_loan,
+# idx_loans_status), поэтому такие обновления не могут быть HOT: каждое
+# оставляет мертвую версию строки и новые записи во всех индексах таблицы
+# (секции). Модуль снимает по каждой таблице (секции) и индексу library:
+#   dead         — мертвые и живые строки (pg_stat_user_tables);
+#   hot          — доля HOT среди обновлений;
+#   bloat        — оценка лишнего места по reltuples, средней ширине
+#                  строки из pg_stats и fillfactor (для индексов — только
+#                  btree);
+#   autovacuum   — порог запуска с учетом параметров таблицы, отношение
+#                  мертвых строк к порогу (больше 1 — автоочистка
+#                  отстает), время с последней очистки, возраст relfrozenxid.
+#
+#     python bloat_monitor.py sample --dsn "dbname=library_management" \
+#         --history bloat_history.jsonl --every 300 --count 12
+#     python bloat_monitor.py report bloat_history.jsonl --hours 24
+#     python bloat_monitor.py check --dsn "dbname=library_management" \
+#         --max-table-bloat 30 --max-index-bloat 50
+#
+# sample дописывает снимки строками JSON в файл истории (удобно для cron).
+# report сравнивает первый и последний снимок окна: смесь вставок,
+# обновлений и удалений, долю HOT, рост мертвых строк и оценок
+# раздувания — и предлагает fillfactor и параметры автоочистки для
+# таблиц с заметной нагрузкой (ALTER TABLE ... SET (...)). check делает
+# снимок и завершается с кодом 1, если раздувание или доля мертвых строк
+# превышает порог. Оценки приблизительны и опираются на ANALYZE: таблицы
+# без статистики в оценку раздувания не попадают.
+#
+# Требуется psycopg 3 (pip install psycopg).
+
+import argparse
+import datetime as dt
+import json
+import math
+import sys
+import time
+
+import psycopg
+from psycopg.rows import dict_row
+
+AUTOVACUUM_SETTINGS = ('autovacuum', 'autovacuum_vacuum_threshold',
+                       'autovacuum_vacuum_scale_factor', 'autovacuum_analyze_scale_factor',
+                       'autovacuum_freeze_max_age', 'block_size')
+
+TABLES = """
+SELECT c.relname, p.relname AS parent, c.relpages, c.reltuples,
+       COALESCE(c.reloptions, '{}') AS reloptions,
+       pg_relation_size(c.oid) AS bytes,
+       s.n_live_tup, s.n_dead_tup, s.n_tup_ins, s.n_tup_upd, s.n_tup_hot_upd, s.n_tup_del,
+       s.n_mod_since_analyze, s.vacuum_count, s.autovacuum_count,
+       s.last_vacuum::TEXT AS last_vacuum, s.last_autovacuum::TEXT AS last_autovacuum,
+       age(c.relfrozenxid) AS xid_age,
+       (SELECT sum((1 - st.null_frac) * st.avg_width)
+        FROM pg_stats st
+        WHERE st.schemaname = n.nspname AND st.tablename = c.relname) AS row_width
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_stat_user_tables s ON s.relid = c.oid
+LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+LEFT JOIN pg_class p ON p.oid = i.inhparent
+WHERE n.nspname = 'library' AND c.relkind = 'r'
+"""
+
+# Ширина ключа — сумма средних ширин столбцов индекса; для выражений
+# берется 8 байт
+INDEXES = """
+SELECT ci.relname, ct.relname AS table_name, am.amname AS method,
+       ci.relpages, ci.reltuples, COALESCE(ci.reloptions, '{}') AS reloptions,
+       pg_relation_size(ci.oid) AS bytes,
+       s.idx_scan,
+       (SELECT sum(COALESCE(st.avg_width, 8))
+        FROM unnest(i.indkey::SMALLINT[]) AS k(attnum)
+        LEFT JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+        LEFT JOIN pg_stats st ON st.schemaname = n.nspname AND st.tablename = ct.relname
+                             AND st.attname = a.attname) AS key_width,
+       (SELECT array_agg(a.attname ORDER BY a.attnum)
+        FROM pg_attribute a
+        WHERE a.attrelid = i.indrelid
+          AND (a.attnum = ANY (i.indkey)
+               OR pg_get_expr(i.indpred, i.indrelid) ~ ('\\m' || a.attname || '\\M')
+               OR pg_get_expr(i.indexprs, i.indrelid) ~ ('\\m' || a.attname || '\\M'))
+          AND a.attnum > 0 AND NOT a.attisdropped) AS columns
+FROM pg_index i
+JOIN pg_class ci ON ci.oid = i.indexrelid
+JOIN pg_class ct ON ct.oid = i.indrelid
+JOIN pg_namespace n ON n.oid = ct.relnamespace
+JOIN pg_am am ON am.oid = ci.relam
+LEFT JOIN pg_stat_user_indexes s ON s.indexrelid = i.indexrelid
+WHERE n.nspname = 'library' AND ci.relkind = 'i'
+"""
+
+# Размеры страницы и кортежей для оценки (байты)
+PAGE_HEADER = 24
+HEAP_TUPLE_HEADER = 24   # 23 байта заголовка, выровненные до 8
+INDEX_TUPLE_HEADER = 8
+BTREE_SPECIAL = 16
+LINE_POINTER = 4
+
+
+def maxalign(n):
+    return int(math.ceil(n / 8) * 8)
+
+
+def reloption(reloptions, name, default=None):
+    for item in reloptions:
+        key, _, value = item.partition('=')
+        if key == name:
+            return float(value)
+    return default
+
+
+# ---------------------------------------------------------------------
+# СНИМОК
+# ---------------------------------------------------------------------
+
+def estimate_bloat(bytes_, relpages, reltuples, width, header, usable, fillfactor, block):
+    """Лишние байты и их доля от размера по оценке минимального числа страниц."""
+    if width is None or reltuples < 0 or not relpages:
+        return None, None
+    tuple_bytes = header + maxalign(width) + LINE_POINTER
+    per_page = max(1, math.floor(usable * fillfactor / 100 / tuple_bytes))
+    expected = math.ceil(reltuples / per_page)
+    extra = max(0, relpages - expected) * block
+    return extra, round(extra / bytes_ * 100, 1) if bytes_ else 0.0
+
+
+def take_sample(conn):
+    conn.row_factory = dict_row
+    settings = {name: conn.execute('SELECT current_setting(%s) AS v', (name,)).fetchone()['v']
+                for name in AUTOVACUUM_SETTINGS}
+    block = int(settings['block_size'])
+    sample = {'taken_at': dt.datetime.now().isoformat(timespec='seconds'),
+              'database': conn.info.dbname, 'settings': settings, 'tables': {}, 'indexes': {}}
+
+    for row in conn.execute(TABLES):
+        name = row.pop('relname')
+        options = row['reloptions']
+        row['bloat_bytes'], row['bloat_percent'] = estimate_bloat(
+            row['bytes'], row['relpages'], row['reltuples'],
+            float(row['row_width']) if row['row_width'] is not None else None,
+            HEAP_TUPLE_HEADER, block - PAGE_HEADER, reloption(options, 'fillfactor', 100), block)
+        threshold = (reloption(options, 'autovacuum_vacuum_threshold',
+                               float(settings['autovacuum_vacuum_threshold']))
+                     + reloption(options, 'autovacuum_vacuum_scale_factor',
+                                 float(settings['autovacuum_vacuum_scale_factor']))
+                     * max(row['reltuples'], 0))
+        row['autovacuum_threshold'] = round(threshold)
+        row['autovacuum_lag'] = round(row['n_dead_tup'] / threshold, 2) if threshold else None
+        row['row_width'] = float(row['row_width']) if row['row_width'] is not None else None
+        sample['tables'][name] = row
+
+    for row in conn.execute(INDEXES):
+        name = row.pop('relname')
+        width = float(row.pop('key_width')) if row['key_width'] is not None else None
+        row['bloat_bytes'], row['bloat_percent'] = estimate_bloat(
+            row['bytes'], row['relpages'] - 1, row['reltuples'], width if row['method'] == 'btree'
+            else None, INDEX_TUPLE_HEADER, block - PAGE_HEADER - BTREE_SPECIAL,
+            reloption(row['reloptions'], 'fillfactor', 90), block)
+        sample['indexes'][name] = row
+    return sample
+
+
+def connect(dsn):
+    conn = psycopg.connect(dsn, autocommit=True)
+    conn.execute('SET search_path TO library, public')
+    return conn
+
+
+def read_history(path, hours=None):
+    with open(path, encoding='utf-8') as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+    if hours and samples:
+        last = dt.datetime.fromisoformat(samples[-1]['taken_at'])
+        since = last - dt.timedelta(hours=hours)
+        samples = [s for s in samples if dt.datetime.fromisoformat(s['taken_at']) >= since]
+    return samples
+
+
+# ---------------------------------------------------------------------
+# АНАЛИЗ И РЕКОМЕНДАЦИИ
+# ---------------------------------------------------------------------
+
+def counter_delta(first, last, key):
+    """Прирост счетчика; после сброса статистики берется значение целиком."""
+    before, after = first.get(key) or 0, last.get(key) or 0
+    return after - before if after >= before else after
+
+
+def table_activity(samples):
+    """Смесь операций и динамика по таблицам между первым и последним снимком."""
+    first, last = samples[0], samples[-1]
+    hours = max((dt.datetime.fromisoformat(last['taken_at'])
+                 - dt.datetime.fromisoformat(first['taken_at'])).total_seconds() / 3600, 0)
+    activity = {}
+    for name, t in last['tables'].items():
+        f = first['tables'].get(name, {})
+        ins, upd, hot, dele = (counter_delta(f, t, k) for k in
+                               ('n_tup_ins', 'n_tup_upd', 'n_tup_hot_upd', 'n_tup_del'))
+        writes = ins + upd + dele
+        activity[name] = {
+            'parent': t['parent'],
+            'hours': round(hours, 2),
+            'inserts': ins, 'updates': upd, 'hot_updates': hot, 'deletes': dele,
+            'update_share': round(upd / writes, 3) if writes else 0.0,
+            'hot_ratio': round(hot / upd, 3) if upd else None,
+            'autovacuums': counter_delta(f, t, 'autovacuum_count'),
+            'dead_max': max(s['tables'].get(name, {}).get('n_dead_tup') or 0 for s in samples),
+            'lag_max': max((s['tables'].get(name, {}).get('autovacuum_lag') or 0) for s in samples),
+            'bloat_first': f.get('bloat_percent'),
+            'bloat_last': t['bloat_percent'],
+            'reltuples': t['reltuples'],
+            'fillfactor': reloption(t['reloptions'], 'fillfactor', 100),
+        }
+    return activity
+
+
+def recommend(name, a, indexes, settings, min_updates):
+    """Параметры таблицы по наблюдаемой нагрузке: (параметры, пояснения)."""
+    params, notes = {}, []
+    if a['updates'] < min_updates:
+        return params, notes
+
+    # Место под HOT-версии на той же странице: чем больше доля обновлений
+    # и меньше HOT, тем ниже fillfactor
+    if a['hot_ratio'] is not None and a['hot_ratio'] < 0.9 and a['update_share'] >= 0.2:
+        target = 90 if a['update_share'] < 0.5 else (85 if a['update_share'] < 0.8 else 75)
+        if target < a['fillfactor']:
+            params['fillfactor'] = target
+        elif a['fillfactor'] < 100:
+            notes.append(f'fillfactor уже {a["fillfactor"]:.0f}, HOT {a["hot_ratio"]:.0%}: '
+                         'обновления, вероятно, меняют индексированные столбцы')
+        indexed = sorted({c for i in indexes.values() if i['table_name'] == name
+                          for c in (i['columns'] or [])})
+        if indexed:
+            notes.append('HOT невозможен при изменении столбцов индексов: ' + ', '.join(indexed))
+
+    # Автоочистка примерно раз в 15 минут нагрузки: порог — мертвые
+    # строки (обновления и удаления) за четверть часа
+    if a['hours'] > 0 and a['reltuples'] > 0:
+        churn = (a['updates'] + a['deletes']) / a['hours'] / 4
+        scale = min(0.2, max(0.005, churn / a['reltuples']))
+        current = float(settings['autovacuum_vacuum_scale_factor'])
+        if a['lag_max'] > 1 or scale < current / 2:
+            params['autovacuum_vacuum_scale_factor'] = round(scale, 3)
+            params['autovacuum_analyze_scale_factor'] = round(min(0.1, scale * 2), 3)
+            params['autovacuum_vacuum_threshold'] = 1000
+        if a['lag_max'] > 1:
+            notes.append(f'мертвые строки превышали порог автоочистки в {a["lag_max"]:.1f} раза')
+    if a['parent']:
+        notes.append(f'секция {a["parent"]}: новые секции create_loan_partitions '
+                     'создает без этих параметров')
+    return params, notes
+
+
+def build_report(samples, min_updates):
+    last = samples[-1]
+    activity = table_activity(samples)
+    recommendations = {}
+    for name, a in activity.items():
+        params, notes = recommend(name, a, last['indexes'], last['settings'], min_updates)
+        if params or notes:
+            recommendations[name] = {'params': params, 'notes': notes}
+    return {
+        'from': samples[0]['taken_at'], 'to': last['taken_at'], 'samples': len(samples),
+        'tables': activity,
+        'indexes': {name: {k: i[k] for k in ('table_name', 'method', 'bytes', 'bloat_percent',
+                                              'idx_scan')}
+                    for name, i in last['indexes'].items()},
+        'recommendations': recommendations,
+    }
+
+
+def print_report(report, top):
+    print(f'Окно: {report["from"]} — {report["to"]}, снимков {report["samples"]}\n')
+    print(f'{"таблица":<28} {"вставок":>9} {"обновл.":>9} {"удал.":>8} {"HOT":>6} '
+          f'{"мертвых max":>11} {"лаг max":>7} {"раздув., %":>14} {"AV":>4}')
+    tables = sorted(report['tables'].items(),
+                    key=lambda kv: kv[1]['updates'] + kv[1]['deletes'], reverse=True)
+    for name, a in tables[:top]:
+        hot = f'{a["hot_ratio"]:.0%}' if a['hot_ratio'] is not None else '—'
+        bloat = (f'{a["bloat_first"] if a["bloat_first"] is not None else "—"}'
+                 f'→{a["bloat_last"] if a["bloat_last"] is not None else "—"}')
+        print(f'{name:<28} {a["inserts"]:>9} {a["updates"]:>9} {a["deletes"]:>8} {hot:>6} '
+              f'{a["dead_max"]:>11} {a["lag_max"]:>7.2f} {bloat:>14} {a["autovacuums"]:>4}')
+
+    print(f'\n{"индекс":<40} {"таблица":<24} {"МБ":>8} {"раздув., %":>10} {"сканов":>10}')
+    indexes = sorted(report['indexes'].items(), key=lambda kv: kv[1]['bytes'], reverse=True)
+    for name, i in indexes[:top]:
+        bloat = f'{i["bloat_percent"]:.1f}' if i['bloat_percent'] is not None else '—'
+        print(f'{name:<40} {i["table_name"]:<24} {i["bytes"] / 2**20:>8.1f} {bloat:>10} '
+              f'{i["idx_scan"] or 0:>10}')
+
+    if report['recommendations']:
+        print('\nРекомендации:')
+    for name, r in report['recommendations'].items():
+        if r['params']:
+            options = ', '.join(f'{k} = {v}' for k, v in r['params'].items())
+            print(f'  ALTER TABLE library.{name} SET ({options});')
+        for note in r['notes']:
+            print(f'    -- {name}: {note}')
+
+
+# ---------------------------------------------------------------------
+# КОМАНДЫ
+# ---------------------------------------------------------------------
+
+def sample(args):
+    for n in range(args.count):
+        if n:
+            time.sleep(args.every)
+        with connect(args.dsn) as conn:
+            snapshot = take_sample(conn)
+        with open(args.history, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(snapshot, ensure_ascii=False) + '\n')
+        print(f'✓ Снимок {snapshot["taken_at"]}: таблиц {len(snapshot["tables"])}, '
+              f'индексов {len(snapshot["indexes"])} → {args.history}', file=sys.stderr)
+
+
+def report(args):
+    samples = read_history(args.history, args.hours)
+    if len(samples) < 2:
+        print(f'✗ В {args.history} меньше двух снимков за окно', file=sys.stderr)
+        return 1
+    result = build_report(samples, args.min_updates)
+    print_report(result, args.top)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f'\n✓ Отчет: {args.output}', file=sys.stderr)
+    return 0
+
+
+def check(args):
+    """Код выхода 1, если таблица или индекс больше --min-mb превышает порог."""
+    with connect(args.dsn) as conn:
+        snapshot = take_sample(conn)
+    failures = []
+    min_bytes = args.min_mb * 2**20
+    for name, t in snapshot['tables'].items():
+        if t['bytes'] < min_bytes:
+            continue
+        if t['bloat_percent'] is not None and t['bloat_percent'] > args.max_table_bloat:
+            failures.append(f'таблица {name}: раздувание {t["bloat_percent"]:.1f}%')
+        live_dead = t['n_live_tup'] + t['n_dead_tup']
+        dead = t['n_dead_tup'] / live_dead * 100 if live_dead else 0.0
+        if dead > args.max_dead:
+            failures.append(f'таблица {name}: мертвых строк {dead:.1f}%')
+    for name, i in snapshot['indexes'].items():
+        if i['bytes'] >= min_bytes and i['bloat_percent'] is not None \
+                and i['bloat_percent'] > args.max_index_bloat:
+            failures.append(f'индекс {name}: раздувание {i["bloat_percent"]:.1f}%')
+    for failure in failures:
+        print(f'✗ {failure}')
+    if not failures:
+        print(f'✓ Таблиц {len(snapshot["tables"])}, индексов {len(snapshot["indexes"])}: '
+              'пороги не превышены')
+    return 1 if failures else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Раздувание и HOT-обновления схемы library')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('sample', help='дописать снимок в файл истории')
+    p.add_argument('--dsn', required=True)
+    p.add_argument('--history', default='bloat_history.jsonl')
+    p.add_argument('--every', type=float, default=300.0, help='пауза между снимками, с')
+    p.add_argument('--count', type=int, default=1, help='число снимков')
+
+    p = commands.add_parser('report', help='нагрузка и рекомендации по истории')
+    p.add_argument('history')
+    p.add_argument('--hours', type=float, help='окно от последнего снимка, ч')
+    p.add_argument('--min-updates', type=int, default=1000,
+                   help='меньше обновлений и удалений — без рекомендаций')
+    p.add_argument('--top', type=int, default=20, help='строк в каждом разделе')
+    p.add_argument('-o', '--output', help='сохранить отчет в JSON')
+
+    p = commands.add_parser('check', help='проверка порогов раздувания')
+    p.add_argument('--dsn', required=True)
+    p.add_argument('--max-table-bloat', type=float, default=30.0, help='порог для таблиц, %%')
+    p.add_argument('--max-index-bloat', type=float, default=50.0, help='порог для индексов, %%')
+    p.add_argument('--max-dead', type=float, default=20.0, help='порог мертвых строк, %%')
+    p.add_argument('--min-mb', type=float, default=8.0, help='меньшие объекты не проверяются')
+
+    args = parser.parse_args(argv)
+    if args.command == 'sample':
+        if args.count < 1 or args.every < 0:
+            parser.error('--count должен быть положительным, --every — неотрицательным')
+        sample(args)
+    elif args.command == 'report':
+        raise SystemExit(report(args))
+    else:
+        raise SystemExit(check(args))
+
+
+if __name__ == '__main__':
+    main()
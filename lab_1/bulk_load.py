@@ -0,0 +1,163 @@
+# Массовая загрузка схемы library в режиме "данные сначала"
+#
+# Выполняет фазы, которые script_1.py пишет в library_bulk_load_*.sql:
+#   1. schema      — таблицы без индексов, внешних ключей и триггеров;
+#   2. data        — COPY данных из data_generator.py (или пропуск, если
+#                    данные загружены отдельно: psql < выгрузка.sql);
+#   3. post-load   — экземпляры book_copies и производные таблицы одним
+#                    проходом;
+#   4. indexes     — индексы параллельно в нескольких соединениях;
+#   5. constraints — внешние ключи, триггеры, ANALYZE.
+#
+# Пример:
+#     python bulk_load.py --dsn "dbname=library_management" \
+#         --readers 1000000 --loans 20000000 --jobs 4
+#
+# Требуется psycopg 3 (pip install psycopg).
+
+import argparse
+import queue
+import re
+import sys
+import threading
+import time
+
+import psycopg
+
+import data_generator
+import script_1
+
+PHASES = ('schema', 'data', 'post-load', 'indexes', 'constraints')
+
+# Размер пачки строк, передаваемой в COPY за один вызов write()
+COPY_BATCH_LINES = 5000
+
+
+def run_script(dsn, sql):
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute(sql)
+
+
+def copy_generated_data(dsn, config):
+    """Фаза 2: потоковый COPY сгенерированных строк, память не растет."""
+    generator = data_generator.LibraryDataGenerator(config)
+    counts = {}
+    with psycopg.connect(dsn) as conn:
+        conn.execute('SET search_path TO library, public')
+        conn.execute(config.partitions_sql())
+        with conn.cursor() as cur:
+            for table, columns, rows in generator.tables():
+                n = 0
+                with cur.copy(f'COPY {table} ({", ".join(columns)}) FROM STDIN') as copy:
+                    batch = []
+                    for row in rows:
+                        batch.append(row if isinstance(row, str) else data_generator.copy_line(row))
+                        if len(batch) >= COPY_BATCH_LINES:
+                            copy.write(''.join(batch))
+                            n += len(batch)
+                            batch.clear()
+                    if batch:
+                        copy.write(''.join(batch))
+                        n += len(batch)
+                counts[table] = n
+                print(f'  {table}: {n} строк', file=sys.stderr)
+    return counts
+
+
+def index_table(statement):
+    match = re.search(r'\bON\s+(\w+)', statement)
+    return match.group(1) if match else None
+
+
+def build_indexes(dsn, statements, jobs, maintenance_work_mem):
+    """Фаза 4: каждое соединение берет следующий индекс из общей очереди.
+
+    Индексы самых больших таблиц запускаются первыми, чтобы самая долгая
+    сборка не оказалась в хвосте.
+    """
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        # Размер секционированной таблицы — сумма ее секций
+        sizes = dict(conn.execute(
+            "SELECT c.relname, (SELECT SUM(pg_relation_size(t.relid)) "
+            "                   FROM pg_partition_tree(c.oid) t) "
+            "FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE n.nspname = 'library' AND c.relkind IN ('r', 'p') "
+            "AND NOT c.relispartition").fetchall())
+    pending = queue.Queue()
+    for statement in sorted(statements, key=lambda s: sizes.get(index_table(s), 0), reverse=True):
+        pending.put(statement)
+
+    errors = []
+
+    def worker():
+        with psycopg.connect(dsn, autocommit=True) as conn:
+            conn.execute('SET search_path TO library, public')
+            conn.execute(f"SET maintenance_work_mem = '{maintenance_work_mem}'")
+            while True:
+                try:
+                    statement = pending.get_nowait()
+                except queue.Empty:
+                    return
+                started = time.perf_counter()
+                try:
+                    conn.execute(statement)
+                except psycopg.Error as e:
+                    errors.append((statement, e))
+                    continue
+                print(f'  {time.perf_counter() - started:8.1f} с  {statement}', file=sys.stderr)
+
+    threads = [threading.Thread(target=worker) for _ in range(max(1, jobs))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        for statement, e in errors:
+            print(f'Ошибка: {statement}\n  {e}', file=sys.stderr)
+        raise SystemExit(1)
+
+
+def run_phases(dsn, phases, config, jobs=4, maintenance_work_mem='512MB'):
+    """Выполняет выбранные фазы по порядку PHASES (config — для фазы data)."""
+    scripts = script_1.bulk_load_scripts
+    for phase in PHASES:
+        if phase not in phases:
+            continue
+        print(f'=== Фаза: {phase} ===', file=sys.stderr)
+        started = time.perf_counter()
+        if phase == 'schema':
+            run_script(dsn, scripts['library_bulk_load_1_schema.sql'])
+        elif phase == 'data':
+            copy_generated_data(dsn, config)
+        elif phase == 'post-load':
+            run_script(dsn, scripts['library_bulk_load_3_post_load.sql'])
+        elif phase == 'indexes':
+            build_indexes(dsn, script_1.sql_statements(script_1.INDEXES_SQL),
+                          jobs, maintenance_work_mem)
+        elif phase == 'constraints':
+            run_script(dsn, scripts['library_bulk_load_5_constraints.sql'])
+        print(f'✓ {phase}: {time.perf_counter() - started:.1f} с', file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Массовая загрузка схемы library')
+    parser.add_argument('--dsn', required=True, help='строка подключения PostgreSQL')
+    parser.add_argument('--phases', default=','.join(PHASES),
+                        help=f'фазы через запятую из {", ".join(PHASES)}')
+    parser.add_argument('--jobs', type=int, default=4,
+                        help='число соединений для параллельной сборки индексов')
+    parser.add_argument('--maintenance-work-mem', default='512MB')
+    data_generator.add_generator_arguments(parser)
+    args = parser.parse_args(argv)
+    data_generator.check_generator_arguments(parser, args)
+    phases = [p.strip() for p in args.phases.split(',') if p.strip()]
+    unknown = set(phases) - set(PHASES)
+    if unknown:
+        parser.error(f'неизвестные фазы: {", ".join(sorted(unknown))}')
+
+    run_phases(args.dsn, phases, data_generator.config_from_args(args),
+               args.jobs, args.maintenance_work_mem)
+
+
+if __name__ == '__main__':
+    main()
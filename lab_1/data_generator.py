@@ -0,0 +1,599 @@
+# Генератор синтетических данных для схемы library
+#
+# Заполняет таблицы categories, readers, authors, books, book_authors, loans
+# и fines заданным количеством строк. Вывод — psql-скрипт с блоками
+# COPY ... FROM STDIN, который передается в psql через конвейер:
+#
+#     python data_generator.py --readers 1000000 --loans 10000000 \
+#         | psql -d library_management
+#
+# Особенности:
+# - популярность книг подчиняется закону Ципфа (параметр --zipf);
+# - выдачи распределены по дням с сезонными пиками (начало семестров,
+#   сессии, летний спад) и недельным циклом;
+# - доля просрочек зависит от reader_type;
+# - соблюдаются все CHECK и FOREIGN KEY схемы из script_1.py;
+# - при одинаковых --seed и --as-of результат побайтно совпадает;
+# - строки генерируются и пишутся потоком: память занимают только
+#   массивы по книгам и читателям, но не выдачи.
+
+import argparse
+import array
+import datetime as dt
+import itertools
+import math
+import random
+import sys
+import tempfile
+from dataclasses import dataclass, field
+
+from script_1 import POST_LOAD_SQL
+
+# ---------------------------------------------------------------------
+# СПРАВОЧНЫЕ ДАННЫЕ
+# ---------------------------------------------------------------------
+
+# Категории совпадают с тестовыми данными script_1.py (category_id 1..7)
+CATEGORIES = [
+    ('Художественная литература', 'Романы, повести, рассказы, поэзия'),
+    ('Научная литература', 'Научные труды, исследования, монографии'),
+    ('Техническая литература', 'Технические справочники, руководства'),
+    ('Учебная литература', 'Учебники, учебные пособия, методички'),
+    ('Справочная литература', 'Энциклопедии, словари, справочники'),
+    ('Детская литература', 'Книги для детей и подростков'),
+    ('Медицинская литература', 'Медицинские справочники и учебники'),
+]
+CATEGORY_WEIGHTS = [30, 12, 14, 26, 6, 7, 5]
+
+READER_TYPES = ['студент', 'преподаватель', 'сотрудник']
+READER_TYPE_WEIGHTS = [80, 8, 12]
+
+# Сроки выдачи — те же, что в функции calculate_due_date
+LOAN_PERIOD_DAYS = {'студент': 14, 'преподаватель': 30, 'сотрудник': 21}
+
+# Доля выдач, возвращаемых с опозданием, и средняя длительность опоздания
+OVERDUE_RATE = {'студент': 0.16, 'преподаватель': 0.05, 'сотрудник': 0.08}
+MEAN_DAYS_LATE = {'студент': 9.0, 'преподаватель': 6.0, 'сотрудник': 7.0}
+
+# Доля утерянных среди выдач, просроченных более чем на 30 дней
+LOST_RATE = 0.02
+FINE_PAID_RATE = 0.85
+FINE_PER_DAY = 10   # как в calculate_overdue_fine
+MAX_FINE = 1000
+
+# Сезонность выдач по месяцам (1 = среднее значение)
+MONTH_FACTOR = {
+    1: 0.9, 2: 1.4, 3: 1.2, 4: 1.0, 5: 1.0, 6: 0.8,
+    7: 0.35, 8: 0.5, 9: 1.8, 10: 1.3, 11: 1.1, 12: 1.0,
+}
+# Недельный цикл: пн..вс
+WEEKDAY_FACTOR = [1.15, 1.1, 1.1, 1.05, 1.0, 0.55, 0.25]
+
+MALE_LAST_NAMES = [
+    'Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов',
+    'Лебедев', 'Козлов', 'Новиков', 'Морозов', 'Волков', 'Соловьев', 'Васильев',
+    'Зайцев', 'Павлов', 'Семенов', 'Голубев', 'Виноградов', 'Богданов',
+    'Воробьев', 'Федоров', 'Михайлов', 'Беляев', 'Тарасов', 'Белов', 'Комаров',
+    'Орлов', 'Киселев', 'Макаров', 'Андреев', 'Ковалев', 'Ильин', 'Гусев',
+    'Титов', 'Кузьмин', 'Кудрявцев', 'Баранов', 'Куликов', 'Алексеев',
+    'Степанов', 'Яковлев', 'Сорокин', 'Сергеев', 'Романов', 'Захаров',
+    'Борисов', 'Королев', 'Герасимов', 'Пономарев', 'Григорьев', 'Лазарев',
+    'Медведев', 'Ершов', 'Никитин', 'Соболев', 'Рябов', 'Поляков', 'Цветков',
+    'Данилов', 'Жуков', 'Фролов', 'Журавлев', 'Николаев', 'Крылов', 'Максимов',
+    'Осипов', 'Белоусов', 'Федотов', 'Дорофеев', 'Егоров', 'Матвеев', 'Бобров',
+    'Дмитриев', 'Калинин', 'Анисимов', 'Петухов', 'Антонов', 'Тимофеев',
+    'Никифоров', 'Веселов', 'Филиппов', 'Марков', 'Большаков', 'Суханов',
+    'Миронов', 'Ширяев', 'Александров', 'Коновалов', 'Шестаков', 'Казаков',
+    'Ефимов', 'Денисов', 'Громов', 'Фомин', 'Давыдов', 'Мельников', 'Щербаков',
+    'Блинов', 'Колесников', 'Карпов', 'Афанасьев', 'Власов', 'Маслов',
+    'Исаков', 'Тихонов', 'Аксенов', 'Гаврилов', 'Родионов', 'Котов', 'Горбунов',
+    'Кудряшов', 'Быков', 'Зуев', 'Третьяков', 'Савельев', 'Панов', 'Рыбаков',
+    'Суворов', 'Абрамов', 'Воронов', 'Мухин', 'Архипов', 'Трофимов', 'Мартынов',
+    'Емельянов', 'Горшков', 'Чернов', 'Овчинников', 'Селезнев', 'Панфилов',
+    'Копылов', 'Михеев', 'Галкин', 'Назаров', 'Лобанов', 'Лукин', 'Беляков',
+    'Потапов', 'Некрасов', 'Хохлов', 'Жданов', 'Наумов', 'Шилов', 'Воронцов',
+    'Ермаков', 'Дроздов', 'Игнатьев', 'Савин', 'Логинов', 'Сафонов', 'Капустин',
+    'Кириллов', 'Моисеев', 'Елисеев', 'Кошелев', 'Костин', 'Горбачев', 'Орехов',
+    'Ефремов', 'Исаев', 'Евдокимов', 'Калашников', 'Кабанов', 'Носков',
+    'Юдин', 'Кулагин', 'Лапин', 'Прохоров', 'Нестеров', 'Харитонов', 'Агафонов',
+    'Муравьев', 'Ларионов', 'Федосеев', 'Зимин', 'Пахомов', 'Шубин', 'Игнатов',
+    'Филатов', 'Крюков', 'Рогов', 'Кулаков', 'Терентьев', 'Молчанов',
+    'Владимиров', 'Артемьев', 'Гурьев', 'Зиновьев', 'Гришин', 'Кононов',
+    'Дементьев', 'Ситников', 'Симонов', 'Мишин', 'Фадеев', 'Комиссаров',
+    'Мамонтов', 'Носов', 'Гуляев', 'Шаров', 'Устинов', 'Вишняков', 'Евсеев',
+    'Лаврентьев', 'Брагин', 'Константинов', 'Корнилов', 'Авдеев', 'Зыков',
+    'Бирюков', 'Шарапов', 'Никонов', 'Щукин', 'Дьячков', 'Одинцов', 'Сазонов',
+    'Якушев', 'Красильников', 'Гордеев', 'Самойлов', 'Князев', 'Беспалов',
+    'Уваров', 'Шашков', 'Бобылев', 'Доронин', 'Белозеров', 'Рожков', 'Самсонов',
+    'Мясников', 'Лихачев', 'Буров', 'Сысоев', 'Фомичев', 'Русаков', 'Стрелков',
+    'Гущин', 'Тетерин', 'Колобов', 'Субботин', 'Фокин', 'Блохин', 'Селиверстов',
+    'Пестов', 'Кондратьев', 'Силин', 'Меркушев', 'Лыткин', 'Туров',
+]
+MALE_FIRST_NAMES = [
+    'Александр', 'Алексей', 'Андрей', 'Антон', 'Артем', 'Борис', 'Вадим',
+    'Валентин', 'Валерий', 'Василий', 'Виктор', 'Виталий', 'Владимир',
+    'Владислав', 'Вячеслав', 'Геннадий', 'Георгий', 'Глеб', 'Григорий',
+    'Даниил', 'Денис', 'Дмитрий', 'Евгений', 'Егор', 'Иван', 'Игорь', 'Илья',
+    'Кирилл', 'Константин', 'Лев', 'Леонид', 'Максим', 'Матвей', 'Михаил',
+    'Никита', 'Николай', 'Олег', 'Павел', 'Петр', 'Роман', 'Руслан', 'Семен',
+    'Сергей', 'Станислав', 'Степан', 'Тимофей', 'Федор', 'Юрий', 'Ярослав',
+]
+FEMALE_FIRST_NAMES = [
+    'Алевтина', 'Алина', 'Алла', 'Анастасия', 'Анна', 'Валентина', 'Валерия',
+    'Вера', 'Виктория', 'Галина', 'Дарья', 'Диана', 'Евгения', 'Екатерина',
+    'Елена', 'Елизавета', 'Жанна', 'Зоя', 'Ирина', 'Карина', 'Кира', 'Ксения',
+    'Лариса', 'Любовь', 'Людмила', 'Маргарита', 'Марина', 'Мария', 'Надежда',
+    'Наталья', 'Нина', 'Оксана', 'Ольга', 'Полина', 'Светлана', 'София',
+    'Тамара', 'Татьяна', 'Ульяна', 'Юлия', 'Яна',
+]
+# Основы отчеств: 'Сергее' + 'вич'/'вна'
+PATRONYMIC_STEMS = [
+    'Александро', 'Алексее', 'Андрее', 'Антоно', 'Борисо', 'Валерье',
+    'Василье', 'Викторо', 'Владимиро', 'Геннадье', 'Георгие', 'Григорье',
+    'Дмитрие', 'Евгенье', 'Ивано', 'Игоре', 'Константино', 'Леонидо',
+    'Максимо', 'Михайло', 'Николае', 'Олего', 'Павло', 'Петро', 'Романо',
+    'Сергее', 'Степано', 'Федоро', 'Юрье',
+]
+
+AUTHOR_COUNTRIES = ['Россия', 'США', 'Великобритания', 'Германия', 'Франция',
+                    'Италия', 'Испания', 'Япония', 'Польша', 'Чехия']
+AUTHOR_COUNTRY_WEIGHTS = [55, 12, 9, 7, 6, 3, 2, 2, 2, 2]
+
+AUTHOR_ROLES = ['автор', 'соавтор', 'переводчик', 'редактор']
+
+TITLE_ADJECTIVES = [
+    'Тихий', 'Последний', 'Новый', 'Старый', 'Северный', 'Белый', 'Красный',
+    'Забытый', 'Далекий', 'Вечный', 'Первый', 'Тайный', 'Золотой', 'Ночной',
+    'Осенний', 'Весенний', 'Горький', 'Светлый', 'Одинокий', 'Большой',
+]
+TITLE_NOUNS = [
+    'дом', 'сад', 'берег', 'город', 'путь', 'ветер', 'огонь', 'лес', 'мост',
+    'остров', 'сон', 'свет', 'век', 'мир', 'голос', 'снег', 'океан', 'день',
+    'порт', 'перевал',
+]
+SUBJECTS = [
+    'математического анализа', 'линейной алгебры', 'программирования',
+    'баз данных', 'теории вероятностей', 'физики', 'химии', 'экономики',
+    'философии', 'истории', 'биологии', 'механики', 'электротехники',
+    'операционных систем', 'компьютерных сетей', 'анатомии', 'фармакологии',
+    'психологии', 'социологии', 'лингвистики',
+]
+TEXTBOOK_PREFIXES = ['Основы', 'Курс', 'Задачник по курсу', 'Практикум',
+                     'Введение в теорию', 'Справочник']
+
+TRANSLIT = dict(zip(
+    'абвгдеёжзийклмнопрстуфхцчшщъыьэюя',
+    ['a', 'b', 'v', 'g', 'd', 'e', 'e', 'zh', 'z', 'i', 'y', 'k', 'l', 'm',
+     'n', 'o', 'p', 'r', 's', 't', 'u', 'f', 'kh', 'ts', 'ch', 'sh', 'sch',
+     '', 'y', '', 'e', 'yu', 'ya'],
+))
+
+
+# ---------------------------------------------------------------------
+# ПАРАМЕТРЫ И ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
+# ---------------------------------------------------------------------
+
+@dataclass
+class GeneratorConfig:
+    """Объемы данных и параметры распределений."""
+    readers: int = 10_000
+    authors: int = 2_000
+    books: int = 20_000
+    loans: int = 100_000
+    seed: int = 42
+    as_of: dt.date = field(default_factory=dt.date.today)
+    history_days: int = 3 * 365
+    zipf_s: float = 1.07
+
+    @property
+    def start_date(self):
+        return self.as_of - dt.timedelta(days=self.history_days)
+
+    def partitions_sql(self):
+        """Вызов, создающий месячные секции loans под весь период выдач."""
+        return f"CALL create_loan_partitions(DATE '{self.start_date}', DATE '{self.as_of}');\n"
+
+
+def translit(text):
+    return ''.join(TRANSLIT.get(ch, ch) for ch in text.lower())
+
+
+def female_last_name(last_name):
+    """Женская форма фамилии: Иванов -> Иванова, Ильин -> Ильина."""
+    if last_name.endswith(('ов', 'ев', 'ин', 'ын')):
+        return last_name + 'а'
+    if last_name.endswith('ский'):
+        return last_name[:-2] + 'ая'
+    return last_name
+
+
+def random_person(rng):
+    """Фамилия, имя, отчество (отчество иногда отсутствует)."""
+    last_name = rng.choice(MALE_LAST_NAMES)
+    stem = rng.choice(PATRONYMIC_STEMS)
+    if rng.random() < 0.5:
+        first_name = rng.choice(MALE_FIRST_NAMES)
+        middle_name = stem + 'вич'
+    else:
+        last_name = female_last_name(last_name)
+        first_name = rng.choice(FEMALE_FIRST_NAMES)
+        middle_name = stem + 'вна'
+    if rng.random() < 0.03:
+        middle_name = None
+    return last_name, first_name, middle_name
+
+
+def zipf_cum_weights(n, s):
+    """Накопленные веса распределения Ципфа для рангов 1..n."""
+    return list(itertools.accumulate(1.0 / (rank ** s) for rank in range(1, n + 1)))
+
+
+def coprime_stride(n, rng):
+    """Шаг, взаимно простой с n: перемешивает ранги популярности по book_id."""
+    if n <= 2:
+        return 1
+    while True:
+        stride = rng.randrange(n // 3, n)
+        if math.gcd(stride, n) == 1:
+            return stride
+
+
+def isbn13(book_id):
+    digits = '9785' + f'{book_id:08d}'
+    total = sum(int(d) * (1 if i % 2 == 0 else 3) for i, d in enumerate(digits))
+    check = (10 - total % 10) % 10
+    return f'978-5-{digits[4:8]}-{digits[8:]}-{check}'
+
+
+def daily_loan_counts(config):
+    """Распределяет config.loans выдач по дням с учетом сезонности.
+
+    Возвращает список (дата, количество); сумма количеств ровно равна
+    config.loans (метод наибольших остатков).
+    """
+    days = [config.start_date + dt.timedelta(days=i) for i in range(config.history_days + 1)]
+    weights = []
+    for day in days:
+        w = MONTH_FACTOR[day.month] * WEEKDAY_FACTOR[day.weekday()]
+        # Пик первых двух недель семестра
+        if (day.month == 9 and day.day <= 14) or (day.month == 2 and 7 <= day.day <= 21):
+            w *= 1.8
+        weights.append(w)
+    total_weight = sum(weights)
+    exact = [config.loans * w / total_weight for w in weights]
+    counts = [int(x) for x in exact]
+    remainder = config.loans - sum(counts)
+    by_fraction = sorted(range(len(days)), key=lambda i: exact[i] - counts[i], reverse=True)
+    for i in by_fraction[:remainder]:
+        counts[i] += 1
+    return list(zip(days, counts))
+
+
+def copy_value(value):
+    """Значение в текстовом формате COPY."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    text = str(value)
+    if any(ch in text for ch in '\\\t\n\r'):
+        text = (text.replace('\\', '\\\\').replace('\t', '\\t')
+                    .replace('\n', '\\n').replace('\r', '\\r'))
+    return text
+
+
+def copy_line(row):
+    return '\t'.join(copy_value(v) for v in row) + '\n'
+
+
+# ---------------------------------------------------------------------
+# ГЕНЕРАТОР
+# ---------------------------------------------------------------------
+
+class LibraryDataGenerator:
+    """Потоковый генератор строк для всех таблиц схемы library.
+
+    Таблицы выдаются методом tables() в порядке внешних ключей. Выдачи
+    генерируются в хронологическом порядке (loan_id растет вместе с
+    loan_date), штрафы накапливаются во временном файле и выдаются
+    последними, поэтому итераторы нужно потреблять строго по порядку.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        # Состояние, которое нужно выдачам: O(readers + books), не O(loans)
+        self.reader_types = bytearray(config.readers)
+        self.copies_total = array.array('H', bytes(2 * config.books))
+        self.copies_out = array.array('H', bytes(2 * config.books))
+        self.book_stride = coprime_stride(config.books, self.rng)
+        self.book_cum_weights = zipf_cum_weights(config.books, config.zipf_s)
+        self.fines_spool = None
+        self.fines_count = 0
+
+    def book_id_for_rank(self, rank):
+        """Книга с заданным рангом популярности (0 — самая популярная)."""
+        return (rank * self.book_stride) % self.config.books + 1
+
+    def tables(self):
+        """Кортежи (таблица, столбцы, итератор строк) в порядке загрузки."""
+        return [
+            ('categories', ('category_id', 'name', 'description'), self.categories()),
+            ('readers', ('reader_id', 'last_name', 'first_name', 'middle_name',
+                         'reader_type', 'phone', 'email', 'registration_date',
+                         'is_active'), self.readers()),
+            ('authors', ('author_id', 'last_name', 'first_name', 'middle_name',
+                         'birth_year', 'death_year', 'country', 'biography'),
+             self.authors()),
+            ('books', ('book_id', 'title', 'isbn', 'publication_year', 'pages',
+                       'copies_total', 'copies_available', 'category_id',
+                       'language'), self.books()),
+            ('book_authors', ('book_id', 'author_id', 'author_role'), self.book_authors()),
+            ('loans', ('loan_id', 'reader_id', 'book_id', 'loan_date', 'due_date',
+                       'return_date', 'status', 'librarian_id', 'notes'), self.loans()),
+            ('fines', ('fine_id', 'loan_id', 'loan_date', 'amount', 'fine_date',
+                       'paid_date', 'fine_type'), self.fines()),
+        ]
+
+    def categories(self):
+        for category_id, (name, description) in enumerate(CATEGORIES, start=1):
+            yield (category_id, name, description)
+
+    def readers(self):
+        rng = self.rng
+        earliest = self.config.start_date - dt.timedelta(days=4 * 365)
+        span = (self.config.start_date - earliest).days
+        for i in range(self.config.readers):
+            reader_id = i + 1
+            type_index = rng.choices(range(3), weights=READER_TYPE_WEIGHTS)[0]
+            self.reader_types[i] = type_index
+            last_name, first_name, middle_name = random_person(rng)
+            domain = 'student.edu' if type_index == 0 else 'university.edu'
+            email = f'{translit(first_name)[0]}.{translit(last_name)}{reader_id}@{domain}'
+            phone = f'+7-9{rng.randrange(10, 100)}-{rng.randrange(100, 1000)}-' \
+                    f'{rng.randrange(10, 100)}-{rng.randrange(10, 100)}'
+            registration_date = earliest + dt.timedelta(days=rng.randrange(span + 1))
+            is_active = rng.random() >= 0.03
+            yield (reader_id, last_name, first_name, middle_name, READER_TYPES[type_index],
+                   phone, email, registration_date, is_active)
+
+    def authors(self):
+        rng = self.rng
+        current_year = self.config.as_of.year
+        for author_id in range(1, self.config.authors + 1):
+            last_name, first_name, middle_name = random_person(rng)
+            birth_year = rng.randrange(1750, min(current_year - 20, 2000))
+            death_year = None
+            if birth_year < 1945 or rng.random() < 0.05:
+                death_year = min(birth_year + rng.randrange(30, 95), current_year)
+                if death_year <= birth_year:
+                    death_year = None
+            country = rng.choices(AUTHOR_COUNTRIES, weights=AUTHOR_COUNTRY_WEIGHTS)[0]
+            yield (author_id, last_name, first_name, middle_name, birth_year,
+                   death_year, country, None)
+
+    def books(self):
+        rng = self.rng
+        n = self.config.books
+        inverse_stride = pow(self.book_stride, -1, n) if n > 1 else 1
+        current_year = self.config.as_of.year
+        for book_id in range(1, n + 1):
+            rank = ((book_id - 1) * inverse_stride) % n
+            category_id = rng.choices(range(1, 8), weights=CATEGORY_WEIGHTS)[0]
+            if category_id in (2, 3, 4, 7):
+                title = f'{rng.choice(TEXTBOOK_PREFIXES)} {rng.choice(SUBJECTS)}'
+            else:
+                title = f'{rng.choice(TITLE_ADJECTIVES)} {rng.choice(TITLE_NOUNS)}'
+            if rng.random() < 0.3:
+                title += f'. Том {rng.randrange(1, 6)}'
+            # Популярные книги закупают большим тиражом
+            if rank < max(1, n // 100):
+                copies = rng.randrange(10, 31)
+            elif rank < max(1, n // 10):
+                copies = rng.randrange(3, 11)
+            else:
+                copies = rng.randrange(1, 4)
+            self.copies_total[book_id - 1] = copies
+            publication_year = rng.randrange(max(1000, current_year - 70), current_year + 1)
+            pages = rng.randrange(48, 1200)
+            language = 'русский' if rng.random() < 0.92 else 'английский'
+            # copies_available уточняется после загрузки выдач
+            yield (book_id, title, isbn13(book_id), publication_year, pages,
+                   copies, copies, category_id, language)
+
+    def book_authors(self):
+        rng = self.rng
+        author_ids = range(1, self.config.authors + 1)
+        author_weights = zipf_cum_weights(self.config.authors, 0.8)
+        for book_id in range(1, self.config.books + 1):
+            k = rng.choices((1, 2, 3), weights=(75, 18, 7))[0]
+            k = min(k, self.config.authors)
+            chosen = []
+            while len(chosen) < k:
+                author_id = rng.choices(author_ids, cum_weights=author_weights)[0]
+                if author_id not in chosen:
+                    chosen.append(author_id)
+            for position, author_id in enumerate(chosen):
+                if position == 0:
+                    role = 'автор'
+                else:
+                    role = rng.choices(AUTHOR_ROLES[1:], weights=(70, 20, 10))[0]
+                yield (book_id, author_id, role)
+
+    def loans(self):
+        config = self.config
+        rng = self.rng
+        as_of = config.as_of
+        ranks = range(config.books)
+        self.fines_spool = tempfile.TemporaryFile(mode='w+', encoding='utf-8')
+        self.fines_count = 0
+        loan_id = 0
+        for loan_date, count in daily_loan_counts(config):
+            if count == 0:
+                continue
+            book_ranks = rng.choices(ranks, cum_weights=self.book_cum_weights, k=count)
+            for rank in book_ranks:
+                loan_id += 1
+                reader_index = rng.randrange(config.readers)
+                reader_type = READER_TYPES[self.reader_types[reader_index]]
+                book_id = self.book_id_for_rank(rank)
+                yield self._loan(loan_id, reader_index + 1, reader_type, book_id, loan_date, as_of)
+
+    def _loan(self, loan_id, reader_id, reader_type, book_id, loan_date, as_of):
+        rng = self.rng
+        period = LOAN_PERIOD_DAYS[reader_type]
+        due_date = loan_date + dt.timedelta(days=period)
+        late = rng.random() < OVERDUE_RATE[reader_type]
+        if late:
+            days_late = 1 + int(rng.expovariate(1.0 / MEAN_DAYS_LATE[reader_type]))
+            planned_return = due_date + dt.timedelta(days=days_late)
+        else:
+            planned_return = loan_date + dt.timedelta(days=rng.randrange(1, period + 1))
+
+        if planned_return <= as_of:
+            status, return_date = 'возвращена', planned_return
+        else:
+            status, return_date = ('просрочена' if due_date < as_of else 'выдана'), None
+            if due_date + dt.timedelta(days=30) <= as_of and rng.random() < LOST_RATE:
+                status = 'утеряна'
+            # Невозвращенных экземпляров не больше, чем copies_total
+            book_index = book_id - 1
+            if self.copies_out[book_index] >= self.copies_total[book_index]:
+                status, return_date = 'возвращена', min(due_date, as_of)
+            else:
+                self.copies_out[book_index] += 1
+
+        if status == 'возвращена' and return_date > due_date:
+            days_late = (return_date - due_date).days
+            paid_date = None
+            if rng.random() < FINE_PAID_RATE:
+                paid_date = return_date + dt.timedelta(days=rng.randrange(0, 31))
+                if paid_date > as_of:
+                    paid_date = None
+            self._spool_fine(loan_id, loan_date, min(days_late * FINE_PER_DAY, MAX_FINE),
+                             return_date, paid_date, 'просрочка')
+        elif status == 'просрочена':
+            days_late = (as_of - due_date).days
+            self._spool_fine(loan_id, loan_date, min(days_late * FINE_PER_DAY, MAX_FINE),
+                             due_date + dt.timedelta(days=1), None, 'просрочка')
+        elif status == 'утеряна':
+            self._spool_fine(loan_id, loan_date, rng.randrange(500, 3001),
+                             due_date + dt.timedelta(days=30), None, 'утеря')
+
+        notes = 'Возвращена в срок' if status == 'возвращена' and return_date <= due_date else None
+        return (loan_id, reader_id, book_id, loan_date, due_date, return_date,
+                status, None, notes)
+
+    def _spool_fine(self, loan_id, loan_date, amount, fine_date, paid_date, fine_type):
+        self.fines_count += 1
+        self.fines_spool.write(copy_line(
+            (self.fines_count, loan_id, loan_date, f'{amount:.2f}', fine_date, paid_date, fine_type)))
+
+    def fines(self):
+        """Строки штрафов в формате COPY (уже закодированные)."""
+        if self.fines_spool is None:
+            raise RuntimeError('Штрафы доступны только после генерации выдач')
+        self.fines_spool.seek(0)
+        yield from self.fines_spool
+        self.fines_spool.close()
+        self.fines_spool = None
+
+
+# ---------------------------------------------------------------------
+# ВЫВОД В ФОРМАТЕ PSQL
+# ---------------------------------------------------------------------
+
+LOADED_TABLES = ('categories', 'readers', 'authors', 'books', 'book_authors', 'loans', 'fines')
+
+def write_psql_script(config, out, bare=False):
+    """Пишет в out psql-скрипт загрузки: TRUNCATE, COPY-блоки, пост-обработку.
+
+    При bare=True пишутся только COPY-блоки: так данные загружаются во
+    второй фазе режима массовой загрузки (library_bulk_load_*.sql), где
+    пересчет и триггеры выполняют следующие фазы.
+    """
+    generator = LibraryDataGenerator(config)
+    out.write(f'-- Синтетические данные: seed={config.seed}, as_of={config.as_of}, '
+              f'readers={config.readers}, books={config.books}, loans={config.loans}\n')
+    out.write('SET search_path TO library, public;\n')
+    out.write(config.partitions_sql())
+    if not bare:
+        out.write('BEGIN;\n')
+        out.write(f'TRUNCATE {", ".join(LOADED_TABLES)} RESTART IDENTITY CASCADE;\n')
+        # Пользовательские триггеры пересчитываются одним проходом после загрузки
+        for table in LOADED_TABLES:
+            out.write(f'ALTER TABLE {table} DISABLE TRIGGER USER;\n')
+
+    counts = {}
+    for table, columns, rows in generator.tables():
+        out.write(f'COPY {table} ({", ".join(columns)}) FROM STDIN;\n')
+        n = 0
+        for row in rows:
+            out.write(row if isinstance(row, str) else copy_line(row))
+            n += 1
+        out.write('\\.\n')
+        counts[table] = n
+
+    if not bare:
+        for table in LOADED_TABLES:
+            out.write(f'ALTER TABLE {table} ENABLE TRIGGER USER;\n')
+        out.write(POST_LOAD_SQL)
+        out.write('COMMIT;\n')
+        out.write('ANALYZE;\n')
+    return counts
+
+
+def add_generator_arguments(parser):
+    """Параметры генератора (используются также в bulk_load.py)."""
+    parser.add_argument('--readers', type=int, default=GeneratorConfig.readers)
+    parser.add_argument('--authors', type=int, default=GeneratorConfig.authors)
+    parser.add_argument('--books', type=int, default=GeneratorConfig.books)
+    parser.add_argument('--loans', type=int, default=GeneratorConfig.loans)
+    parser.add_argument('--seed', type=int, default=GeneratorConfig.seed)
+    parser.add_argument('--as-of', type=dt.date.fromisoformat, default=None,
+                        help='дата "сегодня" для статусов выдач (по умолчанию текущая)')
+    parser.add_argument('--history-days', type=int, default=GeneratorConfig.history_days,
+                        help='глубина истории выдач в днях')
+    parser.add_argument('--zipf', type=float, default=GeneratorConfig.zipf_s,
+                        help='показатель распределения Ципфа для популярности книг')
+
+
+def check_generator_arguments(parser, args):
+    if min(args.readers, args.authors, args.books) < 1 or args.loans < 0:
+        parser.error('количество читателей, авторов и книг должно быть положительным')
+    if args.as_of and args.as_of > dt.date.today():
+        parser.error('--as-of не может быть в будущем (CHECK по текущему году)')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Генератор синтетических данных для схемы library (psql COPY-скрипт)')
+    add_generator_arguments(parser)
+    parser.add_argument('--bare', action='store_true',
+                        help='только COPY-блоки, без TRUNCATE и пересчета (фаза 2 массовой загрузки)')
+    parser.add_argument('-o', '--output', help='файл вывода (по умолчанию stdout)')
+    args = parser.parse_args(argv)
+    check_generator_arguments(parser, args)
+    return args
+
+
+def config_from_args(args):
+    return GeneratorConfig(
+        readers=args.readers, authors=args.authors, books=args.books,
+        loans=args.loans, seed=args.seed, as_of=args.as_of or dt.date.today(),
+        history_days=args.history_days, zipf_s=args.zipf,
+    )
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    config = config_from_args(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8', newline='\n') as f:
+            counts = write_psql_script(config, f, bare=args.bare)
+    else:
+        counts = write_psql_script(config, sys.stdout, bare=args.bare)
+
+    print('=== СГЕНЕРИРОВАНЫ СИНТЕТИЧЕСКИЕ ДАННЫЕ ===', file=sys.stderr)
+    for table, n in counts.items():
+        print(f'✓ {table}: {n} строк', file=sys.stderr)
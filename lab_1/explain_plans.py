@@ -0,0 +1,249 @@
+# Контроль планов запросов отчетов схемы library
+#
+# Для примеров из раздела «ПРИМЕРЫ ПОЛЕЗНЫХ ЗАПРОСОВ» (EXAMPLES_SQL в
+# script_1.py) и каждого представления v_* выполняется
+# EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) на данных фиксированного масштаба
+# (см. SCALES в bench_procedures.py). Для каждого запроса сохраняются:
+#   fingerprint  — хэш формы плана: типы узлов, таблицы, индексы, виды
+#                  соединений и агрегатов, без оценок стоимости и строк;
+#   shape        — та же форма текстом, для сравнения глазами;
+#   buffers      — разделяемые блоки (hit + read) и временные блоки;
+#   времена      — медианы планирования и исполнения по --repeat запускам.
+#
+#     python explain_plans.py run --scale medium -o plans_baseline.json
+#     ... изменение схемы ...
+#     python explain_plans.py run --scale medium -o plans_new.json
+#     python explain_plans.py compare plans_baseline.json plans_new.json
+#
+# compare отмечает смену формы плана (с построчной разницей) и рост
+# буферов или времени исполнения сверх порогов; код выхода 1, если
+# найдено хотя бы одно изменение. Времена сравниваются только при
+# разнице больше --min-ms, чтобы шум на быстрых запросах не давал ложных
+# регрессий.
+#
+# Требуется psycopg 3 (pip install psycopg); без --dsn используется
+# временный кластер, как в bench_procedures.py.
+
+import argparse
+import datetime as dt
+import difflib
+import hashlib
+import json
+import re
+import statistics
+import sys
+
+import psycopg
+from psycopg import sql
+
+import script_1
+from bench_procedures import SCALES, TempCluster, git_revision, scale_database
+
+# Ключи узла плана, определяющие его форму
+SHAPE_KEYS = ('Node Type', 'Parent Relationship', 'Subplan Name', 'Join Type', 'Strategy',
+              'Partial Mode', 'Relation Name', 'Index Name', 'Function Name', 'CTE Name',
+              'Scan Direction')
+
+# Настройки сеанса, от которых не должен зависеть план
+SESSION_SETTINGS = ('SET search_path TO library, public', 'SET jit = off')
+
+
+# ---------------------------------------------------------------------
+# ЗАПРОСЫ
+# ---------------------------------------------------------------------
+
+def example_queries():
+    """Запросы из закомментированных примеров EXAMPLES_SQL.
+
+    Возвращает [(имя, SQL)]: «example:N» или «example:N.M», если в
+    примере несколько запросов.
+    """
+    queries = []
+    for match in re.finditer(r'^-- (\d+)\. .*\n((?:-- .*\n?)+)', script_1.EXAMPLES_SQL, re.M):
+        number, body = match.groups()
+        text = '\n'.join(line[3:] for line in body.splitlines())
+        statements = [s.strip() for s in text.split(';') if s.strip()]
+        for i, statement in enumerate(statements, 1):
+            name = f'example:{number}' if len(statements) == 1 else f'example:{number}.{i}'
+            queries.append((name, statement))
+    return queries
+
+
+def view_queries(conn):
+    views = [row[0] for row in conn.execute(
+        "SELECT table_name FROM information_schema.views "
+        "WHERE table_schema = 'library' AND table_name LIKE 'v\\_%' ORDER BY table_name")]
+    return [(f'view:{view}', sql.SQL('SELECT * FROM {}').format(sql.Identifier(view)).as_string(conn))
+            for view in views]
+
+
+# ---------------------------------------------------------------------
+# ПЛАНЫ
+# ---------------------------------------------------------------------
+
+def plan_shape(node, depth=0):
+    """Строки формы плана: узел и значимые атрибуты с отступом по глубине."""
+    attrs = [str(node[key]) for key in SHAPE_KEYS[1:] if key in node]
+    lines = ['  ' * depth + node['Node Type'] + (f' [{", ".join(attrs)}]' if attrs else '')]
+    for child in node.get('Plans', []):
+        lines.extend(plan_shape(child, depth + 1))
+    return lines
+
+
+def fingerprint(shape):
+    return hashlib.sha1('\n'.join(shape).encode('utf-8')).hexdigest()[:16]
+
+
+def explain(conn, query, repeat):
+    runs = []
+    for _ in range(repeat):
+        row = conn.execute(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}').fetchone()[0]
+        runs.append(row[0] if isinstance(row, list) else json.loads(row)[0])
+    last = runs[-1]
+    plan = last['Plan']
+    shape = plan_shape(plan)
+    return {
+        'fingerprint': fingerprint(shape),
+        'shape': shape,
+        'rows': plan.get('Actual Rows'),
+        'shared_hit': plan.get('Shared Hit Blocks', 0),
+        'shared_read': plan.get('Shared Read Blocks', 0),
+        'shared_buffers': plan.get('Shared Hit Blocks', 0) + plan.get('Shared Read Blocks', 0),
+        'temp_buffers': plan.get('Temp Read Blocks', 0) + plan.get('Temp Written Blocks', 0),
+        'planning_ms': round(statistics.median(r['Planning Time'] for r in runs), 3),
+        'execution_ms': round(statistics.median(r['Execution Time'] for r in runs), 3),
+    }
+
+
+def collect(dsn, repeat):
+    plans = {}
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        for setting in SESSION_SETTINGS:
+            conn.execute(setting)
+        conn.execute('VACUUM ANALYZE')
+        for name, query in example_queries() + view_queries(conn):
+            try:
+                plans[name] = {'query': query, **explain(conn, query, repeat)}
+            except psycopg.Error as e:
+                plans[name] = {'query': query, 'error': e.diag.message_primary or str(e)}
+                print(f'  {name:<32} ошибка: {plans[name]["error"]}', file=sys.stderr)
+                continue
+            p = plans[name]
+            print(f'  {name:<32} {p["fingerprint"]} {p["shared_buffers"]:>9} буф. '
+                  f'{p["execution_ms"]:>10.2f} мс', file=sys.stderr)
+    return plans
+
+
+def run(args):
+    report = {
+        'started_at': dt.datetime.now().isoformat(timespec='seconds'),
+        'git_revision': git_revision(),
+        'scale': args.scale,
+        'config': SCALES[args.scale],
+        'seed': args.seed,
+        'repeat': args.repeat,
+    }
+
+    def run_on(admin_dsn):
+        with psycopg.connect(admin_dsn) as conn:
+            report['server_version'] = conn.execute('SHOW server_version').fetchone()[0]
+        with scale_database(admin_dsn, args.scale, args.seed, args.jobs, args.keep) as (dsn, _):
+            report['plans'] = collect(dsn, args.repeat)
+
+    if args.dsn:
+        run_on(args.dsn)
+    else:
+        with TempCluster(args.pg_bin, args.locale) as cluster:
+            run_on(cluster.dsn)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'✓ Планы: {args.output}', file=sys.stderr)
+
+
+# ---------------------------------------------------------------------
+# СРАВНЕНИЕ
+# ---------------------------------------------------------------------
+
+def compare(args):
+    """Сравнение с базовой линией; код выхода 1 при изменении плана или регрессии."""
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+    if (baseline['scale'], baseline['seed']) != (current['scale'], current['seed']):
+        print('Внимание: прогоны на разных данных '
+              f'({baseline["scale"]}/{baseline["seed"]} и {current["scale"]}/{current["seed"]})')
+
+    def change(old, new):
+        return (new - old) / old * 100 if old else (100.0 if new else 0.0)
+
+    flagged = 0
+    print(f'{"запрос":<32} {"план":<10} {"буферы, %":>10} {"время, %":>9}')
+    for name in sorted(baseline['plans'].keys() | current['plans'].keys()):
+        old, new = baseline['plans'].get(name), current['plans'].get(name)
+        if old is None or new is None:
+            print(f'{name:<32} {"новый" if old is None else "удален"}')
+            continue
+        if 'error' in old or 'error' in new:
+            flagged += 'error' in new
+            print(f'{name:<32} ошибка: {new.get("error") or old.get("error")}')
+            continue
+        shape_changed = old['fingerprint'] != new['fingerprint']
+        buffers = change(old['shared_buffers'] + old['temp_buffers'],
+                         new['shared_buffers'] + new['temp_buffers'])
+        exec_delta = new['execution_ms'] - old['execution_ms']
+        exec_change = change(old['execution_ms'], new['execution_ms'])
+        marks = []
+        if shape_changed:
+            marks.append('план изменился')
+        if buffers > args.buffers_threshold:
+            marks.append('буферы')
+        if exec_change > args.time_threshold and exec_delta > args.min_ms:
+            marks.append('время')
+        flagged += bool(marks)
+        mark = f'  ✗ {", ".join(marks)}' if marks else ''
+        print(f'{name:<32} {"другой" if shape_changed else "тот же":<10} '
+              f'{buffers:>+10.1f} {exec_change:>+9.1f}{mark}')
+        if shape_changed:
+            for line in difflib.unified_diff(old['shape'], new['shape'], 'было', 'стало',
+                                             lineterm='', n=1):
+                print(f'    {line}')
+    return 1 if flagged else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Контроль планов запросов схемы library')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('run', help='загрузить данные и снять планы')
+    p.add_argument('--dsn', help='сервер для базы прогона (по умолчанию — временный кластер)')
+    p.add_argument('--pg-bin', help='каталог initdb и pg_ctl для временного кластера')
+    p.add_argument('--locale', default='C.UTF-8', help='локаль временного кластера')
+    p.add_argument('--scale', default='medium', choices=sorted(SCALES))
+    p.add_argument('--repeat', type=int, default=5, help='запусков EXPLAIN ANALYZE на запрос')
+    p.add_argument('--jobs', type=int, default=4, help='соединений для сборки индексов')
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--keep', action='store_true', help='не удалять базу прогона')
+    p.add_argument('-o', '--output', default='plans_baseline.json')
+
+    p = commands.add_parser('compare', help='сравнить планы с базовой линией')
+    p.add_argument('baseline')
+    p.add_argument('current')
+    p.add_argument('--buffers-threshold', type=float, default=20.0,
+                   help='допустимый рост числа буферов, %%')
+    p.add_argument('--time-threshold', type=float, default=50.0,
+                   help='допустимый рост медианы времени исполнения, %%')
+    p.add_argument('--min-ms', type=float, default=1.0,
+                   help='меньшая разница во времени не считается регрессией, мс')
+
+    args = parser.parse_args(argv)
+    if args.command == 'compare':
+        raise SystemExit(compare(args))
+    if args.repeat < 1:
+        parser.error('--repeat должен быть положительным')
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
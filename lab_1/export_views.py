@@ -0,0 +1,200 @@
+# Потоковая выгрузка отчетных представлений в CSV и Parquet
+#
+# Представления берутся из VIEWS_SQL в script_1.py (по умолчанию
+# v_reader_statistics, v_active_loans и v_book_popularity). Строки не
+# накапливаются в памяти клиента:
+#   csv     — COPY (SELECT * FROM представление) TO STDOUT, блоки пишутся
+#             в файл по мере прихода;
+#   parquet — именованный серверный курсор, пачки по --batch-rows строк,
+#             каждая пачка — группа строк Parquet.
+# Каждое представление выгружается в своем соединении, все — из одного
+# снимка данных (pg_export_snapshot и SET TRANSACTION SNAPSHOT), поэтому
+# файлы согласованы между собой при любом --jobs; с --jobs > 1 соединения
+# работают параллельно.
+#
+#     python export_views.py --dsn "dbname=library_management" \
+#         --format parquet --jobs 3 --output-dir export/
+#
+# Требуется psycopg 3 (pip install psycopg); для Parquet — pyarrow
+# (pip install pyarrow).
+
+import argparse
+import importlib.util
+import os
+import re
+import sys
+import threading
+import time
+
+import psycopg
+from psycopg import sql
+
+import script_1
+
+DEFAULT_VIEWS = ('v_reader_statistics', 'v_active_loans', 'v_book_popularity')
+
+# COPY приходит мелкими сообщениями сервера, в файл они пишутся через буфер
+FILE_BUFFER = 1 << 20
+
+
+def known_views():
+    return re.findall(r'^CREATE VIEW (v_\w+)', script_1.VIEWS_SQL, re.M)
+
+
+# ---------------------------------------------------------------------
+# ФОРМАТЫ
+# ---------------------------------------------------------------------
+
+def export_csv(conn, view, path, batch_rows):
+    query = sql.SQL('COPY (SELECT * FROM {}) TO STDOUT WITH (FORMAT csv, HEADER)').format(
+        sql.Identifier(view))
+    with open(path, 'wb', buffering=FILE_BUFFER) as f, conn.cursor() as cur:
+        with cur.copy(query) as copy:
+            for block in copy:
+                f.write(block)
+        return cur.rowcount
+
+
+def arrow_type(pa, column):
+    """Тип Arrow по типу столбца PostgreSQL; None — выгрузить текстом."""
+    name = psycopg.adapters.types.get(column.type_code)
+    name = name.name if name else None
+    if name in ('int2', 'int4'):
+        return pa.int32()
+    if name == 'int8':
+        return pa.int64()
+    if name in ('float4', 'float8'):
+        return pa.float64()
+    if name == 'numeric':
+        if column.precision is not None and column.scale is not None:
+            return pa.decimal128(column.precision, column.scale)
+        return pa.float64()
+    if name == 'bool':
+        return pa.bool_()
+    if name == 'date':
+        return pa.date32()
+    if name == 'timestamp':
+        return pa.timestamp('us')
+    if name == 'timestamptz':
+        return pa.timestamp('us', tz='UTC')
+    if name in ('text', 'varchar', 'bpchar', 'name'):
+        return pa.string()
+    return None
+
+
+def export_parquet(conn, view, path, batch_rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    total = 0
+    query = sql.SQL('SELECT * FROM {}').format(sql.Identifier(view))
+    with conn.cursor(name=f'export_{view}') as cur:
+        cur.itersize = batch_rows
+        cur.execute(query)
+        types = [arrow_type(pa, column) for column in cur.description]
+        schema = pa.schema([(column.name, t or pa.string())
+                            for column, t in zip(cur.description, types)])
+        with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+            while True:
+                rows = cur.fetchmany(batch_rows)
+                if not rows:
+                    break
+                arrays = []
+                for i, (field, t) in enumerate(zip(schema, types)):
+                    values = [row[i] for row in rows]
+                    if t is None:
+                        values = [None if v is None else str(v) for v in values]
+                    elif pa.types.is_floating(t):
+                        values = [None if v is None else float(v) for v in values]
+                    arrays.append(pa.array(values, type=field.type))
+                writer.write_batch(pa.record_batch(arrays, schema=schema))
+                total += len(rows)
+    return total
+
+
+EXPORTERS = {'csv': export_csv, 'parquet': export_parquet}
+
+
+# ---------------------------------------------------------------------
+# ВЫГРУЗКА
+# ---------------------------------------------------------------------
+
+def export_view(dsn, view, args, snapshot, results):
+    path = os.path.join(args.output_dir, f'{view}.{args.format}')
+    started = time.perf_counter()
+    # Транзакции управляются явно: SET TRANSACTION SNAPSHOT должен идти
+    # сразу после BEGIN
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute('SET search_path TO library, public')
+        conn.execute('BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY')
+        conn.execute(sql.SQL('SET TRANSACTION SNAPSHOT {}').format(snapshot))
+        rows = EXPORTERS[args.format](conn, view, path, args.batch_rows)
+        conn.execute('ROLLBACK')
+    results[view] = (rows, time.perf_counter() - started, os.path.getsize(path))
+    print(f'  {view:<24} {rows:>12} строк  {results[view][1]:>7.1f} с  → {path}',
+          file=sys.stderr)
+
+
+def run(args):
+    os.makedirs(args.output_dir, exist_ok=True)
+    results, errors = {}, []
+
+    def worker(views, snapshot):
+        for view in views:
+            try:
+                export_view(args.dsn, view, args, snapshot, results)
+            except Exception as e:  # и ошибки pyarrow: без записи поток упал бы молча
+                errors.append(f'{view}: {e}')
+
+    # Держим транзакцию с экспортированным снимком, пока идет выгрузка
+    with psycopg.connect(args.dsn, autocommit=True) as coordinator:
+        coordinator.execute('BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY')
+        snapshot = coordinator.execute('SELECT pg_export_snapshot()').fetchone()[0]
+        jobs = min(args.jobs, len(args.views))
+        if jobs == 1:
+            worker(args.views, snapshot)
+        else:
+            threads = [threading.Thread(target=worker, args=(args.views[i::jobs], snapshot))
+                       for i in range(jobs)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        coordinator.execute('ROLLBACK')
+
+    for error in errors:
+        print(f'✗ {error}', file=sys.stderr)
+    if results:
+        rows = sum(r[0] for r in results.values())
+        size = sum(r[2] for r in results.values())
+        print(f'✓ Выгружено представлений: {len(results)}, строк: {rows}, '
+              f'{size / 2**20:.1f} МБ', file=sys.stderr)
+    return 1 if errors else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Потоковая выгрузка представлений library')
+    parser.add_argument('--dsn', required=True, help='строка подключения PostgreSQL')
+    parser.add_argument('--views', default=','.join(DEFAULT_VIEWS),
+                        help='представления через запятую')
+    parser.add_argument('--format', choices=sorted(EXPORTERS), default='csv')
+    parser.add_argument('--output-dir', default='export')
+    parser.add_argument('--batch-rows', type=int, default=50_000,
+                        help='строк в пачке серверного курсора (группа строк Parquet)')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='параллельных соединений (один общий снимок)')
+    args = parser.parse_args(argv)
+
+    args.views = [v.strip() for v in args.views.split(',') if v.strip()]
+    unknown = set(args.views) - set(known_views())
+    if unknown:
+        parser.error(f'нет в VIEWS_SQL: {", ".join(sorted(unknown))}')
+    if args.batch_rows < 1 or args.jobs < 1:
+        parser.error('--batch-rows и --jobs должны быть положительными')
+    if args.format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+        parser.error('для Parquet нужен pyarrow (pip install pyarrow)')
+    raise SystemExit(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,443 @@
+# Импорт поступлений каталога из файлов поставщиков
+#
+# Файл поставщика — CSV в форме unnormalized_library: строка на издание,
+# авторы одним полем через запятую или точку с запятой («Толстой Лев
+# Николаевич, Тургенев Иван Сергеевич»). Построчная загрузка в books,
+# authors и book_authors медленная и плодит дубли авторов, поэтому импорт
+# идет пакетом:
+#   1. COPY файла в нежурналируемую таблицу import_books_raw (все поля —
+#      текст, чтобы COPY не падал на первой кривой строке);
+#   2. разбиение поля авторов одним запросом (regexp_split_to_table WITH
+#      ORDINALITY) в import_book_authors с нормализованным ключом имени:
+#      пробелы схлопнуты, регистр и ё не различаются;
+#   3. проверка строк набором условий; отклоненные строки с причинами —
+#      в import_rejects, годные с приведенными типами — в import_books;
+#   4. тремя MERGE: новые авторы (по ключу имени, без дублей с уже
+#      существующими), книги по ISBN (новые добавляются, у известных
+#      прибавляются экземпляры, либо они пропускаются с --existing skip)
+#      и связи book_authors. Авторы и связи берутся только из строк новых
+#      книг: состав авторов книги, уже бывшей в каталоге, поставка не
+#      меняет.
+# Шаги 2–3 и 4 — по одной транзакции; с --dry-run шаг 4 откатывается, и
+# отчет показывает, что было бы загружено. Импорты выполняются по одному
+# (advisory lock), поэтому одновременная загрузка двух файлов не создаст
+# одного автора дважды.
+#
+#     python import_catalog.py --dsn "dbname=library_management" \
+#         supplier.csv --rejects supplier_rejects.csv
+#
+# Заголовок файла задает порядок столбцов: title, authors, isbn,
+# publication_year, pages, copies, category, language (title, authors,
+# isbn и category обязательны). Категория должна уже быть в categories.
+#
+# MERGE требует PostgreSQL 15+. Требуется psycopg 3 (pip install psycopg).
+
+import argparse
+import csv
+import sys
+import time
+
+import psycopg
+from psycopg import sql
+
+COLUMNS = ('title', 'authors', 'isbn', 'publication_year', 'pages', 'copies',
+           'category', 'language')
+REQUIRED = ('title', 'authors', 'isbn', 'category')
+
+# Ключ для сравнения имен авторов; для authors.search_text выражение
+# совпадает с индексом idx_authors_name_key
+NAME_KEY = "lower(translate({}, 'Ёё', 'Ее'))"
+
+# Кодировки файлов: имя Python → имя PostgreSQL для COPY
+ENCODINGS = {'utf-8': 'UTF8', 'cp1251': 'WIN1251'}
+
+# Произвольный ключ advisory lock импорта
+IMPORT_LOCK = 'library.import_catalog'
+
+STAGING_SQL = """
+CREATE UNLOGGED TABLE IF NOT EXISTS import_books_raw (
+    row_id BIGSERIAL PRIMARY KEY,
+    batch_id INTEGER NOT NULL DEFAULT current_setting('library.import_batch')::INTEGER,
+    title TEXT,
+    authors TEXT,
+    isbn TEXT,
+    publication_year TEXT,
+    pages TEXT,
+    copies TEXT,
+    category TEXT,
+    language TEXT
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS import_book_authors (
+    batch_id INTEGER NOT NULL,
+    row_id BIGINT NOT NULL,
+    author_order INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    last_name TEXT,
+    first_name TEXT,
+    middle_name TEXT,
+    PRIMARY KEY (batch_id, row_id, author_order)
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS import_books (
+    batch_id INTEGER NOT NULL,
+    row_id BIGINT NOT NULL,
+    title VARCHAR(200) NOT NULL,
+    isbn VARCHAR(20) NOT NULL,
+    publication_year INTEGER,
+    pages INTEGER,
+    copies INTEGER NOT NULL,
+    category_id INTEGER NOT NULL,
+    language VARCHAR(50),
+    is_new BOOLEAN,  -- ISBN не было в books до MERGE (шаг 4)
+    PRIMARY KEY (batch_id, row_id)
+);
+
+-- record_no — номер записи в файле без заголовка
+CREATE UNLOGGED TABLE IF NOT EXISTS import_rejects (
+    batch_id INTEGER NOT NULL,
+    row_id BIGINT NOT NULL,
+    record_no INTEGER NOT NULL,
+    isbn TEXT,
+    title TEXT,
+    reason TEXT NOT NULL
+);
+
+CREATE SEQUENCE IF NOT EXISTS import_batch_seq;
+"""
+
+# Шаг 2: авторы одной строкой запроса на весь пакет
+SPLIT_AUTHORS_SQL = f"""
+INSERT INTO import_book_authors
+    (batch_id, row_id, author_order, name, name_key, last_name, first_name, middle_name)
+SELECT r.batch_id, r.row_id, a.ord, a.name, {NAME_KEY.format('a.name')},
+       a.parts[1], a.parts[2], a.parts[3]
+FROM import_books_raw r
+CROSS JOIN LATERAL (
+    SELECT s.ord, n.name, regexp_match(n.name, '^(\\S+) (\\S+)(?: (.+))?$') AS parts
+    FROM regexp_split_to_table(r.authors, '\\s*[;,]\\s*') WITH ORDINALITY AS s(part, ord)
+    CROSS JOIN LATERAL (SELECT regexp_replace(btrim(s.part), '\\s+', ' ', 'g') AS name) n
+    WHERE n.name <> ''
+) a
+WHERE r.batch_id = %(batch)s
+"""
+
+# Шаг 3: каждая строка проверяется всеми условиями сразу, в отчет идут все
+# причины отказа
+REJECTS_SQL = """
+WITH raw AS (
+    SELECT r.*,
+           r.row_id - min(r.row_id) OVER () + 1 AS record_no,
+           NULLIF(btrim(r.title), '') AS t_title,
+           NULLIF(btrim(r.isbn), '') AS t_isbn,
+           NULLIF(btrim(r.publication_year), '') AS t_year,
+           NULLIF(btrim(r.pages), '') AS t_pages,
+           NULLIF(btrim(r.copies), '') AS t_copies,
+           row_number() OVER (PARTITION BY btrim(r.isbn) ORDER BY r.row_id) AS isbn_seen,
+           min(r.row_id) OVER (PARTITION BY btrim(r.isbn)) AS isbn_first
+    FROM import_books_raw r
+    WHERE r.batch_id = %(batch)s
+)
+INSERT INTO import_rejects (batch_id, row_id, record_no, isbn, title, reason)
+SELECT r.batch_id, r.row_id, r.record_no, r.isbn, r.title, c.reason
+FROM raw r
+LEFT JOIN categories cat ON cat.name = btrim(r.category)
+CROSS JOIN LATERAL (VALUES
+    (r.t_title IS NULL, 'нет названия'),
+    (length(r.t_title) > 200, 'название длиннее 200 символов'),
+    (r.t_isbn IS NULL, 'нет ISBN'),
+    (length(r.t_isbn) > 20, 'ISBN длиннее 20 символов'),
+    (r.t_isbn IS NOT NULL AND r.isbn_seen > 1, 'ISBN повторяется в файле (запись '
+                      || r.isbn_first - r.row_id + r.record_no || ')'),
+    -- CASE, а не OR: приведение к INTEGER только для строк из цифр
+    (CASE WHEN r.t_year ~ '^\\d{4}$'
+          THEN r.t_year::INTEGER NOT BETWEEN 1000 AND EXTRACT(YEAR FROM CURRENT_DATE)
+          ELSE r.t_year IS NOT NULL END, 'неверный год издания'),
+    (CASE WHEN r.t_pages ~ '^\\d{1,6}$' THEN r.t_pages::INTEGER = 0
+          ELSE r.t_pages IS NOT NULL END, 'неверное число страниц'),
+    (CASE WHEN r.t_copies ~ '^\\d{1,4}$' THEN r.t_copies::INTEGER = 0
+          ELSE r.t_copies IS NOT NULL END, 'неверное число экземпляров'),
+    (cat.category_id IS NULL, 'неизвестная категория'),
+    (length(btrim(r.language)) > 50, 'язык длиннее 50 символов'),
+    (NOT EXISTS (SELECT 1 FROM import_book_authors a
+                 WHERE a.batch_id = r.batch_id AND a.row_id = r.row_id), 'нет авторов')
+) c(failed, reason)
+WHERE c.failed
+UNION ALL
+SELECT r.batch_id, r.row_id, r.record_no, r.isbn, r.title,
+       CASE WHEN a.parts_missing THEN 'неполное имя автора: '
+            ELSE 'имя автора длиннее 50 символов: ' END || a.name
+FROM raw r
+JOIN LATERAL (
+    SELECT a.name, a.first_name IS NULL AS parts_missing
+    FROM import_book_authors a
+    WHERE a.batch_id = r.batch_id AND a.row_id = r.row_id
+      AND (a.first_name IS NULL OR greatest(length(a.last_name), length(a.first_name),
+                                            length(a.middle_name)) > 50)
+) a ON true
+"""
+
+VALID_BOOKS_SQL = """
+INSERT INTO import_books
+    (batch_id, row_id, title, isbn, publication_year, pages, copies, category_id, language)
+SELECT r.batch_id, r.row_id, btrim(r.title), btrim(r.isbn),
+       NULLIF(btrim(r.publication_year), '')::INTEGER,
+       NULLIF(btrim(r.pages), '')::INTEGER,
+       COALESCE(NULLIF(btrim(r.copies), '')::INTEGER, 1),
+       c.category_id,
+       NULLIF(btrim(r.language), '')
+FROM import_books_raw r
+JOIN categories c ON c.name = btrim(r.category)
+WHERE r.batch_id = %(batch)s
+  AND NOT EXISTS (SELECT 1 FROM import_rejects j
+                  WHERE j.batch_id = r.batch_id AND j.row_id = r.row_id)
+"""
+
+# Шаг 4. Книги пакета, ISBN которых еще нет в каталоге, отмечаются до
+# MERGE книг: после него новые и известные книги уже не различить.
+# Возвращает число известных книг
+MARK_NEW_BOOKS_SQL = """
+WITH marked AS (
+    UPDATE import_books s
+    SET is_new = NOT EXISTS (SELECT 1 FROM books b WHERE b.isbn = s.isbn)
+    WHERE s.batch_id = %(batch)s
+    RETURNING s.is_new
+)
+SELECT count(*) FILTER (WHERE NOT is_new) FROM marked
+"""
+
+# Существующий автор узнается по ключу его ФИО (search_text — та же
+# строка «Фамилия Имя Отчество», поиск по индексу idx_authors_name_key);
+# новый автор попадает в authors один раз, сколько бы новых книг пакета
+# его ни упоминали
+MERGE_AUTHORS_SQL = f"""
+MERGE INTO authors a
+USING (
+    SELECT DISTINCT ON (ia.name_key) ia.name_key, ia.last_name, ia.first_name, ia.middle_name
+    FROM import_book_authors ia
+    JOIN import_books ib ON ib.batch_id = ia.batch_id AND ib.row_id = ia.row_id
+    WHERE ia.batch_id = %(batch)s AND ib.is_new
+    ORDER BY ia.name_key, ia.row_id, ia.author_order
+) s ON {NAME_KEY.format('a.search_text')} = s.name_key
+WHEN NOT MATCHED THEN
+    INSERT (last_name, first_name, middle_name)
+    VALUES (s.last_name, s.first_name, s.middle_name)
+"""
+
+MERGE_BOOKS_SQL = """
+MERGE INTO books b
+USING (SELECT * FROM import_books WHERE batch_id = %(batch)s) s
+ON b.isbn = s.isbn
+{matched}
+WHEN NOT MATCHED THEN
+    INSERT (title, isbn, publication_year, pages, copies_total, copies_available,
+            category_id, language)
+    VALUES (s.title, s.isbn, s.publication_year, s.pages, s.copies, s.copies,
+            s.category_id, COALESCE(s.language, 'русский'))
+"""
+
+# Известной книге поставка добавляет экземпляры: триггер tr_book_copies
+# создаст их в book_copies. Снимок copies_available не трогаем — его
+# пересчитывает sync_books_availability()
+MATCHED_ADD_COPIES = """WHEN MATCHED THEN
+    UPDATE SET copies_total = b.copies_total + s.copies"""
+
+# Для каждого имени берется автор с наименьшим author_id по индексу
+# idx_authors_name_key: стоимость зависит от размера файла, а не каталога
+MERGE_BOOK_AUTHORS_SQL = f"""
+MERGE INTO book_authors ba
+USING (
+    SELECT DISTINCT b.book_id, k.author_id
+    FROM import_books s
+    JOIN books b ON b.isbn = s.isbn
+    JOIN import_book_authors ia ON ia.batch_id = s.batch_id AND ia.row_id = s.row_id
+    CROSS JOIN LATERAL (
+        SELECT a.author_id
+        FROM authors a
+        WHERE {NAME_KEY.format('a.search_text')} = ia.name_key
+        ORDER BY a.author_id
+        LIMIT 1
+    ) k
+    WHERE s.batch_id = %(batch)s AND s.is_new
+) src ON ba.book_id = src.book_id AND ba.author_id = src.author_id
+WHEN NOT MATCHED THEN
+    INSERT (book_id, author_id) VALUES (src.book_id, src.author_id)
+"""
+
+CLEANUP_TABLES = ('import_books_raw', 'import_book_authors', 'import_books', 'import_rejects')
+
+
+# ---------------------------------------------------------------------
+# ЗАГРУЗКА
+# ---------------------------------------------------------------------
+
+def read_header(path, delimiter, encoding):
+    with open(path, encoding=encoding, newline='') as f:
+        header = next(csv.reader(f, delimiter=delimiter), None)
+    if not header:
+        raise ValueError(f'{path}: пустой файл')
+    header = [h.strip().lstrip('\ufeff').lower() for h in header]
+    unknown = [h for h in header if h not in COLUMNS]
+    missing = [c for c in REQUIRED if c not in header]
+    if unknown or missing or len(set(header)) != len(header):
+        raise ValueError(f'{path}: неверный заголовок'
+                         + (f'; лишние столбцы: {", ".join(unknown)}' if unknown else '')
+                         + (f'; нет столбцов: {", ".join(missing)}' if missing else ''))
+    return header
+
+
+def copy_file(conn, path, header, args):
+    query = sql.SQL(
+        'COPY import_books_raw ({}) FROM STDIN '
+        'WITH (FORMAT csv, HEADER true, DELIMITER {}, ENCODING {})'
+    ).format(sql.SQL(', ').join(map(sql.Identifier, header)), sql.Literal(args.delimiter),
+             sql.Literal(ENCODINGS[args.encoding]))
+    with open(path, 'rb') as f, conn.cursor() as cur:
+        with cur.copy(query) as copy:
+            while block := f.read(1 << 20):
+                copy.write(block)
+        return cur.rowcount
+
+
+def stage(conn, batch, path, args):
+    """Шаги 1–3: COPY, разбиение авторов и проверка; возвращает число записей."""
+    header = read_header(path, args.delimiter, args.encoding)
+    with conn.transaction():
+        rows = copy_file(conn, path, header, args)
+        # Свежие staging-таблицы без статистики дают планировщику ложные
+        # оценки — соединения ниже выбираются по реальным объемам
+        conn.execute('ANALYZE import_books_raw')
+        conn.execute(SPLIT_AUTHORS_SQL, {'batch': batch})
+        conn.execute('ANALYZE import_book_authors')
+        conn.execute(REJECTS_SQL, {'batch': batch})
+        conn.execute(VALID_BOOKS_SQL, {'batch': batch})
+        conn.execute('ANALYZE import_books')
+    return rows
+
+
+def merge(conn, batch, args):
+    """Шаг 4: MERGE в нормализованные таблицы; возвращает счетчики."""
+    params = {'batch': batch}
+    counts = {}
+    with conn.transaction(force_rollback=args.dry_run):
+        counts['existing'] = conn.execute(MARK_NEW_BOOKS_SQL, params).fetchone()[0]
+        counts['authors'] = conn.execute(MERGE_AUTHORS_SQL, params).rowcount
+        matched = MATCHED_ADD_COPIES if args.existing == 'add-copies' else ''
+        books = conn.execute(MERGE_BOOKS_SQL.format(matched=matched), params).rowcount
+        counts['books_new'] = books - (counts['existing'] if matched else 0)
+        counts['links'] = conn.execute(MERGE_BOOK_AUTHORS_SQL, params).rowcount
+    return counts
+
+
+# ---------------------------------------------------------------------
+# ОТЧЕТ
+# ---------------------------------------------------------------------
+
+def write_rejects(conn, batch, path):
+    query = sql.SQL(
+        'COPY (SELECT record_no, isbn, title, reason FROM import_rejects '
+        'WHERE batch_id = {} ORDER BY record_no, reason) TO STDOUT WITH (FORMAT csv, HEADER)'
+    ).format(sql.Literal(batch))
+    with open(path, 'wb') as f, conn.cursor() as cur:
+        with cur.copy(query) as copy:
+            for block in copy:
+                f.write(block)
+
+
+def print_report(conn, batch, path, rows, counts, args):
+    reasons = conn.execute(
+        "SELECT regexp_replace(reason, ':.*| \\(запись.*', ''), count(*), "
+        "count(DISTINCT row_id) FROM import_rejects WHERE batch_id = %s "
+        "GROUP BY 1 ORDER BY 2 DESC", (batch,)).fetchall()
+    rejected = conn.execute(
+        'SELECT count(DISTINCT row_id) FROM import_rejects WHERE batch_id = %s',
+        (batch,)).fetchone()[0]
+    authors_split = conn.execute(
+        'SELECT count(*), count(DISTINCT name_key) FROM import_book_authors '
+        'WHERE batch_id = %s', (batch,)).fetchone()
+
+    print(f'{path}: записей {rows}, принято {rows - rejected}, отклонено {rejected}')
+    print(f'  имен авторов в файле: {authors_split[0]}, различных: {authors_split[1]}')
+    prefix = 'было бы ' if args.dry_run else ''
+    print(f'  {prefix}добавлено авторов: {counts["authors"]}, книг: {counts["books_new"]}, '
+          f'связей книга—автор: {counts["links"]}')
+    if args.existing == 'add-copies':
+        print(f'  {prefix}пополнено известных книг: {counts["existing"]}')
+    else:
+        print(f'  пропущено известных книг: {counts["existing"]}')
+    if reasons:
+        print(f'  {"причина":<40} {"случаев":>8} {"записей":>8}')
+        for reason, cases, records in reasons:
+            print(f'  {reason:<40} {cases:>8} {records:>8}')
+        for record_no, isbn, title, reason in conn.execute(
+                'SELECT record_no, isbn, title, reason FROM import_rejects WHERE batch_id = %s '
+                'ORDER BY record_no, reason LIMIT %s', (batch, args.show_rejects)):
+            print(f'    запись {record_no}: {isbn or "—"} «{(title or "").strip()[:40]}» — {reason}')
+        if rejected > args.show_rejects:
+            print('    ...')
+
+
+def cleanup(conn, batch):
+    with conn.transaction():
+        for table in CLEANUP_TABLES:
+            conn.execute(sql.SQL('DELETE FROM {} WHERE batch_id = %s').format(
+                sql.Identifier(table)), (batch,))
+
+
+def run(args):
+    failed = 0
+    with psycopg.connect(args.dsn, autocommit=True) as conn:
+        conn.execute('SET search_path TO library, public')
+        conn.execute(STAGING_SQL)
+        conn.execute('SELECT pg_advisory_lock(hashtext(%s))', (IMPORT_LOCK,))
+        for path in args.files:
+            batch = conn.execute("SELECT nextval('import_batch_seq')").fetchone()[0]
+            conn.execute("SELECT set_config('library.import_batch', %s, false)", (str(batch),))
+            started = time.perf_counter()
+            try:
+                rows = stage(conn, batch, path, args)
+                counts = merge(conn, batch, args)
+                print_report(conn, batch, path, rows, counts, args)
+                if args.rejects:
+                    write_rejects(conn, batch, args.rejects.format(batch=batch))
+            except (psycopg.Error, OSError, ValueError) as e:
+                failed += 1
+                print(f'✗ {path}: {e}', file=sys.stderr)
+                continue
+            finally:
+                if not args.keep_staging:
+                    cleanup(conn, batch)
+            mark = 'проверен (--dry-run)' if args.dry_run else 'загружен'
+            print(f'✓ {path} {mark} за {time.perf_counter() - started:.1f} с '
+                  f'(пакет {batch})', file=sys.stderr)
+        conn.execute('SELECT pg_advisory_unlock(hashtext(%s))', (IMPORT_LOCK,))
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Пакетный импорт поступлений каталога')
+    parser.add_argument('--dsn', required=True, help='строка подключения PostgreSQL')
+    parser.add_argument('files', nargs='+', help='CSV-файлы поставщиков')
+    parser.add_argument('--delimiter', default=',', help='разделитель полей CSV')
+    parser.add_argument('--encoding', choices=sorted(ENCODINGS), default='utf-8',
+                        help='кодировка файлов')
+    parser.add_argument('--existing', choices=('add-copies', 'skip'), default='add-copies',
+                        help='что делать с книгами, ISBN которых уже есть в каталоге')
+    parser.add_argument('--rejects', help='CSV отклоненных записей ({batch} — номер пакета)')
+    parser.add_argument('--show-rejects', type=int, default=20,
+                        help='сколько отклоненных записей показать в отчете')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='проверить и посчитать, но откатить MERGE')
+    parser.add_argument('--keep-staging', action='store_true',
+                        help='не очищать staging-таблицы после импорта')
+    args = parser.parse_args(argv)
+    if len(args.delimiter) != 1:
+        parser.error('--delimiter должен быть одним символом')
+    if args.rejects and len(args.files) > 1 and '{batch}' not in args.rejects:
+        parser.error('для нескольких файлов в --rejects нужен {batch}')
+    raise SystemExit(run(args))
+
+
+if __name__ == '__main__':
+    main()
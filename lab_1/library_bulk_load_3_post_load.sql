@@ -0,0 +1,22 @@
+SET search_path TO library, public;
+
+-- =====================================================================
+-- ПЕРЕСЧЕТ ПРОИЗВОДНЫХ ДАННЫХ ПОСЛЕ ЗАГРУЗКИ
+-- Выполняется одним проходом по таблицам вместо построчных триггеров
+-- =====================================================================
+
+-- Последовательности продолжают нумерацию после загруженных ключей
+SELECT setval(pg_get_serial_sequence('categories', 'category_id'), COALESCE(MAX(category_id), 0) + 1, false) FROM categories;
+SELECT setval(pg_get_serial_sequence('readers', 'reader_id'), COALESCE(MAX(reader_id), 0) + 1, false) FROM readers;
+SELECT setval(pg_get_serial_sequence('authors', 'author_id'), COALESCE(MAX(author_id), 0) + 1, false) FROM authors;
+SELECT setval(pg_get_serial_sequence('books', 'book_id'), COALESCE(MAX(book_id), 0) + 1, false) FROM books;
+SELECT setval(pg_get_serial_sequence('loans', 'loan_id'), COALESCE(MAX(loan_id), 0) + 1, false) FROM loans;
+SELECT setval(pg_get_serial_sequence('fines', 'fine_id'), COALESCE(MAX(fine_id), 0) + 1, false) FROM fines;
+
+-- Заполнение производных таблиц по данным, вставленным до создания триггеров
+SELECT rebuild_book_copies() AS book_copies_built;
+SELECT sync_books_availability() AS books_availability_fixed;
+SELECT rebuild_reader_stats() AS reader_stats_fixed;
+SELECT rebuild_loan_rollups() AS loan_rollups_fixed;
+SELECT rebuild_book_authors_display() AS authors_display_fixed;
+SELECT rebuild_book_search_vector() AS search_vectors_fixed;
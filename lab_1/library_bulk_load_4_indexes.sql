@@ -0,0 +1,49 @@
+SET search_path TO library, public;
+
+-- =====================================================================
+-- СОЗДАНИЕ ИНДЕКСОВ ДЛЯ ОПТИМИЗАЦИИ
+-- =====================================================================
+
+-- Индексы для часто используемых запросов
+CREATE INDEX idx_books_category ON books(category_id);
+CREATE INDEX idx_books_title ON books USING gin(to_tsvector('russian', title));
+CREATE INDEX idx_books_isbn ON books(isbn) WHERE isbn IS NOT NULL;
+CREATE INDEX idx_books_search ON books USING gin(search_vector);
+
+CREATE INDEX idx_book_copies_free ON book_copies(book_id) WHERE loan_id IS NULL;
+CREATE UNIQUE INDEX idx_book_copies_loan ON book_copies(loan_id) WHERE loan_id IS NOT NULL;
+
+CREATE INDEX idx_loans_reader ON loans(reader_id);
+CREATE INDEX idx_loans_book ON loans(book_id);
+CREATE INDEX idx_loans_dates ON loans(loan_date, due_date);
+CREATE INDEX idx_loans_status ON loans(status) WHERE status != 'возвращена';
+
+CREATE INDEX idx_readers_type ON readers(reader_type);
+CREATE INDEX idx_readers_name ON readers(last_name, first_name);
+CREATE INDEX idx_readers_email ON readers(email) WHERE email IS NOT NULL;
+CREATE INDEX idx_readers_search ON readers USING gist(search_text gist_trgm_ops);
+
+CREATE INDEX idx_authors_name ON authors(last_name, first_name);
+CREATE INDEX idx_authors_search ON authors USING gist(search_text gist_trgm_ops);
+-- Ключ имени автора для импорта каталога (import_catalog.py): без учета регистра и ё
+CREATE INDEX idx_authors_name_key ON authors ((lower(translate(search_text, 'Ёё', 'Ее'))), author_id);
+CREATE INDEX idx_fines_unpaid ON fines(loan_id) WHERE paid = FALSE;
+
+-- Воркеры читают только ожидающие заявки по порядку поступления
+CREATE INDEX idx_loan_requests_pending ON loan_requests(request_id) WHERE status = 'ожидает';
+
+-- Архив пополняется по возрастанию дат, поэтому BRIN (несколько страниц
+-- на всю таблицу) заменяет btree для отбора по периоду
+CREATE INDEX idx_loans_history_loan_date ON loans_history USING brin(loan_date);
+CREATE INDEX idx_loans_history_return_date ON loans_history USING brin(return_date);
+CREATE INDEX idx_fines_history_fine_date ON fines_history USING brin(fine_date);
+
+-- Окна по дням читают первичный ключ (loan_day, ...); история одной книги —
+-- этот индекс
+CREATE INDEX idx_book_loans_daily_book ON book_loans_daily(book_id, loan_day) INCLUDE (loans);
+
+-- Самые выдаваемые книги за всю историю — первые записи индекса
+CREATE INDEX idx_book_loan_totals_loans ON book_loan_totals(loans DESC, book_id);
+
+-- Составные индексы для сложных запросов
+CREATE INDEX idx_book_authors_composite ON book_authors(author_id, book_id);
@@ -0,0 +1,175 @@
+SET search_path TO library, public;
+
+-- ---------------------------------------------------------------------
+-- ВНЕШНИЕ КЛЮЧИ
+-- Объявлены отдельно от таблиц, чтобы при массовой загрузке создавать
+-- их после данных (см. library_bulk_load_*.sql)
+-- ---------------------------------------------------------------------
+
+ALTER TABLE books ADD CONSTRAINT books_category_id_fkey
+    FOREIGN KEY (category_id) REFERENCES categories(category_id);
+
+ALTER TABLE book_copies ADD CONSTRAINT book_copies_book_id_fkey
+    FOREIGN KEY (book_id) REFERENCES books(book_id) ON DELETE CASCADE;
+
+ALTER TABLE book_authors ADD CONSTRAINT book_authors_book_id_fkey
+    FOREIGN KEY (book_id) REFERENCES books(book_id) ON DELETE CASCADE;
+ALTER TABLE book_authors ADD CONSTRAINT book_authors_author_id_fkey
+    FOREIGN KEY (author_id) REFERENCES authors(author_id) ON DELETE CASCADE;
+
+ALTER TABLE loans ADD CONSTRAINT loans_reader_id_fkey
+    FOREIGN KEY (reader_id) REFERENCES readers(reader_id);
+ALTER TABLE loans ADD CONSTRAINT loans_book_id_fkey
+    FOREIGN KEY (book_id) REFERENCES books(book_id);
+
+ALTER TABLE fines ADD CONSTRAINT fines_loan_id_fkey
+    FOREIGN KEY (loan_id, loan_date) REFERENCES loans(loan_id, loan_date)
+    ON UPDATE CASCADE ON DELETE CASCADE;
+
+ALTER TABLE loans_history ADD CONSTRAINT loans_history_reader_id_fkey
+    FOREIGN KEY (reader_id) REFERENCES readers(reader_id);
+ALTER TABLE loans_history ADD CONSTRAINT loans_history_book_id_fkey
+    FOREIGN KEY (book_id) REFERENCES books(book_id);
+ALTER TABLE fines_history ADD CONSTRAINT fines_history_loan_id_fkey
+    FOREIGN KEY (loan_id) REFERENCES loans_history(loan_id);
+
+ALTER TABLE reader_loan_stats ADD CONSTRAINT reader_loan_stats_reader_id_fkey
+    FOREIGN KEY (reader_id) REFERENCES readers(reader_id) ON DELETE CASCADE;
+
+ALTER TABLE book_loans_daily ADD CONSTRAINT book_loans_daily_book_id_fkey
+    FOREIGN KEY (book_id) REFERENCES books(book_id) ON DELETE CASCADE;
+ALTER TABLE category_loans_daily ADD CONSTRAINT category_loans_daily_category_id_fkey
+    FOREIGN KEY (category_id) REFERENCES categories(category_id) ON DELETE CASCADE;
+ALTER TABLE book_loan_totals ADD CONSTRAINT book_loan_totals_book_id_fkey
+    FOREIGN KEY (book_id) REFERENCES books(book_id) ON DELETE CASCADE;
+
+-- Подключение триггеров к таблице выдач. Учет экземпляров — на уровне
+-- оператора: список столбцов (UPDATE OF) с таблицами переходов не
+-- допускается, поэтому правка примечаний стоит один вызов на оператор,
+-- а не на строку
+CREATE TRIGGER tr_update_book_availability_insert
+    AFTER INSERT ON loans
+    REFERENCING NEW TABLE AS new_loans
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_book_availability();
+
+CREATE TRIGGER tr_update_book_availability_update
+    AFTER UPDATE ON loans
+    REFERENCING OLD TABLE AS old_loans NEW TABLE AS new_loans
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_book_availability();
+
+CREATE TRIGGER tr_set_loan_status
+    BEFORE UPDATE OF status, due_date ON loans
+    FOR EACH ROW
+    WHEN ((OLD.status != 'возвращена' AND NEW.status = 'возвращена' AND NEW.return_date IS NULL)
+          OR (OLD.status = 'выдана' AND NEW.status = 'выдана' AND NEW.due_date < CURRENT_DATE))
+    EXECUTE FUNCTION set_loan_status();
+
+CREATE TRIGGER tr_set_loan_due_date
+    BEFORE INSERT ON loans
+    FOR EACH ROW
+    EXECUTE FUNCTION set_loan_due_date();
+
+-- Экземпляры книги (book_copies)
+CREATE TRIGGER tr_book_copies
+    AFTER INSERT OR UPDATE OF copies_total ON books
+    FOR EACH ROW
+    EXECUTE FUNCTION maintain_book_copies();
+
+-- Сводная статистика читателей (reader_loan_stats)
+CREATE TRIGGER tr_reader_stats_loans
+    AFTER INSERT OR UPDATE OF reader_id, status ON loans
+    FOR EACH ROW
+    EXECUTE FUNCTION maintain_reader_stats_loans();
+
+CREATE TRIGGER tr_reader_stats_loans_delete
+    BEFORE DELETE ON loans
+    FOR EACH ROW
+    EXECUTE FUNCTION maintain_reader_stats_loans();
+
+CREATE TRIGGER tr_reader_stats_fines
+    AFTER INSERT OR UPDATE OF loan_id, loan_date, amount, paid_date OR DELETE ON fines
+    FOR EACH ROW
+    EXECUTE FUNCTION maintain_reader_stats_fines();
+
+-- Итоги выдач (book_loans_daily, category_loans_daily, book_loan_totals)
+CREATE TRIGGER tr_loan_rollups
+    AFTER INSERT OR DELETE ON loans
+    FOR EACH ROW
+    EXECUTE FUNCTION maintain_loan_rollups();
+
+CREATE TRIGGER tr_loan_rollups_update
+    AFTER UPDATE OF book_id, loan_date ON loans
+    FOR EACH ROW
+    WHEN (OLD.book_id IS DISTINCT FROM NEW.book_id OR OLD.loan_date IS DISTINCT FROM NEW.loan_date)
+    EXECUTE FUNCTION maintain_loan_rollups();
+
+-- Строка авторов книги (books.authors_display)
+CREATE TRIGGER tr_authors_display_links
+    AFTER INSERT OR UPDATE OR DELETE ON book_authors
+    FOR EACH ROW
+    EXECUTE FUNCTION maintain_authors_display_links();
+
+CREATE TRIGGER tr_authors_display_names
+    AFTER UPDATE OF last_name, first_name, middle_name ON authors
+    FOR EACH ROW
+    WHEN (OLD.last_name IS DISTINCT FROM NEW.last_name
+          OR OLD.first_name IS DISTINCT FROM NEW.first_name
+          OR OLD.middle_name IS DISTINCT FROM NEW.middle_name)
+    EXECUTE FUNCTION maintain_authors_display_names();
+
+-- Поисковый вектор каталога (books.search_vector)
+CREATE TRIGGER tr_book_search_vector
+    BEFORE INSERT OR UPDATE OF title, isbn, category_id ON books
+    FOR EACH ROW
+    EXECUTE FUNCTION set_book_search_vector();
+
+CREATE TRIGGER tr_search_vector_links
+    AFTER INSERT OR UPDATE OR DELETE ON book_authors
+    FOR EACH ROW
+    EXECUTE FUNCTION maintain_search_vector_links();
+
+CREATE TRIGGER tr_search_vector_names
+    AFTER UPDATE OF last_name, first_name, middle_name ON authors
+    FOR EACH ROW
+    WHEN (OLD.last_name IS DISTINCT FROM NEW.last_name
+          OR OLD.first_name IS DISTINCT FROM NEW.first_name
+          OR OLD.middle_name IS DISTINCT FROM NEW.middle_name)
+    EXECUTE FUNCTION maintain_search_vector_names();
+
+CREATE TRIGGER tr_search_vector_categories
+    AFTER UPDATE OF name ON categories
+    FOR EACH ROW
+    WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION maintain_search_vector_categories();
+
+-- Уведомления кэшей о книгах (канал library_book_changed)
+CREATE TRIGGER tr_notify_books
+    AFTER INSERT OR UPDATE OR DELETE ON books
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_book_changed();
+
+CREATE TRIGGER tr_notify_loans
+    AFTER INSERT OR UPDATE OF book_id, status OR DELETE ON loans
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_book_changed();
+
+CREATE TRIGGER tr_notify_book_authors
+    AFTER INSERT OR UPDATE OR DELETE ON book_authors
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_book_changed();
+
+-- Очередь заявок (каналы library_loan_requests, library_loan_request_done)
+CREATE TRIGGER tr_loan_requests_new
+    AFTER INSERT ON loan_requests
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_loan_requests();
+
+CREATE TRIGGER tr_loan_requests_done
+    AFTER UPDATE OF status ON loan_requests
+    FOR EACH ROW
+    WHEN (OLD.status = 'ожидает' AND NEW.status != 'ожидает')
+    EXECUTE FUNCTION notify_loan_requests();
+
+ANALYZE;
@@ -0,0 +1,37 @@
+"""Python-клиент схемы library.
+
+Оборачивает процедуры issue_book/return_book, пакетные issue_books/
+return_books, check_book_availability, search_books и отчетные
+представления v_* в типизированный API. Соединения общие (пул), запросы
+готовятся на сервере (prepared statements), независимые вызовы наличия
+идут конвейером.
+
+    from library_client import LibraryClient, LibraryError
+
+    with LibraryClient('dbname=library_management', max_size=20) as lib:
+        try:
+            loan_id = lib.issue_book(reader_id=1, book_id=3)
+        except LibraryError as e:
+            print('Отказ:', e)
+        print(lib.availability_many([1, 2, 3]))
+
+        # Через очередь заявок: стойка не ждет блокировок выдачи
+        request_id = lib.request_issue(reader_id=1, book_id=3)
+        print(lib.wait_request(request_id, timeout=5.0))
+
+Асинхронный вариант — AsyncLibraryClient (async with, await). BookCache —
+LRU-кэш наличия и карточек книг, сбрасываемый по LISTEN/NOTIFY.
+Требуется psycopg 3 с пулом (pip install "psycopg[pool]").
+"""
+
+from .aio import AsyncLibraryClient
+from .cache import BookCache
+from .client import LibraryClient
+from .models import (ActiveLoan, Availability, BookDetails, BookPopularity, IssueResult,
+                     LibraryError, LoanRequest, ReaderStatistics, ReturnResult, SearchResult)
+
+__all__ = [
+    'ActiveLoan', 'AsyncLibraryClient', 'Availability', 'BookCache', 'BookDetails', 'BookPopularity',
+    'IssueResult', 'LibraryClient', 'LibraryError', 'LoanRequest', 'ReaderStatistics',
+    'ReturnResult', 'SearchResult',
+]
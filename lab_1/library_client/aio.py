@@ -0,0 +1,143 @@
+# Асинхронный клиент схемы library (asyncio): те же методы, что у
+# LibraryClient, но корутины и AsyncConnectionPool
+
+from __future__ import annotations
+
+import asyncio
+
+from psycopg.rows import class_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+
+from . import queries as q
+from .models import (ActiveLoan, Availability, BookDetails, BookPopularity, IssueResult,
+                     LoanRequest, ReaderStatistics, ReturnResult, SearchResult)
+
+
+class AsyncLibraryClient:
+    """Асинхронный вариант LibraryClient (параметры пула те же)."""
+
+    def __init__(self, conninfo, *, min_size=1, max_size=10, prepare_threshold=0):
+        self.pool = AsyncConnectionPool(
+            conninfo, min_size=min_size, max_size=max_size, open=False,
+            kwargs={'autocommit': True, 'prepare_threshold': prepare_threshold},
+            configure=self._configure,
+        )
+
+    @staticmethod
+    async def _configure(conn):
+        await conn.execute(q.SEARCH_PATH)
+
+    async def open(self):
+        await self.pool.open(wait=True)
+        return self
+
+    async def close(self):
+        await self.pool.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _fetch(self, model, sql, params):
+        async with self.pool.connection() as conn:
+            with q.translate_errors():
+                cur = await conn.cursor(row_factory=class_row(model)).execute(sql, params)
+                return await cur.fetchall()
+
+    async def _fetch_one(self, model, sql, params):
+        rows = await self._fetch(model, sql, params)
+        return rows[0] if rows else None
+
+    # --- выдача и возврат ---
+
+    async def issue_book(self, reader_id: int, book_id: int, notes: str = None) -> int:
+        async with self.pool.connection() as conn:
+            with q.translate_errors():
+                cur = await conn.execute(q.ISSUE_BOOK, (reader_id, book_id, notes))
+                return (await cur.fetchone())[0]
+
+    async def return_book(self, loan_id: int, return_date=None) -> None:
+        async with self.pool.connection() as conn:
+            with q.translate_errors():
+                await conn.execute(q.RETURN_BOOK, (loan_id, return_date))
+
+    async def issue_books(self, requests) -> list[IssueResult]:
+        return await self._fetch(IssueResult, q.ISSUE_BOOKS, (Jsonb(list(requests)),))
+
+    async def return_books(self, loan_ids, return_date=None) -> list[ReturnResult]:
+        return await self._fetch(ReturnResult, q.RETURN_BOOKS, (list(loan_ids), return_date))
+
+    # --- очередь заявок ---
+
+    async def request_issue(self, reader_id: int, book_id: int, notes: str = None) -> int:
+        async with self.pool.connection() as conn:
+            cur = await conn.execute(q.REQUEST_ISSUE, (reader_id, book_id, notes))
+            return (await cur.fetchone())[0]
+
+    async def request_return(self, loan_id: int, return_date=None) -> int:
+        async with self.pool.connection() as conn:
+            cur = await conn.execute(q.REQUEST_RETURN, (loan_id, return_date))
+            return (await cur.fetchone())[0]
+
+    async def loan_request(self, request_id: int) -> LoanRequest | None:
+        return await self._fetch_one(LoanRequest, q.LOAN_REQUEST, (request_id,))
+
+    async def wait_request(self, request_id: int, timeout: float = 10.0) -> LoanRequest | None:
+        """Ждет обработки заявки по уведомлению воркера (см. LibraryClient)."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        async with self.pool.connection() as conn:
+            await conn.execute(f'LISTEN {q.REQUEST_DONE_CHANNEL}')
+            try:
+                cur = conn.cursor(row_factory=class_row(LoanRequest))
+                request = await (await cur.execute(q.LOAN_REQUEST, (request_id,))).fetchone()
+                while request is not None and request.status == 'ожидает':
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    async for notify in conn.notifies(timeout=remaining):
+                        if notify.payload == str(request_id):
+                            break
+                    request = await (await cur.execute(q.LOAN_REQUEST, (request_id,))).fetchone()
+                return request
+            finally:
+                await conn.execute(f'UNLISTEN {q.REQUEST_DONE_CHANNEL}')
+
+    # --- наличие и каталог ---
+
+    async def check_availability(self, book_id: int) -> Availability | None:
+        return await self._fetch_one(Availability, q.AVAILABILITY, {'book_id': book_id})
+
+    async def availability_many(self, book_ids) -> dict[int, Availability]:
+        """Наличие нескольких книг конвейером в одном соединении."""
+        async with self.pool.connection() as conn:
+            async with conn.pipeline():
+                cursors = [await conn.cursor(row_factory=class_row(Availability))
+                           .execute(q.AVAILABILITY, {'book_id': book_id})
+                           for book_id in book_ids]
+            rows = [await cur.fetchone() for cur in cursors]
+        return {row.book_id: row for row in rows if row is not None}
+
+    async def book_details(self, book_id: int) -> BookDetails | None:
+        return await self._fetch_one(BookDetails, q.BOOK_DETAILS, (book_id,))
+
+    async def books_details(self, book_ids) -> list[BookDetails]:
+        return await self._fetch(BookDetails, q.BOOKS_DETAILS, (list(book_ids),))
+
+    async def search_books(self, query: str, limit: int = 20) -> list[SearchResult]:
+        return await self._fetch(SearchResult, q.SEARCH_BOOKS, (query, limit))
+
+    # --- отчеты ---
+
+    async def active_loans(self, overdue_only: bool = False, limit: int = 100) -> list[ActiveLoan]:
+        return await self._fetch(ActiveLoan, q.OVERDUE_LOANS if overdue_only else q.ACTIVE_LOANS,
+                                 (limit,))
+
+    async def reader_statistics(self, reader_id: int) -> ReaderStatistics | None:
+        return await self._fetch_one(ReaderStatistics, q.READER_STATISTICS, (reader_id,))
+
+    async def book_popularity(self, limit: int = 10) -> list[BookPopularity]:
+        return await self._fetch(BookPopularity, q.BOOK_POPULARITY, (limit,))
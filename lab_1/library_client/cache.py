@@ -0,0 +1,136 @@
+# Кэш наличия и карточек книг в памяти процесса
+#
+# Записи вытесняются по LRU сверх maxsize и удаляются по уведомлениям
+# NOTIFY library_book_changed, которые посылают триггеры books, loans и
+# book_authors (notify_book_changed в script_1.py). Устаревшее значение
+# живет не дольше задержки доставки уведомления. Пока соединение LISTEN
+# не установлено или потеряно, кэш очищен и запросы идут в базу.
+#
+#     with LibraryClient(dsn) as lib, BookCache(lib, dsn, maxsize=50_000) as cache:
+#         cache.availability(3)
+#         cache.book_details(3)
+#
+# Требуется psycopg 3.2+ (notifies с timeout).
+
+import threading
+from collections import OrderedDict
+
+import psycopg
+
+NOTIFY_CHANNEL = 'library_book_changed'
+
+
+class BookCache:
+    """LRU-кэш Availability и BookDetails по book_id поверх LibraryClient."""
+
+    def __init__(self, client, conninfo, *, maxsize=10_000, reconnect_delay=1.0):
+        self.client = client
+        self.conninfo = conninfo
+        self.maxsize = maxsize
+        self.reconnect_delay = reconnect_delay
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (вид, book_id) -> значение
+        # book_id -> [число идущих загрузок, пришло ли уведомление за это время]
+        self._loading = {}
+        self._lock = threading.Lock()
+        self._listening = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, timeout=10.0):
+        """Запускает поток LISTEN и ждет подписки на канал."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, name='book-cache-listen', daemon=True)
+        self._thread.start()
+        self._listening.wait(timeout)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- чтение ---
+
+    def availability(self, book_id):
+        return self._get('availability', book_id, self.client.check_availability)
+
+    def book_details(self, book_id):
+        return self._get('details', book_id, self.client.book_details)
+
+    def _get(self, kind, book_id, load):
+        if not self._listening.is_set():
+            return load(book_id)
+        key = (kind, book_id)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            state = self._loading.setdefault(book_id, [0, False])
+            state[0] += 1
+        try:
+            value = load(book_id)
+        except BaseException:
+            with self._lock:
+                self._release(book_id, state)
+            raise
+        with self._lock:
+            stale = self._release(book_id, state)
+            # Уведомление пришло во время загрузки: значение могло устареть
+            if value is not None and not stale and self._listening.is_set():
+                self._entries[key] = value
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return value
+
+    def _release(self, book_id, state):
+        state[0] -= 1
+        if state[0] == 0:
+            del self._loading[book_id]
+        return state[1]
+
+    # --- сброс ---
+
+    def invalidate(self, book_id):
+        with self._lock:
+            self._entries.pop(('availability', book_id), None)
+            self._entries.pop(('details', book_id), None)
+            state = self._loading.get(book_id)
+            if state is not None:
+                state[1] = True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for state in self._loading.values():
+                state[1] = True
+
+    def _listen(self):
+        while not self._stop.is_set():
+            try:
+                with psycopg.connect(self.conninfo, autocommit=True) as conn:
+                    conn.execute(f'LISTEN {NOTIFY_CHANNEL}')
+                    self._listening.set()
+                    while not self._stop.is_set():
+                        for notify in conn.notifies(timeout=1.0):
+                            try:
+                                self.invalidate(int(notify.payload))
+                            except ValueError:
+                                self.clear()
+            except psycopg.OperationalError:
+                pass
+            finally:
+                # Уведомления за время разрыва потеряны: не доверяем ничему
+                self._listening.clear()
+                self.clear()
+            self._stop.wait(self.reconnect_delay)
@@ -0,0 +1,148 @@
+# Синхронный клиент схемы library (терминалы выдачи, пакетные задания)
+
+from __future__ import annotations
+
+import time
+
+from psycopg.rows import class_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import ConnectionPool
+
+from . import queries as q
+from .models import (ActiveLoan, Availability, BookDetails, BookPopularity, IssueResult,
+                     LoanRequest, ReaderStatistics, ReturnResult, SearchResult)
+
+
+class LibraryClient:
+    """Типизированный доступ к процедурам и представлениям library.
+
+    Соединения берутся из общего пула на время одного вызова и работают в
+    режиме autocommit: каждый вызов процедуры — отдельная транзакция.
+    При prepare_threshold=0 каждый запрос готовится на сервере при первом
+    выполнении в соединении; для pgbouncer в режиме transaction передайте
+    prepare_threshold=None.
+    """
+
+    def __init__(self, conninfo, *, min_size=1, max_size=10, prepare_threshold=0):
+        self.pool = ConnectionPool(
+            conninfo, min_size=min_size, max_size=max_size, open=False,
+            kwargs={'autocommit': True, 'prepare_threshold': prepare_threshold},
+            configure=self._configure,
+        )
+
+    @staticmethod
+    def _configure(conn):
+        conn.execute(q.SEARCH_PATH)
+
+    def open(self):
+        self.pool.open(wait=True)
+        return self
+
+    def close(self):
+        self.pool.close()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _fetch(self, model, sql, params):
+        with self.pool.connection() as conn, q.translate_errors():
+            return conn.cursor(row_factory=class_row(model)).execute(sql, params).fetchall()
+
+    def _fetch_one(self, model, sql, params):
+        rows = self._fetch(model, sql, params)
+        return rows[0] if rows else None
+
+    # --- выдача и возврат ---
+
+    def issue_book(self, reader_id: int, book_id: int, notes: str = None) -> int:
+        """Выдает книгу и возвращает loan_id; при отказе (читатель
+        неактивен, есть просрочки, нет экземпляров) поднимает LibraryError."""
+        with self.pool.connection() as conn, q.translate_errors():
+            return conn.execute(q.ISSUE_BOOK, (reader_id, book_id, notes)).fetchone()[0]
+
+    def return_book(self, loan_id: int, return_date=None) -> None:
+        with self.pool.connection() as conn, q.translate_errors():
+            conn.execute(q.RETURN_BOOK, (loan_id, return_date))
+
+    def issue_books(self, requests) -> list[IssueResult]:
+        """Пакетная выдача: requests — словари с reader_id, book_id и
+        необязательным notes. Ошибки возвращаются по позициям."""
+        return self._fetch(IssueResult, q.ISSUE_BOOKS, (Jsonb(list(requests)),))
+
+    def return_books(self, loan_ids, return_date=None) -> list[ReturnResult]:
+        return self._fetch(ReturnResult, q.RETURN_BOOKS, (list(loan_ids), return_date))
+
+    # --- очередь заявок ---
+
+    def request_issue(self, reader_id: int, book_id: int, notes: str = None) -> int:
+        """Ставит заявку на выдачу в очередь loan_requests и сразу
+        возвращает request_id; выдачу выполнит воркер."""
+        with self.pool.connection() as conn:
+            return conn.execute(q.REQUEST_ISSUE, (reader_id, book_id, notes)).fetchone()[0]
+
+    def request_return(self, loan_id: int, return_date=None) -> int:
+        with self.pool.connection() as conn:
+            return conn.execute(q.REQUEST_RETURN, (loan_id, return_date)).fetchone()[0]
+
+    def loan_request(self, request_id: int) -> LoanRequest | None:
+        return self._fetch_one(LoanRequest, q.LOAN_REQUEST, (request_id,))
+
+    def wait_request(self, request_id: int, timeout: float = 10.0) -> LoanRequest | None:
+        """Ждет обработки заявки по уведомлению воркера не дольше timeout
+        секунд; возвращает заявку (со статусом 'ожидает', если не дождались)."""
+        deadline = time.monotonic() + timeout
+        with self.pool.connection() as conn:
+            conn.execute(f'LISTEN {q.REQUEST_DONE_CHANNEL}')
+            try:
+                cur = conn.cursor(row_factory=class_row(LoanRequest))
+                request = cur.execute(q.LOAN_REQUEST, (request_id,)).fetchone()
+                while request is not None and request.status == 'ожидает':
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    for notify in conn.notifies(timeout=remaining):
+                        if notify.payload == str(request_id):
+                            break
+                    request = cur.execute(q.LOAN_REQUEST, (request_id,)).fetchone()
+                return request
+            finally:
+                conn.execute(f'UNLISTEN {q.REQUEST_DONE_CHANNEL}')
+
+    # --- наличие и каталог ---
+
+    def check_availability(self, book_id: int) -> Availability | None:
+        return self._fetch_one(Availability, q.AVAILABILITY, {'book_id': book_id})
+
+    def availability_many(self, book_ids) -> dict[int, Availability]:
+        """Наличие нескольких книг за один обмен с сервером: вызовы
+        check_book_availability отправляются конвейером (pipeline)."""
+        with self.pool.connection() as conn:
+            with conn.pipeline():
+                cursors = [conn.cursor(row_factory=class_row(Availability))
+                           .execute(q.AVAILABILITY, {'book_id': book_id})
+                           for book_id in book_ids]
+            rows = [cur.fetchone() for cur in cursors]
+        return {row.book_id: row for row in rows if row is not None}
+
+    def book_details(self, book_id: int) -> BookDetails | None:
+        return self._fetch_one(BookDetails, q.BOOK_DETAILS, (book_id,))
+
+    def books_details(self, book_ids) -> list[BookDetails]:
+        return self._fetch(BookDetails, q.BOOKS_DETAILS, (list(book_ids),))
+
+    def search_books(self, query: str, limit: int = 20) -> list[SearchResult]:
+        return self._fetch(SearchResult, q.SEARCH_BOOKS, (query, limit))
+
+    # --- отчеты ---
+
+    def active_loans(self, overdue_only: bool = False, limit: int = 100) -> list[ActiveLoan]:
+        return self._fetch(ActiveLoan, q.OVERDUE_LOANS if overdue_only else q.ACTIVE_LOANS, (limit,))
+
+    def reader_statistics(self, reader_id: int) -> ReaderStatistics | None:
+        return self._fetch_one(ReaderStatistics, q.READER_STATISTICS, (reader_id,))
+
+    def book_popularity(self, limit: int = 10) -> list[BookPopularity]:
+        return self._fetch(BookPopularity, q.BOOK_POPULARITY, (limit,))
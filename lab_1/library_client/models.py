@@ -0,0 +1,124 @@
+# Типизированные результаты клиента: поля совпадают со столбцами
+# представлений и функций схемы library (строки читаются через class_row)
+
+import datetime as dt
+from dataclasses import dataclass, fields
+from decimal import Decimal
+from typing import Optional
+
+
+class LibraryError(Exception):
+    """Отказ бизнес-правила схемы (RAISE EXCEPTION в процедуре или триггере)."""
+
+
+@dataclass(frozen=True)
+class Availability:
+    book_id: int
+    available: bool
+    copies_available: int
+    copies_total: int
+
+
+@dataclass(frozen=True)
+class BookDetails:
+    book_id: int
+    title: str
+    isbn: Optional[str]
+    publication_year: Optional[int]
+    pages: Optional[int]
+    copies_total: int
+    copies_available: int
+    availability_percent: Decimal
+    category_name: str
+    language: Optional[str]
+    authors: Optional[str]
+
+
+@dataclass(frozen=True)
+class ActiveLoan:
+    loan_id: int
+    reader_full_name: str
+    reader_type: str
+    phone: Optional[str]
+    email: Optional[str]
+    book_title: str
+    isbn: Optional[str]
+    loan_date: dt.date
+    due_date: dt.date
+    days_overdue: int
+    status_description: str
+    notes: Optional[str]
+
+
+@dataclass(frozen=True)
+class ReaderStatistics:
+    reader_id: int
+    reader_name: str
+    reader_type: str
+    registration_date: Optional[dt.date]
+    total_loans: int
+    active_loans: int
+    overdue_loans: int
+    returned_loans: int
+    total_fines: Decimal
+    unpaid_fines: Decimal
+    reader_status: str
+
+
+@dataclass(frozen=True)
+class BookPopularity:
+    book_id: int
+    title: str
+    authors: Optional[str]
+    category_name: str
+    loan_count: int
+    loans_last_month: int
+    loans_last_week: int
+    copies_total: int
+    copies_available: int
+    loans_per_copy: Optional[Decimal]
+
+
+@dataclass(frozen=True)
+class SearchResult:
+    book_id: int
+    title: str
+    authors: Optional[str]
+    category_name: str
+    isbn: Optional[str]
+    rank: float
+
+
+@dataclass(frozen=True)
+class IssueResult:
+    item_no: int
+    reader_id: Optional[int]
+    book_id: Optional[int]
+    loan_id: Optional[int]
+    success: bool
+    message: str
+
+
+@dataclass(frozen=True)
+class ReturnResult:
+    item_no: int
+    loan_id: Optional[int]
+    fine_amount: Optional[Decimal]
+    success: bool
+    message: str
+
+
+@dataclass(frozen=True)
+class LoanRequest:
+    request_id: int
+    operation: str
+    status: str
+    result_loan_id: Optional[int]
+    message: Optional[str]
+    created_at: dt.datetime
+    processed_at: Optional[dt.datetime]
+
+
+def columns(model):
+    """Список столбцов SELECT для модели в порядке ее полей."""
+    return ', '.join(f.name for f in fields(model))
@@ -0,0 +1,52 @@
+# Тексты запросов, общие для синхронного и асинхронного клиентов.
+# Каждый текст постоянен, поэтому psycopg готовит его на сервере один раз
+# на соединение (prepare_threshold) и дальше передает только параметры.
+
+from contextlib import contextmanager
+
+import psycopg
+
+from .models import (ActiveLoan, BookDetails, BookPopularity, IssueResult, LibraryError,
+                     LoanRequest, ReaderStatistics, ReturnResult, SearchResult, columns)
+
+SEARCH_PATH = 'SET search_path TO library, public'
+
+ISSUE_BOOK = 'CALL issue_book(%s, %s, %s)'  # строка с INOUT loan_id
+RETURN_BOOK = 'CALL return_book(%s, COALESCE(%s::date, CURRENT_DATE))'
+
+ISSUE_BOOKS = f'SELECT {columns(IssueResult)} FROM issue_books(%s::jsonb)'
+RETURN_BOOKS = (f'SELECT {columns(ReturnResult)} '
+                'FROM return_books(%s::integer[], COALESCE(%s::date, CURRENT_DATE))')
+
+# Очередь заявок: выполняет воркер (loan_queue_worker.py), о результате
+# сообщает NOTIFY на REQUEST_DONE_CHANNEL с request_id
+REQUEST_ISSUE = 'SELECT request_issue(%s, %s, %s)'
+REQUEST_RETURN = 'SELECT request_return(%s, COALESCE(%s::date, CURRENT_DATE))'
+LOAN_REQUEST = f'SELECT {columns(LoanRequest)} FROM loan_requests WHERE request_id = %s'
+REQUEST_DONE_CHANNEL = 'library_loan_request_done'
+
+AVAILABILITY = ('SELECT %(book_id)s::integer AS book_id, available, copies_available, copies_total '
+                'FROM check_book_availability(%(book_id)s)')
+
+BOOK_DETAILS = f'SELECT {columns(BookDetails)} FROM v_books_detailed WHERE book_id = %s'
+BOOKS_DETAILS = (f'SELECT {columns(BookDetails)} FROM v_books_detailed '
+                 'WHERE book_id = ANY(%s::integer[]) ORDER BY book_id')
+ACTIVE_LOANS = f'SELECT {columns(ActiveLoan)} FROM v_active_loans LIMIT %s'
+OVERDUE_LOANS = f'SELECT {columns(ActiveLoan)} FROM v_active_loans WHERE days_overdue > 0 LIMIT %s'
+READER_STATISTICS = f'SELECT {columns(ReaderStatistics)} FROM v_reader_statistics WHERE reader_id = %s'
+# Представление не упорядочено: первые книги по общему числу выдач
+# берутся из индекса book_loan_totals
+BOOK_POPULARITY = (f'SELECT {columns(BookPopularity)} FROM v_book_popularity '
+                   'WHERE book_id IN (SELECT book_id FROM book_loan_totals '
+                   'ORDER BY loans DESC, book_id LIMIT %s) '
+                   'ORDER BY loan_count DESC, book_id')
+SEARCH_BOOKS = f'SELECT {columns(SearchResult)} FROM search_books(%s, %s)'
+
+
+@contextmanager
+def translate_errors():
+    """RAISE EXCEPTION из схемы (SQLSTATE P0001) -> LibraryError с текстом сообщения."""
+    try:
+        yield
+    except psycopg.errors.RaiseException as e:
+        raise LibraryError(e.diag.message_primary) from e
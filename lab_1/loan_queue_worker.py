@@ -0,0 +1,204 @@
+# Воркеры очереди заявок на выдачу и возврат (таблица loan_requests)
+#
+# Стойки выдачи и киоски не вызывают issue_book/return_book сами, а ставят
+# заявку (request_issue, request_return или методы LibraryClient) и ждут
+# результата по уведомлению library_loan_request_done. Пул воркеров — по
+# соединению на поток — разбирает очередь:
+#   1. SELECT ... FOR UPDATE SKIP LOCKED забирает до --batch ожидающих
+#      заявок по порядку поступления; заявки, взятые другим воркером,
+#      пропускаются без ожидания;
+#   2. каждая заявка выполняется в своей точке сохранения: CALL issue_book
+#      или CALL return_book; отказ процедуры (RAISE EXCEPTION) откатывает
+#      только ее и отклоняет заявку с сообщением процедуры;
+#   3. результаты пачки записываются одним UPDATE, COMMIT — один на
+#      пачку. Триггер tr_loan_requests_done рассылает request_id
+#      обработанных заявок.
+# Взаимоблокировки, конфликты сериализации и отмена по тайм-ауту не
+# отклоняют заявку: она остается в очереди и повторяется, пока attempts не
+# достигнет --max-attempts. Пустая очередь — воркер ждет уведомления
+# library_loan_requests (не дольше --poll секунд).
+#
+#     python loan_queue_worker.py --dsn "dbname=library_management" --workers 4
+#     python loan_queue_worker.py --dsn ... --workers 8 --until-empty
+#
+# Порядок заявок соблюдается в пределах воркера; заявки разных воркеров
+# выполняются параллельно, как одновременные вызовы процедур.
+# Требуется psycopg 3.2+ (pip install psycopg).
+
+import argparse
+import sys
+import threading
+import time
+
+import psycopg
+
+CLAIM = """
+SELECT request_id, operation, reader_id, book_id, loan_id, return_date, notes
+FROM loan_requests
+WHERE status = 'ожидает'
+ORDER BY request_id
+LIMIT %s
+FOR UPDATE SKIP LOCKED
+"""
+
+# Последний параметр INOUT loan_id возвращает номер выдачи
+ISSUE = 'CALL issue_book(%s, %s, %s)'
+RETURN = 'CALL return_book(%s, %s)'
+
+# status NULL — заявка остается в очереди для повтора
+SAVE_RESULTS = """
+UPDATE loan_requests r
+SET status = COALESCE(u.status, r.status),
+    attempts = r.attempts + 1,
+    result_loan_id = u.loan_id,
+    message = u.message,
+    processed_at = CASE WHEN u.status IS NOT NULL THEN CURRENT_TIMESTAMP END
+FROM unnest(%s::BIGINT[], %s::TEXT[], %s::INTEGER[], %s::TEXT[])
+    AS u(request_id, status, loan_id, message)
+WHERE r.request_id = u.request_id
+"""
+
+# Ошибки конкуренции и тайм-ауты (lock_timeout, statement_timeout):
+# заявку можно повторить
+RETRYABLE = (psycopg.errors.DeadlockDetected, psycopg.errors.SerializationFailure,
+             psycopg.errors.LockNotAvailable, psycopg.errors.QueryCanceled)
+
+WAKEUP_CHANNEL = 'library_loan_requests'
+
+
+class Worker(threading.Thread):
+    def __init__(self, number, args, stop, stats):
+        super().__init__(name=f'worker-{number}', daemon=True)
+        self.args = args
+        self.stop = stop
+        self.stats = stats
+
+    def run(self):
+        try:
+            with psycopg.connect(self.args.dsn, autocommit=True) as conn:
+                conn.execute('SET search_path TO library, public')
+                conn.execute(f'LISTEN {WAKEUP_CHANNEL}')
+                while not self.stop.is_set():
+                    if self.process_batch(conn):
+                        continue
+                    if self.args.until_empty:
+                        break
+                    # Очередь пуста: ждем новую заявку или --poll секунд
+                    for _ in conn.notifies(timeout=self.args.poll, stop_after=1):
+                        pass
+        except psycopg.Error as e:
+            self.stats.failed(f'{self.name}: {e}')
+
+    def process_batch(self, conn):
+        """Одна пачка в одной транзакции; False, если заявок не было."""
+        started = time.perf_counter()
+        with conn.transaction():
+            requests = conn.execute(CLAIM, (self.args.batch,)).fetchall()
+            if not requests:
+                return False
+            results = [self.process(conn, *request) for request in requests]
+            conn.execute(SAVE_RESULTS, [list(column) for column in zip(*results)])
+        self.stats.add(results, time.perf_counter() - started)
+        return True
+
+    def process(self, conn, request_id, operation, reader_id, book_id, loan_id,
+                return_date, notes):
+        """Выполняет заявку; (request_id, статус, loan_id, сообщение)."""
+        try:
+            with conn.transaction():
+                if operation == 'выдача':
+                    issued = conn.execute(ISSUE, (reader_id, book_id, notes)).fetchone()[0]
+                    return request_id, 'выполнена', issued, 'Книга выдана'
+                conn.execute(RETURN, (loan_id, return_date))
+                return request_id, 'выполнена', loan_id, 'Книга возвращена'
+        except RETRYABLE as e:
+            return self.retry(conn, request_id, e)
+        except psycopg.errors.RaiseException as e:
+            return request_id, 'отклонена', None, e.diag.message_primary
+        except psycopg.OperationalError as e:
+            if conn.broken or conn.closed:
+                raise  # соединение потеряно: пачка откатывается, воркер завершается
+            return self.retry(conn, request_id, e)
+        except psycopg.DatabaseError as e:
+            # Прочие ошибки данных (нарушение ограничения и т.п.) повторять
+            # бессмысленно
+            return request_id, 'отклонена', None, e.diag.message_primary or str(e)
+
+    def retry(self, conn, request_id, error):
+        """Оставляет заявку в очереди, пока не исчерпаны попытки."""
+        attempts = conn.execute('SELECT attempts FROM loan_requests WHERE request_id = %s',
+                                (request_id,)).fetchone()[0]
+        status = 'отклонена' if attempts + 1 >= self.args.max_attempts else None
+        return request_id, status, None, error.diag.message_primary or str(error)
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.done = self.rejected = self.retried = self.batches = 0
+        self.batch_seconds = 0.0
+        self.errors = []
+
+    def add(self, results, seconds):
+        with self.lock:
+            self.batches += 1
+            self.batch_seconds += seconds
+            for _, status, _, _ in results:
+                if status == 'выполнена':
+                    self.done += 1
+                elif status == 'отклонена':
+                    self.rejected += 1
+                else:
+                    self.retried += 1
+
+    def failed(self, message):
+        with self.lock:
+            self.errors.append(message)
+
+
+def run(args):
+    stop = threading.Event()
+    stats = Stats()
+    workers = [Worker(n, args, stop, stats) for n in range(1, args.workers + 1)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    try:
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        stop.set()
+        for worker in workers:
+            worker.join()
+    seconds = time.perf_counter() - started
+
+    for error in stats.errors:
+        print(f'✗ {error}', file=sys.stderr)
+    processed = stats.done + stats.rejected
+    mean_batch = stats.batch_seconds / stats.batches * 1000 if stats.batches else 0.0
+    print(f'✓ Воркеров {args.workers}: выполнено {stats.done}, отклонено {stats.rejected}, '
+          f'повторов {stats.retried} за {seconds:.1f} с '
+          f'({processed / seconds if seconds else 0:.1f} заявок/с, '
+          f'пачек {stats.batches}, в среднем {mean_batch:.1f} мс)', file=sys.stderr)
+    return 1 if stats.errors else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Воркеры очереди заявок loan_requests')
+    parser.add_argument('--dsn', required=True, help='строка подключения PostgreSQL')
+    parser.add_argument('--workers', type=int, default=4, help='потоков (соединений)')
+    parser.add_argument('--batch', type=int, default=20, help='заявок в транзакции')
+    parser.add_argument('--max-attempts', type=int, default=5,
+                        help='попыток заявки при взаимоблокировках и конфликтах')
+    parser.add_argument('--poll', type=float, default=5.0,
+                        help='ожидание уведомления при пустой очереди, с')
+    parser.add_argument('--until-empty', action='store_true',
+                        help='завершиться, когда очередь опустеет')
+    args = parser.parse_args(argv)
+    if args.workers < 1 or args.batch < 1 or args.max_attempts < 1:
+        parser.error('--workers, --batch и --max-attempts должны быть положительными')
+    raise SystemExit(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+# Профиль функций, триггеров и запросов схемы library
+#
+# Снимки счетчиков:
+#   pg_stat_user_functions — вызовы, общее (total) и собственное (self)
+#                            время функций, процедур и триггерных функций
+#                            схемы library (нужен track_functions = pl/all);
+#   pg_stat_statements     — вызовы, время, строки и буферы запросов
+#                            текущей базы, в тексте которых встречаются
+#                            таблицы, представления или функции library.
+# Отчет по разнице двух снимков ранжирует функции по собственному времени,
+# а запросы — по общему, и показывает долю времени внутри функций
+# относительно времени запросов верхнего уровня. С --log добавляются самые
+# медленные планы auto_explain из журнала сервера.
+#
+#     python profile_report.py setup --dsn "dbname=library_management"
+#     python profile_report.py window --dsn "dbname=library_management" \
+#         -- python bench_procedures.py run --dsn "host=/tmp" --scales small
+#     python profile_report.py snapshot --dsn ... -o before.json
+#     ... рабочая нагрузка ...
+#     python profile_report.py snapshot --dsn ... -o after.json
+#     python profile_report.py report before.json after.json --log postgresql.log
+#
+# setup (от суперпользователя) включает для базы track_functions = 'all',
+# pg_stat_statements.track = 'all' (вложенные запросы функций) и, с
+# --auto-explain-ms, загрузку auto_explain в новые сеансы; reset
+# возвращает настройки базы. Расширение pg_stat_statements требует
+# shared_preload_libraries = 'pg_stat_statements' и перезапуска сервера.
+#
+# Требуется psycopg 3 (pip install psycopg).
+
+import argparse
+import datetime as dt
+import json
+import re
+import subprocess
+import sys
+import time
+
+import psycopg
+from psycopg import sql
+from psycopg.rows import dict_row
+
+DB_SETTINGS = ('track_functions', 'pg_stat_statements.track', 'session_preload_libraries',
+               'auto_explain.log_min_duration', 'auto_explain.log_analyze',
+               'auto_explain.log_buffers', 'auto_explain.log_nested_statements')
+
+FUNCTIONS = """
+SELECT p.oid::regprocedure::text AS name,
+       CASE p.prokind WHEN 'p' THEN 'процедура'
+                      ELSE CASE WHEN p.prorettype = 'trigger'::regtype THEN 'триггер'
+                                ELSE 'функция' END END AS kind,
+       f.calls, f.total_time AS total_ms, f.self_time AS self_ms
+FROM pg_stat_user_functions f
+JOIN pg_proc p ON p.oid = f.funcid
+WHERE f.schemaname = 'library'
+"""
+
+LIBRARY_OBJECTS = """
+SELECT c.relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = 'library' AND c.relkind IN ('r', 'v', 'm', 'p')
+UNION
+SELECT p.proname FROM pg_proc p JOIN pg_namespace n ON n.oid = p.pronamespace
+WHERE n.nspname = 'library'
+"""
+
+STATEMENTS = """
+SELECT s.*
+FROM pg_stat_statements s
+WHERE s.dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+"""
+
+
+# ---------------------------------------------------------------------
+# СНИМКИ
+# ---------------------------------------------------------------------
+
+def take_snapshot(conn):
+    conn.row_factory = dict_row
+    snapshot = {
+        'taken_at': dt.datetime.now().isoformat(timespec='seconds'),
+        'database': conn.info.dbname,
+        'settings': {name: conn.execute('SELECT current_setting(%s, true) AS v',
+                                        (name,)).fetchone()['v'] for name in DB_SETTINGS},
+        'functions': {},
+        'statements': {},
+    }
+    if snapshot['settings']['track_functions'] == 'none':
+        print('Внимание: track_functions = none, функции не учитываются '
+              '(см. profile_report.py setup)', file=sys.stderr)
+    for row in conn.execute(FUNCTIONS):
+        snapshot['functions'][row.pop('name')] = row
+
+    installed = conn.execute(
+        "SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'").fetchone()
+    if not installed:
+        print('Внимание: расширение pg_stat_statements не установлено', file=sys.stderr)
+        return snapshot
+    names = sorted(row['relname'] for row in conn.execute(LIBRARY_OBJECTS))
+    scope = re.compile(r'\b(?:library\.|' + '|'.join(map(re.escape, names)) + r')\b', re.I) \
+        if names else None
+    for row in conn.execute(STATEMENTS):
+        if scope is None or not scope.search(row['query'] or ''):
+            continue
+        toplevel = row.get('toplevel', True)  # столбец есть с PostgreSQL 14
+        key = f'{row["queryid"]}:{row["userid"]}:{int(toplevel)}'
+        snapshot['statements'][key] = {
+            'query': row['query'],
+            'toplevel': toplevel,
+            'calls': row['calls'],
+            'total_ms': row.get('total_exec_time', row.get('total_time')),
+            'rows': row['rows'],
+            'shared_hit': row['shared_blks_hit'],
+            'shared_read': row['shared_blks_read'],
+        }
+    return snapshot
+
+
+def connect(dsn):
+    conn = psycopg.connect(dsn, autocommit=True)
+    conn.execute('SET search_path TO library, public')
+    return conn
+
+
+def write_json(path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def read_json(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+# ---------------------------------------------------------------------
+# РАЗНИЦА И ОТЧЕТ
+# ---------------------------------------------------------------------
+
+def delta(before, after, fields):
+    """Разница счетчиков по ключам; сброс статистики между снимками —
+    значения после сброса берутся целиком."""
+    result = {}
+    for key, new in after.items():
+        old = before.get(key)
+        if old is None or new['calls'] < old['calls']:
+            old = {field: 0 for field in fields}
+        diff = {field: new[field] - old[field] for field in fields}
+        if diff['calls'] > 0:
+            result[key] = {**new, **diff}
+    return result
+
+
+def slow_plans(path, top):
+    """Самые долгие записи auto_explain («duration: ... ms  plan:») из журнала."""
+    plans = []
+    current = None
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            match = re.search(r'duration: ([\d.]+) ms\s+plan:', line)
+            if match:
+                current = {'duration_ms': float(match.group(1)), 'plan': []}
+                plans.append(current)
+            elif current is not None and line[:1] in ('\t', ' ') and line.strip():
+                current['plan'].append(line.rstrip())
+            else:
+                current = None
+    plans.sort(key=lambda p: -p['duration_ms'])
+    return plans[:top]
+
+
+def build_report(before, after, top, log=None):
+    functions = delta(before['functions'], after['functions'], ('calls', 'total_ms', 'self_ms'))
+    statements = delta(before['statements'], after['statements'],
+                       ('calls', 'total_ms', 'rows', 'shared_hit', 'shared_read'))
+    toplevel_ms = sum(s['total_ms'] for s in statements.values() if s['toplevel'])
+    functions_self_ms = sum(f['self_ms'] for f in functions.values())
+    report = {
+        'window': [before['taken_at'], after['taken_at']],
+        'database': after['database'],
+        'settings': after['settings'],
+        'toplevel_statements_ms': round(toplevel_ms, 3),
+        'functions_self_ms': round(functions_self_ms, 3),
+        'functions': [],
+        'statements': [],
+    }
+    for name, f in sorted(functions.items(), key=lambda item: -item[1]['self_ms'])[:top]:
+        report['functions'].append({
+            'name': name, 'kind': f['kind'], 'calls': f['calls'],
+            'total_ms': round(f['total_ms'], 3), 'self_ms': round(f['self_ms'], 3),
+            'mean_ms': round(f['total_ms'] / f['calls'], 4),
+            'self_share': round(f['self_ms'] / toplevel_ms * 100, 2) if toplevel_ms else None,
+        })
+    for s in sorted(statements.values(), key=lambda s: -s['total_ms'])[:top]:
+        blocks = s['shared_hit'] + s['shared_read']
+        report['statements'].append({
+            'query': s['query'], 'toplevel': s['toplevel'], 'calls': s['calls'],
+            'total_ms': round(s['total_ms'], 3), 'mean_ms': round(s['total_ms'] / s['calls'], 4),
+            'rows': s['rows'],
+            'share': round(s['total_ms'] / toplevel_ms * 100, 2) if toplevel_ms and s['toplevel']
+            else None,
+            'hit_ratio': round(s['shared_hit'] / blocks * 100, 1) if blocks else None,
+        })
+    if log:
+        report['slow_plans'] = slow_plans(log, top)
+    return report
+
+
+def one_line(text, width):
+    text = ' '.join(text.split())
+    return text if len(text) <= width else text[:width - 1] + '…'
+
+
+def print_report(report):
+    print(f'Окно: {report["window"][0]} — {report["window"][1]}, база {report["database"]}')
+    total = report['toplevel_statements_ms']
+    inside = report['functions_self_ms']
+    if total:
+        print(f'Запросы верхнего уровня: {total:.1f} мс, собственное время функций: '
+              f'{inside:.1f} мс ({inside / total * 100:.1f}%)')
+
+    print('\n=== ФУНКЦИИ, ПРОЦЕДУРЫ, ТРИГГЕРЫ (по собственному времени) ===')
+    print(f'{"#":>3} {"вызовы":>9} {"всего, мс":>11} {"своё, мс":>11} {"ср., мс":>9} '
+          f'{"доля, %":>8}  имя')
+    for i, f in enumerate(report['functions'], 1):
+        share = f'{f["self_share"]:>8.2f}' if f['self_share'] is not None else f'{"—":>8}'
+        print(f'{i:>3} {f["calls"]:>9} {f["total_ms"]:>11.1f} {f["self_ms"]:>11.1f} '
+              f'{f["mean_ms"]:>9.3f} {share}  {f["name"]} ({f["kind"]})')
+    if not report['functions']:
+        print('  нет вызовов (track_functions выключен?)')
+
+    print('\n=== ЗАПРОСЫ (по общему времени) ===')
+    print(f'{"#":>3} {"вызовы":>9} {"всего, мс":>11} {"ср., мс":>9} {"доля, %":>8} '
+          f'{"кэш, %":>7}  запрос')
+    for i, s in enumerate(report['statements'], 1):
+        share = f'{s["share"]:>8.2f}' if s['share'] is not None else f'{"влож.":>8}'
+        hit = f'{s["hit_ratio"]:>7.1f}' if s['hit_ratio'] is not None else f'{"—":>7}'
+        print(f'{i:>3} {s["calls"]:>9} {s["total_ms"]:>11.1f} {s["mean_ms"]:>9.3f} {share} '
+              f'{hit}  {one_line(s["query"], 90)}')
+    if not report['statements']:
+        print('  нет данных pg_stat_statements')
+
+    for plan in report.get('slow_plans', []):
+        print(f'\n--- auto_explain: {plan["duration_ms"]:.1f} мс ---')
+        print('\n'.join(plan['plan'][:25]))
+
+
+# ---------------------------------------------------------------------
+# КОМАНДЫ
+# ---------------------------------------------------------------------
+
+def setup(args):
+    with connect(args.dsn) as conn:
+        try:
+            conn.execute('CREATE EXTENSION IF NOT EXISTS pg_stat_statements SCHEMA public')
+        except psycopg.Error as e:
+            print(f'pg_stat_statements недоступно: {e.diag.message_primary}', file=sys.stderr)
+        db = sql.Identifier(conn.info.dbname)
+        settings = {'track_functions': 'all', 'pg_stat_statements.track': 'all'}
+        if args.auto_explain_ms is not None:
+            settings.update({
+                'session_preload_libraries': 'auto_explain',
+                'auto_explain.log_min_duration': f'{args.auto_explain_ms}ms',
+                'auto_explain.log_analyze': 'on',
+                'auto_explain.log_buffers': 'on',
+                'auto_explain.log_nested_statements': 'on',
+            })
+        for name, value in settings.items():
+            conn.execute(sql.SQL('ALTER DATABASE {} SET {} = {}').format(
+                db, sql.Identifier(*name.split('.')), sql.Literal(value)))
+        print(f'✓ Настройки базы {conn.info.dbname}: '
+              + ', '.join(f'{k} = {v}' for k, v in settings.items()), file=sys.stderr)
+        print('  Действуют для новых сеансов', file=sys.stderr)
+
+
+def reset(args):
+    with connect(args.dsn) as conn:
+        db = sql.Identifier(conn.info.dbname)
+        for name in DB_SETTINGS:
+            conn.execute(sql.SQL('ALTER DATABASE {} RESET {}').format(
+                db, sql.Identifier(*name.split('.'))))
+        print(f'✓ Настройки профилирования базы {conn.info.dbname} сброшены', file=sys.stderr)
+
+
+def snapshot(args):
+    with connect(args.dsn) as conn:
+        write_json(args.output, take_snapshot(conn))
+    print(f'✓ Снимок: {args.output}', file=sys.stderr)
+
+
+def window(args):
+    """Снимок, нагрузка (команда или пауза), снимок, отчет."""
+    with connect(args.dsn) as conn:
+        before = take_snapshot(conn)
+    code = 0
+    if args.command:
+        code = subprocess.run(args.command).returncode
+    else:
+        time.sleep(args.seconds)
+    with connect(args.dsn) as conn:
+        after = take_snapshot(conn)
+    report = build_report(before, after, args.top, args.log)
+    print_report(report)
+    if args.output:
+        write_json(args.output, report)
+        print(f'\n✓ Отчет: {args.output}', file=sys.stderr)
+    return code
+
+
+def report(args):
+    result = build_report(read_json(args.before), read_json(args.after), args.top, args.log)
+    print_report(result)
+    if args.output:
+        write_json(args.output, result)
+        print(f'\n✓ Отчет: {args.output}', file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Профиль функций и запросов схемы library')
+    commands = parser.add_subparsers(dest='action', required=True)
+
+    p = commands.add_parser('setup', help='включить сбор статистики для базы')
+    p.add_argument('--dsn', required=True)
+    p.add_argument('--auto-explain-ms', type=int,
+                   help='записывать в журнал планы запросов дольше N мс (auto_explain)')
+
+    p = commands.add_parser('reset', help='вернуть настройки базы')
+    p.add_argument('--dsn', required=True)
+
+    p = commands.add_parser('snapshot', help='сохранить снимок счетчиков')
+    p.add_argument('--dsn', required=True)
+    p.add_argument('-o', '--output', default='profile_snapshot.json')
+
+    for name, help_text in (('window', 'снимки до и после нагрузки и отчет'),
+                            ('report', 'отчет по двум снимкам')):
+        p = commands.add_parser(name, help=help_text)
+        if name == 'window':
+            p.add_argument('--dsn', required=True)
+            p.add_argument('--seconds', type=float, default=60.0,
+                           help='длительность окна, если команда не задана')
+            p.add_argument('command', nargs=argparse.REMAINDER,
+                           help='команда нагрузки после --')
+        else:
+            p.add_argument('before')
+            p.add_argument('after')
+        p.add_argument('--top', type=int, default=20, help='строк в каждом разделе')
+        p.add_argument('--log', help='журнал сервера с записями auto_explain')
+        p.add_argument('-o', '--output', help='сохранить отчет в JSON')
+
+    args = parser.parse_args(argv)
+    if args.action == 'window':
+        if args.command[:1] == ['--']:
+            args.command = args.command[1:]
+        raise SystemExit(window(args))
+    {'setup': setup, 'reset': reset, 'snapshot': snapshot, 'report': report}[args.action](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,9 @@
 # Создаем полный SQL-скрипт для PostgreSQL с примерами нормализации
 
-postgres_normalization_script = """
+import re
+
+# Заголовок и демонстрация ненормализованной таблицы
+HEADER_SQL = """
 -- =====================================================================
 -- ЛАБОРАТОРНАЯ РАБОТА: ПРОЕКТИРОВАНИЕ РЕЛЯЦИОННОЙ БД В POSTGRESQL
 -- Система управления библиотекой
@@ -39,7 +42,10 @@ INSERT INTO unnormalized_library (reader_name, reader_phone, book_titles, author
 ('Иванов Петр Сергеевич', '+7-915-123-45-67', 'Война и мир, Анна Каренина', 'Толстой Лев Николаевич, Толстой Лев Николаевич', 'Художественная литература', 'Романы и повести', '2024-09-01, 2024-09-15', '2024-09-15, 2024-09-29');
 
 COMMENT ON TABLE unnormalized_library IS 'ПЛОХОЙ пример - ненормализованная таблица с множественными нарушениями НФ';
+"""
 
+# Схема library
+SCHEMA_SQL = """
 -- =====================================================================
 -- СОЗДАНИЕ НОРМАЛИЗОВАННОЙ СХЕМЫ (3НФ)
 -- =====================================================================
@@ -48,6 +54,12 @@ COMMENT ON TABLE unnormalized_library IS 'ПЛОХОЙ пример - ненор
 CREATE SCHEMA IF NOT EXISTS library;
 SET search_path TO library, public;
 
+-- Триграммы для нечеткого поиска имен (search_readers, search_authors)
+CREATE EXTENSION IF NOT EXISTS pg_trgm SCHEMA public;
+"""
+
+# Таблицы (внешние ключи вынесены в FOREIGN_KEYS_SQL)
+TABLES_SQL = """
 -- ---------------------------------------------------------------------
 -- ЭТАП 1: ПРИВЕДЕНИЕ К 1НФ (устранение многозначных атрибутов)
 -- ---------------------------------------------------------------------
@@ -75,12 +87,34 @@ CREATE TABLE readers (
     phone VARCHAR(20),
     email VARCHAR(100) UNIQUE,
     registration_date DATE DEFAULT CURRENT_DATE,
-    is_active BOOLEAN DEFAULT TRUE
+    is_active BOOLEAN DEFAULT TRUE,
+    -- производное: ФИО, email и цифры телефона для нечеткого поиска
+    search_text TEXT GENERATED ALWAYS AS (
+        last_name || ' ' || first_name || COALESCE(' ' || middle_name, '')
+        || COALESCE(' ' || email, '')
+        || COALESCE(' ' || regexp_replace(phone, '[^0-9]', '', 'g'), '')
+    ) STORED
 );
 
 COMMENT ON TABLE readers IS '1НФ: Все атрибуты атомарны, ФИО разделено';
 COMMENT ON COLUMN readers.reader_type IS 'Тип читателя с ограничением значений';
 
+-- Правила выдачи по типу читателя (NULL — без ограничения); проверяются
+-- в issue_book и issue_books по счетчикам reader_loan_stats
+CREATE TABLE reader_type_limits (
+    reader_type VARCHAR(20) PRIMARY KEY
+        CHECK (reader_type IN ('студент', 'преподаватель', 'сотрудник')),
+    max_active_loans INTEGER CHECK (max_active_loans > 0),
+    max_unpaid_fines DECIMAL(10,2) CHECK (max_unpaid_fines >= 0)
+);
+
+INSERT INTO reader_type_limits (reader_type, max_active_loans, max_unpaid_fines) VALUES
+('студент', 10, NULL),
+('преподаватель', 50, NULL),
+('сотрудник', 20, NULL);
+
+COMMENT ON TABLE reader_type_limits IS 'Лимиты на руках и неоплаченных штрафов по типу читателя';
+
 -- Таблица АВТОРЫ
 CREATE TABLE authors (
     author_id SERIAL PRIMARY KEY,
@@ -90,7 +124,11 @@ CREATE TABLE authors (
     birth_year INTEGER CHECK (birth_year BETWEEN 1000 AND EXTRACT(YEAR FROM CURRENT_DATE)),
     death_year INTEGER CHECK (death_year > birth_year),
     country VARCHAR(50),
-    biography TEXT
+    biography TEXT,
+    -- производное: ФИО для нечеткого поиска
+    search_text TEXT GENERATED ALWAYS AS (
+        last_name || ' ' || first_name || COALESCE(' ' || middle_name, '')
+    ) STORED
 );
 
 COMMENT ON TABLE authors IS '1НФ: Каждый автор - отдельная запись';
@@ -106,11 +144,28 @@ CREATE TABLE books (
     copies_available INTEGER NOT NULL CHECK (copies_available >= 0),
     category_id INTEGER NOT NULL,
     language VARCHAR(50) DEFAULT 'русский',
-    FOREIGN KEY (category_id) REFERENCES categories(category_id),
+    authors_display TEXT, -- производное: 'Толстой Л.Н., ...', поддерживается триггерами
+    search_vector TSVECTOR, -- производное: название, авторы, категория, ISBN с весами
     CONSTRAINT check_available_copies CHECK (copies_available <= copies_total)
 );
 
 COMMENT ON TABLE books IS '2НФ: Каждый неключевой атрибут полностью зависит от первичного ключа';
+COMMENT ON COLUMN books.authors_display IS 'Денормализация: строка авторов для отчетов, обновляется триггерами book_authors и authors';
+COMMENT ON COLUMN books.search_vector IS 'Денормализация: поисковый вектор каталога, обновляется триггерами books, book_authors, authors и categories';
+COMMENT ON COLUMN books.copies_available IS 'Снимок числа свободных экземпляров, обновляется sync_books_availability(); точное значение — v_book_stock';
+
+-- Таблица ЭКЗЕМПЛЯРЫ: по строке на физический экземпляр книги.
+-- Выдача занимает свободный экземпляр (FOR UPDATE SKIP LOCKED), поэтому
+-- одновременные выдачи популярной книги блокируют разные узкие строки,
+-- а не одну строку books
+CREATE TABLE book_copies (
+    book_id INTEGER NOT NULL,
+    copy_no INTEGER NOT NULL CHECK (copy_no > 0),
+    loan_id INTEGER, -- NULL: экземпляр на полке
+    PRIMARY KEY (book_id, copy_no)
+);
+
+COMMENT ON TABLE book_copies IS '3НФ: Экземпляр книги и выдача, которая его занимает';
 
 -- ---------------------------------------------------------------------
 -- ЭТАП 2: ПРИВЕДЕНИЕ К 2НФ (устранение частичных зависимостей)
@@ -121,9 +176,7 @@ CREATE TABLE book_authors (
     book_id INTEGER NOT NULL,
     author_id INTEGER NOT NULL,
     author_role VARCHAR(50) DEFAULT 'автор', -- соавтор, переводчик, редактор
-    PRIMARY KEY (book_id, author_id),
-    FOREIGN KEY (book_id) REFERENCES books(book_id) ON DELETE CASCADE,
-    FOREIGN KEY (author_id) REFERENCES authors(author_id) ON DELETE CASCADE
+    PRIMARY KEY (book_id, author_id)
 );
 
 COMMENT ON TABLE book_authors IS '2НФ: Составной первичный ключ, нет частичных зависимостей';
@@ -132,9 +185,9 @@ COMMENT ON TABLE book_authors IS '2НФ: Составной первичный 
 -- ЭТАП 3: ПРИВЕДЕНИЕ К 3НФ (устранение транзитивных зависимостей)
 -- ---------------------------------------------------------------------
 
--- Таблица ВЫДАЧИ
+-- Таблица ВЫДАЧИ (секционирована по месяцам loan_date, см. PARTITIONS_SQL)
 CREATE TABLE loans (
-    loan_id SERIAL PRIMARY KEY,
+    loan_id SERIAL,
     reader_id INTEGER NOT NULL,
     book_id INTEGER NOT NULL,
     loan_date DATE NOT NULL DEFAULT CURRENT_DATE,
@@ -144,30 +197,297 @@ CREATE TABLE loans (
         CHECK (status IN ('выдана', 'возвращена', 'просрочена', 'утеряна')),
     librarian_id INTEGER, -- кто выдал книгу
     notes TEXT,
-    FOREIGN KEY (reader_id) REFERENCES readers(reader_id),
-    FOREIGN KEY (book_id) REFERENCES books(book_id),
+    PRIMARY KEY (loan_id, loan_date), -- ключ секционирования входит в первичный ключ
     CONSTRAINT check_due_date CHECK (due_date > loan_date),
     CONSTRAINT check_return_date CHECK (return_date IS NULL OR return_date >= loan_date)
-);
+) PARTITION BY RANGE (loan_date);
 
-COMMENT ON TABLE loans IS '3НФ: Нет транзитивных зависимостей';
+COMMENT ON TABLE loans IS '3НФ: Нет транзитивных зависимостей. Секции по месяцам loan_date';
 
 -- Таблица ШТРАФЫ
 CREATE TABLE fines (
     fine_id SERIAL PRIMARY KEY,
     loan_id INTEGER NOT NULL UNIQUE, -- один штраф на одну выдачу
+    loan_date DATE NOT NULL, -- вместе с loan_id ссылается на секционированную loans
     amount DECIMAL(10,2) NOT NULL CHECK (amount > 0),
     fine_date DATE NOT NULL DEFAULT CURRENT_DATE,
     paid_date DATE,
     paid BOOLEAN GENERATED ALWAYS AS (paid_date IS NOT NULL) STORED,
     fine_type VARCHAR(50) DEFAULT 'просрочка' 
         CHECK (fine_type IN ('просрочка', 'порча', 'утеря')),
-    FOREIGN KEY (loan_id) REFERENCES loans(loan_id) ON DELETE CASCADE,
     CONSTRAINT check_paid_date CHECK (paid_date IS NULL OR paid_date >= fine_date)
 );
 
 COMMENT ON TABLE fines IS '3НФ: Каждый неключевой атрибут зависит только от первичного ключа';
 
+-- Таблица ЗАЯВКИ на выдачу и возврат: стойки и киоски ставят заявку и не
+-- ждут блокировок; воркеры (loan_queue_worker.py) разбирают очередь
+-- пачками (FOR UPDATE SKIP LOCKED) через issue_book/return_book и пишут
+-- результат в строку заявки. Аргументы проверяют сами процедуры, поэтому
+-- внешних ключей нет: заявка на несуществующего читателя отклоняется
+-- с сообщением процедуры
+CREATE TABLE loan_requests (
+    request_id BIGSERIAL PRIMARY KEY,
+    operation VARCHAR(10) NOT NULL CHECK (operation IN ('выдача', 'возврат')),
+    reader_id INTEGER,
+    book_id INTEGER,
+    loan_id INTEGER,
+    return_date DATE,
+    notes TEXT,
+    status VARCHAR(20) NOT NULL DEFAULT 'ожидает'
+        CHECK (status IN ('ожидает', 'выполнена', 'отклонена')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result_loan_id INTEGER, -- выдача, созданная заявкой на выдачу
+    message TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP,
+    CONSTRAINT check_request_args CHECK (
+        (operation = 'выдача' AND reader_id IS NOT NULL AND book_id IS NOT NULL)
+        OR (operation = 'возврат' AND loan_id IS NOT NULL))
+) WITH (autovacuum_vacuum_scale_factor = 0.01, autovacuum_vacuum_threshold = 1000);
+
+COMMENT ON TABLE loan_requests IS 'Очередь заявок на выдачу и возврат; заявка остается в ожидании до выполнения, отказа или исчерпания попыток и вычищается purge_loan_requests()';
+
+-- Архив выдач: возвращенные выдачи старше срока хранения (archive_returned_loans)
+-- и строки архивированных месячных секций loans
+CREATE TABLE loans_history (
+    loan_id INTEGER PRIMARY KEY,
+    reader_id INTEGER NOT NULL,
+    book_id INTEGER NOT NULL,
+    loan_date DATE NOT NULL,
+    due_date DATE NOT NULL,
+    return_date DATE,
+    status VARCHAR(20),
+    librarian_id INTEGER,
+    notes TEXT
+);
+
+COMMENT ON TABLE loans_history IS 'Архив возвращенных выдач (только добавление, по возрастанию loan_date; индексы BRIN)';
+
+-- Архив штрафов по выдачам из loans_history
+CREATE TABLE fines_history (
+    fine_id INTEGER PRIMARY KEY,
+    loan_id INTEGER NOT NULL UNIQUE,
+    loan_date DATE NOT NULL,
+    amount DECIMAL(10,2) NOT NULL,
+    fine_date DATE NOT NULL,
+    paid_date DATE,
+    paid BOOLEAN GENERATED ALWAYS AS (paid_date IS NOT NULL) STORED,
+    fine_type VARCHAR(50)
+);
+
+COMMENT ON TABLE fines_history IS 'Архив оплаченных штрафов по выдачам из loans_history';
+
+-- ---------------------------------------------------------------------
+-- ДЕНОРМАЛИЗАЦИЯ ДЛЯ ОТЧЕТОВ (производные данные, поддерживаются триггерами)
+-- ---------------------------------------------------------------------
+
+-- Сводная статистика по читателю: заменяет группировку всей истории
+-- выдач и штрафов в v_reader_statistics
+CREATE TABLE reader_loan_stats (
+    reader_id INTEGER PRIMARY KEY,
+    total_loans INTEGER NOT NULL DEFAULT 0 CHECK (total_loans >= 0),
+    active_loans INTEGER NOT NULL DEFAULT 0 CHECK (active_loans >= 0),
+    overdue_loans INTEGER NOT NULL DEFAULT 0 CHECK (overdue_loans >= 0),
+    returned_loans INTEGER NOT NULL DEFAULT 0 CHECK (returned_loans >= 0),
+    total_fines DECIMAL(12,2) NOT NULL DEFAULT 0 CHECK (total_fines >= 0),
+    unpaid_fines DECIMAL(12,2) NOT NULL DEFAULT 0 CHECK (unpaid_fines >= 0)
+);
+
+COMMENT ON TABLE reader_loan_stats IS 'Денормализация: счетчики выдач и штрафов читателя, поддерживаются триггерами';
+COMMENT ON COLUMN reader_loan_stats.total_loans IS 'Все выдачи читателя, включая утерянные';
+
+-- Число выдач книги и категории за день: отчеты популярности за период
+-- читают строки дней окна, а не всю историю выдач
+CREATE TABLE book_loans_daily (
+    loan_day DATE NOT NULL,
+    book_id INTEGER NOT NULL,
+    loans INTEGER NOT NULL DEFAULT 0 CHECK (loans >= 0),
+    PRIMARY KEY (loan_day, book_id)
+);
+
+CREATE TABLE category_loans_daily (
+    loan_day DATE NOT NULL,
+    category_id INTEGER NOT NULL,
+    loans INTEGER NOT NULL DEFAULT 0 CHECK (loans >= 0),
+    PRIMARY KEY (loan_day, category_id)
+);
+
+-- Все выдачи книги за историю: общий итог популярности без суммирования
+-- дневных строк
+CREATE TABLE book_loan_totals (
+    book_id INTEGER PRIMARY KEY,
+    loans INTEGER NOT NULL DEFAULT 0 CHECK (loans >= 0)
+);
+
+COMMENT ON TABLE book_loans_daily IS 'Денормализация: выдачи книги по дням (с архивом), поддерживается триггерами';
+COMMENT ON TABLE category_loans_daily IS 'Денормализация: выдачи по категории книги на момент выдачи, по дням';
+COMMENT ON TABLE book_loan_totals IS 'Денормализация: выдачи книги за всю историю (с архивом), поддерживается триггерами';
+"""
+
+# Секции таблицы выдач
+PARTITIONS_SQL = """
+-- ---------------------------------------------------------------------
+-- СЕКЦИОНИРОВАНИЕ ВЫДАЧ ПО МЕСЯЦАМ
+-- Запросы за последние дни/недели читают одну-две секции; старые
+-- секции целиком переносятся в loans_history и удаляются
+-- ---------------------------------------------------------------------
+
+-- Создание месячных секций loans_ГГГГ_ММ, покрывающих [p_from, p_to]
+CREATE OR REPLACE PROCEDURE create_loan_partitions(p_from DATE, p_to DATE)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    month_start DATE := date_trunc('month', p_from)::DATE;
+    partition_name TEXT;
+BEGIN
+    WHILE month_start <= p_to LOOP
+        partition_name := 'loans_' || to_char(month_start, 'YYYY_MM');
+        IF to_regclass(format('library.%I', partition_name)) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE library.%I PARTITION OF library.loans FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, (month_start + INTERVAL '1 month')::DATE);
+        END IF;
+        month_start := (month_start + INTERVAL '1 month')::DATE;
+    END LOOP;
+END;
+$$;
+
+-- Регулярное обслуживание (например, ежедневно через pg_cron):
+-- создает секции на p_months_ahead месяцев вперед и, если задан
+-- p_archive_after_months, переносит в loans_history/fines_history секции
+-- старше этого срока. Секция переносится, только если все ее выдачи
+-- возвращены и штрафы оплачены. Каждая секция — отдельная транзакция,
+-- поэтому процедуру нужно вызывать вне явного BEGIN
+CREATE OR REPLACE PROCEDURE maintain_loan_partitions(
+    p_months_ahead INTEGER DEFAULT 3,
+    p_archive_after_months INTEGER DEFAULT NULL
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    part RECORD;
+    cutoff DATE;
+    blocking_count INTEGER;
+    moved_loans INTEGER;
+    moved_fines INTEGER;
+BEGIN
+    CALL create_loan_partitions(
+        CURRENT_DATE,
+        (date_trunc('month', CURRENT_DATE) + make_interval(months => p_months_ahead))::DATE);
+    COMMIT;
+
+    IF p_archive_after_months IS NULL THEN
+        RETURN;
+    END IF;
+    cutoff := (date_trunc('month', CURRENT_DATE) - make_interval(months => p_archive_after_months))::DATE;
+
+    FOR part IN
+        SELECT 
+            c.oid::regclass AS partition_table,
+            (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \\(''([0-9-]+)''\\)'))[1]::DATE AS upper_bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'library.loans'::regclass
+        ORDER BY upper_bound
+    LOOP
+        CONTINUE WHEN part.upper_bound > cutoff;
+
+        EXECUTE format(
+            'SELECT COUNT(*) FROM %s l
+             WHERE l.status <> ''возвращена''
+                OR EXISTS (SELECT 1 FROM library.fines f
+                           WHERE f.loan_id = l.loan_id AND f.loan_date = l.loan_date AND NOT f.paid)',
+            part.partition_table) INTO blocking_count;
+        IF blocking_count > 0 THEN
+            RAISE NOTICE 'Секция % не архивирована: % невозвращенных выдач или неоплаченных штрафов',
+                part.partition_table, blocking_count;
+            CONTINUE;
+        END IF;
+
+        -- История остается в статистике: триггеры счетчиков пропускают перенос
+        PERFORM set_config('library.archiving', 'on', true);
+
+        EXECUTE format(
+            'INSERT INTO library.loans_history (loan_id, reader_id, book_id, loan_date, due_date,
+                                                return_date, status, librarian_id, notes)
+             SELECT loan_id, reader_id, book_id, loan_date, due_date,
+                    return_date, status, librarian_id, notes
+             FROM %s ORDER BY loan_date, loan_id', part.partition_table);
+        GET DIAGNOSTICS moved_loans = ROW_COUNT;
+
+        EXECUTE format(
+            'WITH moved AS (
+                DELETE FROM library.fines f USING %s l
+                WHERE f.loan_id = l.loan_id AND f.loan_date = l.loan_date
+                RETURNING f.fine_id, f.loan_id, f.loan_date, f.amount, f.fine_date, f.paid_date, f.fine_type
+             )
+             INSERT INTO library.fines_history (fine_id, loan_id, loan_date, amount, fine_date, paid_date, fine_type)
+             SELECT * FROM moved', part.partition_table);
+        GET DIAGNOSTICS moved_fines = ROW_COUNT;
+
+        EXECUTE format('ALTER TABLE library.loans DETACH PARTITION %s', part.partition_table);
+        EXECUTE format('DROP TABLE %s', part.partition_table);
+
+        RAISE NOTICE 'Секция % перенесена в архив: % выдач, % штрафов',
+            part.partition_table, moved_loans, moved_fines;
+        COMMIT;
+    END LOOP;
+END;
+$$;
+
+-- Начальные секции: с тестовых данных до трех месяцев вперед
+CALL create_loan_partitions(DATE '2024-01-01', (CURRENT_DATE + INTERVAL '3 months')::DATE);
+"""
+
+# Внешние ключи
+FOREIGN_KEYS_SQL = """
+-- ---------------------------------------------------------------------
+-- ВНЕШНИЕ КЛЮЧИ
+-- Объявлены отдельно от таблиц, чтобы при массовой загрузке создавать
+-- их после данных (см. library_bulk_load_*.sql)
+-- ---------------------------------------------------------------------
+
+ALTER TABLE books ADD CONSTRAINT books_category_id_fkey
+    FOREIGN KEY (category_id) REFERENCES categories(category_id);
+
+ALTER TABLE book_copies ADD CONSTRAINT book_copies_book_id_fkey
+    FOREIGN KEY (book_id) REFERENCES books(book_id) ON DELETE CASCADE;
+
+ALTER TABLE book_authors ADD CONSTRAINT book_authors_book_id_fkey
+    FOREIGN KEY (book_id) REFERENCES books(book_id) ON DELETE CASCADE;
+ALTER TABLE book_authors ADD CONSTRAINT book_authors_author_id_fkey
+    FOREIGN KEY (author_id) REFERENCES authors(author_id) ON DELETE CASCADE;
+
+ALTER TABLE loans ADD CONSTRAINT loans_reader_id_fkey
+    FOREIGN KEY (reader_id) REFERENCES readers(reader_id);
+ALTER TABLE loans ADD CONSTRAINT loans_book_id_fkey
+    FOREIGN KEY (book_id) REFERENCES books(book_id);
+
+ALTER TABLE fines ADD CONSTRAINT fines_loan_id_fkey
+    FOREIGN KEY (loan_id, loan_date) REFERENCES loans(loan_id, loan_date)
+    ON UPDATE CASCADE ON DELETE CASCADE;
+
+ALTER TABLE loans_history ADD CONSTRAINT loans_history_reader_id_fkey
+    FOREIGN KEY (reader_id) REFERENCES readers(reader_id);
+ALTER TABLE loans_history ADD CONSTRAINT loans_history_book_id_fkey
+    FOREIGN KEY (book_id) REFERENCES books(book_id);
+ALTER TABLE fines_history ADD CONSTRAINT fines_history_loan_id_fkey
+    FOREIGN KEY (loan_id) REFERENCES loans_history(loan_id);
+
+ALTER TABLE reader_loan_stats ADD CONSTRAINT reader_loan_stats_reader_id_fkey
+    FOREIGN KEY (reader_id) REFERENCES readers(reader_id) ON DELETE CASCADE;
+
+ALTER TABLE book_loans_daily ADD CONSTRAINT book_loans_daily_book_id_fkey
+    FOREIGN KEY (book_id) REFERENCES books(book_id) ON DELETE CASCADE;
+ALTER TABLE category_loans_daily ADD CONSTRAINT category_loans_daily_category_id_fkey
+    FOREIGN KEY (category_id) REFERENCES categories(category_id) ON DELETE CASCADE;
+ALTER TABLE book_loan_totals ADD CONSTRAINT book_loan_totals_book_id_fkey
+    FOREIGN KEY (book_id) REFERENCES books(book_id) ON DELETE CASCADE;
+"""
+
+# Индексы (по одному оператору в строке)
+INDEXES_SQL = """
 -- =====================================================================
 -- СОЗДАНИЕ ИНДЕКСОВ ДЛЯ ОПТИМИЗАЦИИ
 -- =====================================================================
@@ -176,6 +496,10 @@ COMMENT ON TABLE fines IS '3НФ: Каждый неключевой атрибу
 CREATE INDEX idx_books_category ON books(category_id);
 CREATE INDEX idx_books_title ON books USING gin(to_tsvector('russian', title));
 CREATE INDEX idx_books_isbn ON books(isbn) WHERE isbn IS NOT NULL;
+CREATE INDEX idx_books_search ON books USING gin(search_vector);
+
+CREATE INDEX idx_book_copies_free ON book_copies(book_id) WHERE loan_id IS NULL;
+CREATE UNIQUE INDEX idx_book_copies_loan ON book_copies(loan_id) WHERE loan_id IS NOT NULL;
 
 CREATE INDEX idx_loans_reader ON loans(reader_id);
 CREATE INDEX idx_loans_book ON loans(book_id);
@@ -185,13 +509,36 @@ CREATE INDEX idx_loans_status ON loans(status) WHERE status != 'возвраще
 CREATE INDEX idx_readers_type ON readers(reader_type);
 CREATE INDEX idx_readers_name ON readers(last_name, first_name);
 CREATE INDEX idx_readers_email ON readers(email) WHERE email IS NOT NULL;
+CREATE INDEX idx_readers_search ON readers USING gist(search_text gist_trgm_ops);
 
 CREATE INDEX idx_authors_name ON authors(last_name, first_name);
+CREATE INDEX idx_authors_search ON authors USING gist(search_text gist_trgm_ops);
+-- Ключ имени автора для импорта каталога (import_catalog.py): без учета регистра и ё
+CREATE INDEX idx_authors_name_key ON authors ((lower(translate(search_text, 'Ёё', 'Ее'))), author_id);
 CREATE INDEX idx_fines_unpaid ON fines(loan_id) WHERE paid = FALSE;
 
+-- Воркеры читают только ожидающие заявки по порядку поступления
+CREATE INDEX idx_loan_requests_pending ON loan_requests(request_id) WHERE status = 'ожидает';
+
+-- Архив пополняется по возрастанию дат, поэтому BRIN (несколько страниц
+-- на всю таблицу) заменяет btree для отбора по периоду
+CREATE INDEX idx_loans_history_loan_date ON loans_history USING brin(loan_date);
+CREATE INDEX idx_loans_history_return_date ON loans_history USING brin(return_date);
+CREATE INDEX idx_fines_history_fine_date ON fines_history USING brin(fine_date);
+
+-- Окна по дням читают первичный ключ (loan_day, ...); история одной книги —
+-- этот индекс
+CREATE INDEX idx_book_loans_daily_book ON book_loans_daily(book_id, loan_day) INCLUDE (loans);
+
+-- Самые выдаваемые книги за всю историю — первые записи индекса
+CREATE INDEX idx_book_loan_totals_loans ON book_loan_totals(loans DESC, book_id);
+
 -- Составные индексы для сложных запросов
 CREATE INDEX idx_book_authors_composite ON book_authors(author_id, book_id);
+"""
 
+# Тестовые данные
+SAMPLE_DATA_SQL = """
 -- =====================================================================
 -- ЗАПОЛНЕНИЕ БАЗЫ ТЕСТОВЫМИ ДАННЫМИ
 -- =====================================================================
@@ -258,14 +605,46 @@ INSERT INTO loans (reader_id, book_id, loan_date, due_date, return_date, status,
 (6, 8, '2024-09-20', '2024-10-04', NULL, 'выдана', 'Классическая литература');
 
 -- Штрафы
-INSERT INTO fines (loan_id, amount, fine_date, fine_type) VALUES 
-(3, 150.00, '2024-09-04', 'просрочка'); -- штраф за просроченную книгу
+INSERT INTO fines (loan_id, loan_date, amount, fine_date, fine_type) VALUES 
+(3, '2024-08-20', 150.00, '2024-09-04', 'просрочка'); -- штраф за просроченную книгу
+"""
 
+# Представления
+VIEWS_SQL = """
 -- =====================================================================
 -- СОЗДАНИЕ ПРЕДСТАВЛЕНИЙ ДЛЯ АНАЛИЗА И ОТЧЕТНОСТИ
 -- =====================================================================
 
+-- Представления: Все выдачи и штрафы — рабочие таблицы и архив
+CREATE VIEW v_loans_all AS
+SELECT loan_id, reader_id, book_id, loan_date, due_date, return_date, status,
+       librarian_id, notes, FALSE AS archived
+FROM loans
+UNION ALL
+SELECT loan_id, reader_id, book_id, loan_date, due_date, return_date, status,
+       librarian_id, notes, TRUE
+FROM loans_history;
+
+CREATE VIEW v_fines_all AS
+SELECT fine_id, loan_id, loan_date, amount, fine_date, paid_date, paid, fine_type,
+       FALSE AS archived
+FROM fines
+UNION ALL
+SELECT fine_id, loan_id, loan_date, amount, fine_date, paid_date, paid, fine_type, TRUE
+FROM fines_history;
+
+-- Представление: Фактическое наличие экземпляров по book_copies
+CREATE VIEW v_book_stock AS
+SELECT 
+    book_id,
+    COUNT(*)::INTEGER AS copies_total,
+    (COUNT(*) FILTER (WHERE loan_id IS NULL))::INTEGER AS copies_available
+FROM book_copies
+GROUP BY book_id;
+
 -- Представление: Полная информация о книгах
+-- Строка авторов хранится в books.authors_display, поэтому представление
+-- не группирует book_authors/authors для всего каталога
 CREATE VIEW v_books_detailed AS
 SELECT 
     b.book_id,
@@ -274,25 +653,14 @@ SELECT
     b.publication_year,
     b.pages,
     b.copies_total,
-    b.copies_available,
-    ROUND((b.copies_available::DECIMAL / b.copies_total) * 100, 1) AS availability_percent,
+    COALESCE(s.copies_available, 0) AS copies_available,
+    ROUND((COALESCE(s.copies_available, 0)::DECIMAL / b.copies_total) * 100, 1) AS availability_percent,
     c.name AS category_name,
     b.language,
-    STRING_AGG(
-        CASE 
-            WHEN a.middle_name IS NOT NULL THEN 
-                a.last_name || ' ' || LEFT(a.first_name, 1) || '.' || LEFT(a.middle_name, 1) || '.'
-            ELSE 
-                a.last_name || ' ' || LEFT(a.first_name, 1) || '.'
-        END, 
-        ', ' ORDER BY ba.author_id
-    ) AS authors
+    b.authors_display AS authors
 FROM books b
 JOIN categories c ON b.category_id = c.category_id
-LEFT JOIN book_authors ba ON b.book_id = ba.book_id
-LEFT JOIN authors a ON ba.author_id = a.author_id
-GROUP BY b.book_id, b.title, b.isbn, b.publication_year, b.pages, 
-         b.copies_total, b.copies_available, c.name, b.language;
+LEFT JOIN v_book_stock s ON s.book_id = b.book_id;
 
 -- Представление: Активные выдачи с информацией о просрочке
 CREATE VIEW v_active_loans AS
@@ -324,68 +692,89 @@ ORDER BY
     l.due_date;
 
 -- Представление: Статистика по читателям
+-- Читает готовые счетчики из reader_loan_stats: поиск по reader_id —
+-- два обращения по первичному ключу независимо от длины истории выдач
 CREATE VIEW v_reader_statistics AS
 SELECT 
     r.reader_id,
     r.last_name || ' ' || r.first_name AS reader_name,
     r.reader_type,
     r.registration_date,
-    COUNT(l.loan_id) AS total_loans,
-    COUNT(CASE WHEN l.status = 'выдана' THEN 1 END) AS active_loans,
-    COUNT(CASE WHEN l.status = 'просрочена' THEN 1 END) AS overdue_loans,
-    COUNT(CASE WHEN l.status = 'возвращена' THEN 1 END) AS returned_loans,
-    COALESCE(SUM(f.amount), 0) AS total_fines,
-    COALESCE(SUM(CASE WHEN f.paid = FALSE THEN f.amount ELSE 0 END), 0) AS unpaid_fines,
+    COALESCE(s.total_loans, 0) AS total_loans,
+    COALESCE(s.active_loans, 0) AS active_loans,
+    COALESCE(s.overdue_loans, 0) AS overdue_loans,
+    COALESCE(s.returned_loans, 0) AS returned_loans,
+    COALESCE(s.total_fines, 0) AS total_fines,
+    COALESCE(s.unpaid_fines, 0) AS unpaid_fines,
     CASE 
-        WHEN COUNT(CASE WHEN l.status = 'просрочена' THEN 1 END) > 0 THEN 'Есть просрочки'
-        WHEN COALESCE(SUM(CASE WHEN f.paid = FALSE THEN f.amount ELSE 0 END), 0) > 0 THEN 'Есть штрафы'
+        WHEN COALESCE(s.overdue_loans, 0) > 0 THEN 'Есть просрочки'
+        WHEN COALESCE(s.unpaid_fines, 0) > 0 THEN 'Есть штрафы'
         ELSE 'Без нарушений'
     END AS reader_status
 FROM readers r
-LEFT JOIN loans l ON r.reader_id = l.reader_id
-LEFT JOIN fines f ON l.loan_id = f.loan_id
-WHERE r.is_active = TRUE
-GROUP BY r.reader_id, r.last_name, r.first_name, r.reader_type, r.registration_date;
+LEFT JOIN reader_loan_stats s ON s.reader_id = r.reader_id
+WHERE r.is_active = TRUE;
 
 -- Представление: Популярность книг
+-- Все поля считаются для каждой выводимой книги отдельно: общий итог — из
+-- book_loan_totals, окна за месяц и неделю — строки книги в
+-- book_loans_daily за 30 дней, наличие — ее экземпляры в book_copies.
+-- Представление не упорядочено: LIMIT и отбор по book_id не считают
+-- весь каталог. Самые выдаваемые книги — top_books_between() или отбор
+-- по индексу book_loan_totals
 CREATE VIEW v_book_popularity AS
 SELECT 
     b.book_id,
     b.title,
-    vbd.authors,
+    b.authors_display AS authors,
     c.name AS category_name,
-    COUNT(l.loan_id) AS loan_count,
-    COUNT(CASE WHEN l.loan_date >= CURRENT_DATE - INTERVAL '30 days' THEN 1 END) AS loans_last_month,
-    COUNT(CASE WHEN l.loan_date >= CURRENT_DATE - INTERVAL '7 days' THEN 1 END) AS loans_last_week,
+    COALESCE(t.loans, 0) AS loan_count,
+    COALESCE(r.loans_last_month, 0) AS loans_last_month,
+    COALESCE(r.loans_last_week, 0) AS loans_last_week,
     b.copies_total,
-    b.copies_available,
-    ROUND(COUNT(l.loan_id)::DECIMAL / NULLIF(b.copies_total, 0), 2) AS loans_per_copy
+    s.copies_available,
+    ROUND(COALESCE(t.loans, 0)::DECIMAL / NULLIF(b.copies_total, 0), 2) AS loans_per_copy
 FROM books b
 JOIN categories c ON b.category_id = c.category_id
-JOIN v_books_detailed vbd ON b.book_id = vbd.book_id
-LEFT JOIN loans l ON b.book_id = l.book_id
-GROUP BY b.book_id, b.title, vbd.authors, c.name, b.copies_total, b.copies_available
-ORDER BY loan_count DESC;
+LEFT JOIN book_loan_totals t ON t.book_id = b.book_id
+CROSS JOIN LATERAL (
+    SELECT 
+        SUM(d.loans) AS loans_last_month,
+        SUM(d.loans) FILTER (WHERE d.loan_day >= CURRENT_DATE - 7) AS loans_last_week
+    FROM book_loans_daily d
+    WHERE d.book_id = b.book_id AND d.loan_day >= CURRENT_DATE - 30
+) r
+CROSS JOIN LATERAL (
+    SELECT COUNT(*)::INTEGER AS copies_available
+    FROM book_copies bc
+    WHERE bc.book_id = b.book_id AND bc.loan_id IS NULL
+) s;
+"""
 
+# Функции
+FUNCTIONS_SQL = """
 -- =====================================================================
 -- ПОЛЕЗНЫЕ ФУНКЦИИ
 -- =====================================================================
 
+-- Вспомогательные функции написаны на SQL с точной изменчивостью
+-- (IMMUTABLE/STABLE) и PARALLEL SAFE: планировщик подставляет их тело в
+-- вызывающий запрос, и построчные вызовы в отчетах и триггерах не платят
+-- за интерпретатор PL/pgSQL
+
 -- Функция для автоматического расчета срока возврата
 CREATE OR REPLACE FUNCTION calculate_due_date(
     reader_type_param VARCHAR(20),
     loan_date_param DATE DEFAULT CURRENT_DATE
 ) RETURNS DATE AS $$
-BEGIN
-    RETURN loan_date_param + 
+    SELECT loan_date_param +
         CASE reader_type_param
-            WHEN 'студент' THEN INTERVAL '14 days'
-            WHEN 'преподаватель' THEN INTERVAL '30 days'
-            WHEN 'сотрудник' THEN INTERVAL '21 days'
-            ELSE INTERVAL '7 days'
+            WHEN 'студент' THEN 14
+            WHEN 'преподаватель' THEN 30
+            WHEN 'сотрудник' THEN 21
+            ELSE 7
         END;
-END;
-$$ LANGUAGE plpgsql;
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
 
 -- Функция для проверки доступности книги
 CREATE OR REPLACE FUNCTION check_book_availability(book_id_param INTEGER)
@@ -394,83 +783,688 @@ RETURNS TABLE(
     copies_available INTEGER, 
     copies_total INTEGER
 ) AS $$
-BEGIN
-    RETURN QUERY
     SELECT 
-        b.copies_available > 0 AS available,
-        b.copies_available,
+        COALESCE(s.copies_available, 0) > 0,
+        COALESCE(s.copies_available, 0),
         b.copies_total
     FROM books b 
+    LEFT JOIN v_book_stock s ON s.book_id = b.book_id
     WHERE b.book_id = book_id_param;
+$$ LANGUAGE sql STABLE PARALLEL SAFE;
+
+-- Штраф за просрочку на дату p_as_of: 10 рублей за день, не более 1000
+-- (NULL, если просрочки нет)
+CREATE OR REPLACE FUNCTION overdue_fine_amount(
+    p_due_date DATE,
+    p_as_of DATE DEFAULT CURRENT_DATE
+) RETURNS DECIMAL(10,2) AS $$
+    SELECT CASE WHEN p_as_of > p_due_date
+                THEN LEAST((p_as_of - p_due_date) * 10.00, 1000.00)
+           END;
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- Функция для расчета штрафа за просрочку невозвращенной выдачи на
+-- сегодня (0 — без просрочки, NULL — выдача возвращена или не найдена)
+CREATE OR REPLACE FUNCTION calculate_overdue_fine(loan_id_param INTEGER)
+RETURNS DECIMAL(10,2) AS $$
+    SELECT COALESCE(overdue_fine_amount(due_date), 0)
+    FROM loans 
+    WHERE loan_id = loan_id_param AND status != 'возвращена';
+$$ LANGUAGE sql STABLE PARALLEL SAFE;
+
+-- Сроки возврата для набора читателей сразу (например, для пакетной выдачи):
+--     SELECT * FROM calculate_due_dates(ARRAY[1, 2, 3]);
+CREATE OR REPLACE FUNCTION calculate_due_dates(
+    p_reader_ids INTEGER[],
+    p_loan_date DATE DEFAULT CURRENT_DATE
+) RETURNS TABLE(reader_id INTEGER, reader_type VARCHAR(20), due_date DATE) AS $$
+    SELECT r.reader_id, r.reader_type, calculate_due_date(r.reader_type, p_loan_date)
+    FROM readers r
+    WHERE r.reader_id = ANY(p_reader_ids);
+$$ LANGUAGE sql STABLE PARALLEL SAFE;
+
+-- Наличие набора книг одним запросом
+CREATE OR REPLACE FUNCTION check_books_availability(p_book_ids INTEGER[])
+RETURNS TABLE(
+    book_id INTEGER,
+    available BOOLEAN,
+    copies_available INTEGER,
+    copies_total INTEGER
+) AS $$
+    SELECT
+        b.book_id,
+        COALESCE(s.copies_available, 0) > 0,
+        COALESCE(s.copies_available, 0),
+        b.copies_total
+    FROM books b
+    LEFT JOIN v_book_stock s ON s.book_id = b.book_id
+    WHERE b.book_id = ANY(p_book_ids);
+$$ LANGUAGE sql STABLE PARALLEL SAFE;
+
+-- Штрафы по невозвращенным выдачам на дату p_as_of одним запросом
+-- (p_loan_ids NULL — все невозвращенные выдачи):
+--     SELECT * FROM calculate_overdue_fines() WHERE fine_amount > 0;
+CREATE OR REPLACE FUNCTION calculate_overdue_fines(
+    p_loan_ids INTEGER[] DEFAULT NULL,
+    p_as_of DATE DEFAULT CURRENT_DATE
+) RETURNS TABLE(loan_id INTEGER, due_date DATE, days_overdue INTEGER, fine_amount DECIMAL(10,2)) AS $$
+    SELECT l.loan_id, l.due_date,
+           GREATEST(0, p_as_of - l.due_date),
+           COALESCE(overdue_fine_amount(l.due_date, p_as_of), 0)
+    FROM loans l
+    WHERE l.status != 'возвращена'
+      AND (p_loan_ids IS NULL OR l.loan_id = ANY(p_loan_ids));
+$$ LANGUAGE sql STABLE PARALLEL SAFE;
+
+-- Полное перестроение book_copies по books.copies_total и невозвращенным
+-- выдачам (после загрузки или для восстановления; не при работающих выдачах).
+-- Возвращает число экземпляров
+CREATE OR REPLACE FUNCTION rebuild_book_copies()
+RETURNS INTEGER AS $$
+DECLARE
+    copies_count INTEGER;
+BEGIN
+    DELETE FROM book_copies;
+
+    INSERT INTO book_copies (book_id, copy_no, loan_id)
+    SELECT b.book_id, n.copy_no, o.loan_id
+    FROM books b
+    CROSS JOIN LATERAL generate_series(1, b.copies_total) AS n(copy_no)
+    LEFT JOIN (
+        SELECT l.loan_id, l.book_id,
+               row_number() OVER (PARTITION BY l.book_id ORDER BY l.loan_id) AS copy_no
+        FROM loans l
+        WHERE l.status != 'возвращена'
+    ) o ON o.book_id = b.book_id AND o.copy_no = n.copy_no;
+
+    GET DIAGNOSTICS copies_count = ROW_COUNT;
+    RETURN copies_count;
 END;
 $$ LANGUAGE plpgsql;
 
--- Функция для расчета штрафа за просрочку
-CREATE OR REPLACE FUNCTION calculate_overdue_fine(loan_id_param INTEGER)
-RETURNS DECIMAL(10,2) AS $$
+-- Обновление снимка books.copies_available по book_copies; меняет только
+-- расходящиеся строки и возвращает их число. Запускается по расписанию,
+-- например вместе с sweep_overdue_loans
+CREATE OR REPLACE FUNCTION sync_books_availability()
+RETURNS INTEGER AS $$
 DECLARE
-    days_overdue INTEGER;
-    fine_per_day DECIMAL(10,2) := 10.00; -- 10 рублей за день
-    max_fine DECIMAL(10,2) := 1000.00; -- максимальный штраф
+    fixed_count INTEGER;
 BEGIN
-    SELECT GREATEST(0, CURRENT_DATE - due_date) 
-    INTO days_overdue
-    FROM loans 
-    WHERE loan_id = loan_id_param AND status != 'возвращена';
-    
-    RETURN LEAST(days_overdue * fine_per_day, max_fine);
+    UPDATE books b
+    SET copies_available = f.copies_available
+    FROM (
+        SELECT bk.book_id, COALESCE(s.copies_available, 0) AS copies_available
+        FROM books bk
+        LEFT JOIN v_book_stock s ON s.book_id = bk.book_id
+    ) f
+    WHERE f.book_id = b.book_id
+      AND b.copies_available <> f.copies_available;
+
+    GET DIAGNOSTICS fixed_count = ROW_COUNT;
+    RETURN fixed_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Краткое имя автора для отчетов: 'Толстой Л.Н.'
+CREATE OR REPLACE FUNCTION author_short_name(
+    p_last_name VARCHAR(50),
+    p_first_name VARCHAR(50),
+    p_middle_name VARCHAR(50)
+) RETURNS TEXT AS $$
+    SELECT CASE 
+        WHEN p_middle_name IS NOT NULL THEN 
+            p_last_name || ' ' || LEFT(p_first_name, 1) || '.' || LEFT(p_middle_name, 1) || '.'
+        ELSE 
+            p_last_name || ' ' || LEFT(p_first_name, 1) || '.'
+    END;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Перестроение books.authors_display (для всех книг или одной);
+-- возвращает количество исправленных строк
+CREATE OR REPLACE FUNCTION rebuild_book_authors_display(p_book_id INTEGER DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+    fixed_count INTEGER;
+BEGIN
+    UPDATE books b
+    SET authors_display = d.authors
+    FROM (
+        SELECT 
+            bk.book_id,
+            STRING_AGG(author_short_name(a.last_name, a.first_name, a.middle_name),
+                       ', ' ORDER BY ba.author_id) AS authors
+        FROM books bk
+        LEFT JOIN book_authors ba ON ba.book_id = bk.book_id
+        LEFT JOIN authors a ON a.author_id = ba.author_id
+        WHERE p_book_id IS NULL OR bk.book_id = p_book_id
+        GROUP BY bk.book_id
+    ) d
+    WHERE b.book_id = d.book_id
+      AND b.authors_display IS DISTINCT FROM d.authors;
+    GET DIAGNOSTICS fixed_count = ROW_COUNT;
+    RETURN fixed_count;
 END;
 $$ LANGUAGE plpgsql;
 
+-- Полное имя автора для поискового индекса: 'Толстой Лев Николаевич'
+CREATE OR REPLACE FUNCTION author_full_name(
+    p_last_name VARCHAR(50),
+    p_first_name VARCHAR(50),
+    p_middle_name VARCHAR(50)
+) RETURNS TEXT AS $$
+    SELECT p_last_name || ' ' || p_first_name || COALESCE(' ' || p_middle_name, '');
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Поисковый документ книги с весами: название (A), авторы (B),
+-- категория (C), ISBN только цифрами (D)
+CREATE OR REPLACE FUNCTION book_search_document(
+    p_title TEXT,
+    p_authors TEXT,
+    p_category TEXT,
+    p_isbn TEXT
+) RETURNS TSVECTOR AS $$
+    SELECT setweight(to_tsvector('russian', COALESCE(p_title, '')), 'A')
+        || setweight(to_tsvector('russian', COALESCE(p_authors, '')), 'B')
+        || setweight(to_tsvector('russian', COALESCE(p_category, '')), 'C')
+        || setweight(to_tsvector('simple', COALESCE(regexp_replace(p_isbn, '[^0-9Xx]', '', 'g'), '')), 'D');
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Запрос каталога: ISBN (не меньше 10 цифр, дефисы и пробелы допустимы)
+-- ищется по цифрам, остальное разбирается как запрос веб-поиска:
+-- слова, "фразы", OR и -исключения
+CREATE OR REPLACE FUNCTION catalog_search_query(p_query TEXT)
+RETURNS TSQUERY AS $$
+    SELECT CASE
+        WHEN p_query ~ '^[0-9Xx -]+$' AND length(regexp_replace(p_query, '[^0-9]', '', 'g')) >= 10
+            THEN to_tsquery('simple', lower(regexp_replace(p_query, '[^0-9Xx]', '', 'g')))
+        ELSE websearch_to_tsquery('russian', p_query)
+    END;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Перестроение books.search_vector (для всех книг, одной книги или
+-- категории); возвращает количество исправленных строк
+CREATE OR REPLACE FUNCTION rebuild_book_search_vector(
+    p_book_id INTEGER DEFAULT NULL,
+    p_category_id INTEGER DEFAULT NULL
+) RETURNS INTEGER AS $$
+DECLARE
+    fixed_count INTEGER;
+BEGIN
+    UPDATE books b
+    SET search_vector = d.search_vector
+    FROM (
+        SELECT 
+            bk.book_id,
+            book_search_document(
+                bk.title,
+                STRING_AGG(author_full_name(a.last_name, a.first_name, a.middle_name),
+                           ' ' ORDER BY ba.author_id),
+                c.name,
+                bk.isbn) AS search_vector
+        FROM books bk
+        JOIN categories c ON c.category_id = bk.category_id
+        LEFT JOIN book_authors ba ON ba.book_id = bk.book_id
+        LEFT JOIN authors a ON a.author_id = ba.author_id
+        WHERE (p_book_id IS NULL OR bk.book_id = p_book_id)
+          AND (p_category_id IS NULL OR bk.category_id = p_category_id)
+        GROUP BY bk.book_id, c.name
+    ) d
+    WHERE b.book_id = d.book_id
+      AND b.search_vector IS DISTINCT FROM d.search_vector;
+    GET DIAGNOSTICS fixed_count = ROW_COUNT;
+    RETURN fixed_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Поиск по каталогу: отбор по GIN-индексу idx_books_search, сортировка
+-- по ts_rank с учетом весов. Примеры:
+--     SELECT * FROM search_books('Толстой война');
+--     SELECT * FROM search_books('978-5-17-090345-6', 5);
+CREATE OR REPLACE FUNCTION search_books(p_query TEXT, p_limit INTEGER DEFAULT 20)
+RETURNS TABLE(
+    book_id INTEGER,
+    title VARCHAR(200),
+    authors TEXT,
+    category_name VARCHAR(100),
+    isbn VARCHAR(20),
+    rank REAL
+) AS $$
+    SELECT 
+        b.book_id,
+        b.title,
+        b.authors_display,
+        c.name,
+        b.isbn,
+        ts_rank(b.search_vector, catalog_search_query(p_query)) AS rank
+    FROM books b
+    JOIN categories c ON c.category_id = b.category_id
+    WHERE b.search_vector @@ catalog_search_query(p_query)
+    ORDER BY rank DESC, b.book_id
+    LIMIT p_limit;
+$$ LANGUAGE sql STABLE;
+
+-- Нечеткий поиск читателей по фамилии, имени, отчеству, email и телефону
+-- (опечатки, части слов). Кандидаты отбираются оператором <% и
+-- упорядочиваются по расстоянию <<-> обходом GiST-индекса
+-- idx_readers_search (KNN), поэтому первые p_limit строк находятся без
+-- просмотра всей таблицы. Телефон можно вводить в любом формате.
+--     SELECT * FROM search_readers('Иваноф Петр');
+--     SELECT * FROM search_readers('8 915 123-45-67', 5);
+CREATE OR REPLACE FUNCTION search_readers(p_query TEXT, p_limit INTEGER DEFAULT 10)
+RETURNS TABLE(
+    reader_id INTEGER,
+    full_name TEXT,
+    reader_type VARCHAR(20),
+    email VARCHAR(100),
+    phone VARCHAR(20),
+    is_active BOOLEAN,
+    similarity REAL
+) AS $$
+    SELECT 
+        r.reader_id,
+        r.last_name || ' ' || r.first_name || COALESCE(' ' || r.middle_name, ''),
+        r.reader_type,
+        r.email,
+        r.phone,
+        r.is_active,
+        word_similarity(q.query, r.search_text)
+    FROM (
+        SELECT CASE WHEN p_query ~ '^[0-9+() -]+$'
+                    THEN regexp_replace(p_query, '[^0-9]', '', 'g')
+                    ELSE p_query
+               END AS query
+    ) q
+    JOIN readers r ON q.query <% r.search_text
+    ORDER BY q.query <<-> r.search_text, r.reader_id
+    LIMIT p_limit;
+$$ LANGUAGE sql STABLE
+SET pg_trgm.word_similarity_threshold = 0.3;
+
+-- Нечеткий поиск авторов по фамилии, имени и отчеству (KNN по
+-- GiST-индексу idx_authors_search)
+--     SELECT * FROM search_authors('Дастоевский');
+CREATE OR REPLACE FUNCTION search_authors(p_query TEXT, p_limit INTEGER DEFAULT 10)
+RETURNS TABLE(
+    author_id INTEGER,
+    full_name TEXT,
+    birth_year INTEGER,
+    country VARCHAR(50),
+    similarity REAL
+) AS $$
+    SELECT 
+        a.author_id,
+        a.search_text,
+        a.birth_year,
+        a.country,
+        word_similarity(p_query, a.search_text)
+    FROM authors a
+    WHERE p_query <% a.search_text
+    ORDER BY p_query <<-> a.search_text, a.author_id
+    LIMIT p_limit;
+$$ LANGUAGE sql STABLE
+SET pg_trgm.word_similarity_threshold = 0.3;
+
+-- Фактическая статистика читателей, посчитанная по loans и fines
+-- вместе с архивом
+-- (эталон для проверки и перестроения reader_loan_stats)
+CREATE OR REPLACE FUNCTION reader_stats_actual(p_reader_id INTEGER DEFAULT NULL)
+RETURNS SETOF reader_loan_stats AS $$
+    SELECT 
+        l.reader_id,
+        COUNT(*)::INTEGER,
+        COUNT(*) FILTER (WHERE l.status = 'выдана')::INTEGER,
+        COUNT(*) FILTER (WHERE l.status = 'просрочена')::INTEGER,
+        COUNT(*) FILTER (WHERE l.status = 'возвращена')::INTEGER,
+        COALESCE(SUM(f.amount), 0),
+        COALESCE(SUM(f.amount) FILTER (WHERE f.paid = FALSE), 0)
+    FROM v_loans_all l
+    LEFT JOIN v_fines_all f ON f.loan_id = l.loan_id
+    WHERE p_reader_id IS NULL OR l.reader_id = p_reader_id
+    GROUP BY l.reader_id;
+$$ LANGUAGE sql STABLE;
+
+-- Проверка расхождений reader_loan_stats с исходными таблицами
+CREATE OR REPLACE FUNCTION verify_reader_stats(p_reader_id INTEGER DEFAULT NULL)
+RETURNS TABLE(
+    reader_id INTEGER,
+    stat_name TEXT,
+    stored_value DECIMAL(12,2),
+    actual_value DECIMAL(12,2)
+) AS $$
+    SELECT COALESCE(s.reader_id, a.reader_id), v.stat_name, v.stored_value, v.actual_value
+    FROM (SELECT * FROM reader_loan_stats
+          WHERE p_reader_id IS NULL OR reader_id = p_reader_id) s
+    FULL JOIN reader_stats_actual(p_reader_id) a ON a.reader_id = s.reader_id
+    CROSS JOIN LATERAL (VALUES
+        ('total_loans', COALESCE(s.total_loans, 0), COALESCE(a.total_loans, 0)),
+        ('active_loans', COALESCE(s.active_loans, 0), COALESCE(a.active_loans, 0)),
+        ('overdue_loans', COALESCE(s.overdue_loans, 0), COALESCE(a.overdue_loans, 0)),
+        ('returned_loans', COALESCE(s.returned_loans, 0), COALESCE(a.returned_loans, 0)),
+        ('total_fines', COALESCE(s.total_fines, 0), COALESCE(a.total_fines, 0)),
+        ('unpaid_fines', COALESCE(s.unpaid_fines, 0), COALESCE(a.unpaid_fines, 0))
+    ) AS v(stat_name, stored_value, actual_value)
+    WHERE v.stored_value <> v.actual_value
+    ORDER BY 1, 2;
+$$ LANGUAGE sql STABLE;
+
+-- Перестроение reader_loan_stats (для всех читателей или одного);
+-- возвращает количество исправленных строк
+CREATE OR REPLACE FUNCTION rebuild_reader_stats(p_reader_id INTEGER DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+    fixed_count INTEGER;
+    removed_count INTEGER;
+BEGIN
+    INSERT INTO reader_loan_stats
+    SELECT * FROM reader_stats_actual(p_reader_id)
+    ON CONFLICT (reader_id) DO UPDATE SET
+        total_loans = EXCLUDED.total_loans,
+        active_loans = EXCLUDED.active_loans,
+        overdue_loans = EXCLUDED.overdue_loans,
+        returned_loans = EXCLUDED.returned_loans,
+        total_fines = EXCLUDED.total_fines,
+        unpaid_fines = EXCLUDED.unpaid_fines
+    WHERE (reader_loan_stats.total_loans, reader_loan_stats.active_loans,
+           reader_loan_stats.overdue_loans, reader_loan_stats.returned_loans,
+           reader_loan_stats.total_fines, reader_loan_stats.unpaid_fines)
+        IS DISTINCT FROM
+          (EXCLUDED.total_loans, EXCLUDED.active_loans, EXCLUDED.overdue_loans,
+           EXCLUDED.returned_loans, EXCLUDED.total_fines, EXCLUDED.unpaid_fines);
+    GET DIAGNOSTICS fixed_count = ROW_COUNT;
+
+    -- Строки читателей, у которых больше нет выдач
+    DELETE FROM reader_loan_stats s
+    WHERE (p_reader_id IS NULL OR s.reader_id = p_reader_id)
+      AND NOT EXISTS (SELECT 1 FROM loans l WHERE l.reader_id = s.reader_id)
+      AND NOT EXISTS (SELECT 1 FROM loans_history h WHERE h.reader_id = s.reader_id);
+    GET DIAGNOSTICS removed_count = ROW_COUNT;
+
+    RETURN fixed_count + removed_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Перестроение book_loans_daily, category_loans_daily и book_loan_totals
+-- по всем выдачам (с архивом); категории — текущие категории книг.
+-- Возвращает количество исправленных строк
+CREATE OR REPLACE FUNCTION rebuild_loan_rollups()
+RETURNS INTEGER AS $$
+DECLARE
+    fixed_count INTEGER := 0;
+    step_count INTEGER;
+BEGIN
+    INSERT INTO book_loans_daily AS d (loan_day, book_id, loans)
+    SELECT loan_date, book_id, COUNT(*)
+    FROM v_loans_all
+    GROUP BY loan_date, book_id
+    ON CONFLICT (loan_day, book_id) DO UPDATE SET loans = EXCLUDED.loans
+    WHERE d.loans <> EXCLUDED.loans;
+    GET DIAGNOSTICS step_count = ROW_COUNT;
+    fixed_count := fixed_count + step_count;
+
+    DELETE FROM book_loans_daily d
+    WHERE NOT EXISTS (SELECT 1 FROM v_loans_all l
+                      WHERE l.loan_date = d.loan_day AND l.book_id = d.book_id);
+    GET DIAGNOSTICS step_count = ROW_COUNT;
+    fixed_count := fixed_count + step_count;
+
+    INSERT INTO category_loans_daily AS d (loan_day, category_id, loans)
+    SELECT bd.loan_day, b.category_id, SUM(bd.loans)
+    FROM book_loans_daily bd
+    JOIN books b ON b.book_id = bd.book_id
+    GROUP BY bd.loan_day, b.category_id
+    ON CONFLICT (loan_day, category_id) DO UPDATE SET loans = EXCLUDED.loans
+    WHERE d.loans <> EXCLUDED.loans;
+    GET DIAGNOSTICS step_count = ROW_COUNT;
+    fixed_count := fixed_count + step_count;
+
+    DELETE FROM category_loans_daily d
+    WHERE NOT EXISTS (SELECT 1 FROM book_loans_daily bd
+                      JOIN books b ON b.book_id = bd.book_id
+                      WHERE bd.loan_day = d.loan_day AND b.category_id = d.category_id);
+    GET DIAGNOSTICS step_count = ROW_COUNT;
+    fixed_count := fixed_count + step_count;
+
+    INSERT INTO book_loan_totals AS t (book_id, loans)
+    SELECT book_id, SUM(loans)
+    FROM book_loans_daily
+    GROUP BY book_id
+    ON CONFLICT (book_id) DO UPDATE SET loans = EXCLUDED.loans
+    WHERE t.loans <> EXCLUDED.loans;
+    GET DIAGNOSTICS step_count = ROW_COUNT;
+    fixed_count := fixed_count + step_count;
+
+    DELETE FROM book_loan_totals t
+    WHERE NOT EXISTS (SELECT 1 FROM book_loans_daily bd WHERE bd.book_id = t.book_id);
+    GET DIAGNOSTICS step_count = ROW_COUNT;
+
+    RETURN fixed_count + step_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Самые выдаваемые книги за период [p_from, p_to] по дневным итогам:
+-- стоимость зависит от длины периода, а не от всей истории выдач
+--     SELECT * FROM top_books_between(DATE '2024-09-01', DATE '2024-12-31', 20);
+CREATE OR REPLACE FUNCTION top_books_between(
+    p_from DATE,
+    p_to DATE DEFAULT CURRENT_DATE,
+    p_limit INTEGER DEFAULT 10
+) RETURNS TABLE(
+    book_id INTEGER,
+    title VARCHAR(200),
+    authors TEXT,
+    category_name VARCHAR(100),
+    loans BIGINT
+) AS $$
+    SELECT b.book_id, b.title, b.authors_display, c.name, d.loans
+    FROM (
+        SELECT bd.book_id, SUM(bd.loans) AS loans
+        FROM book_loans_daily bd
+        WHERE bd.loan_day BETWEEN p_from AND p_to
+        GROUP BY bd.book_id
+        ORDER BY loans DESC, bd.book_id
+        LIMIT p_limit
+    ) d
+    JOIN books b ON b.book_id = d.book_id
+    JOIN categories c ON c.category_id = b.category_id
+    ORDER BY d.loans DESC, d.book_id;
+$$ LANGUAGE sql STABLE PARALLEL SAFE;
+
+-- Выдачи по категориям за период и доля каждой категории
+CREATE OR REPLACE FUNCTION category_loans_between(
+    p_from DATE,
+    p_to DATE DEFAULT CURRENT_DATE
+) RETURNS TABLE(
+    category_id INTEGER,
+    category_name VARCHAR(100),
+    loans BIGINT,
+    share_percent DECIMAL(5,2)
+) AS $$
+    SELECT c.category_id, c.name, d.loans,
+           ROUND(d.loans * 100.0 / NULLIF(SUM(d.loans) OVER (), 0), 2)
+    FROM (
+        SELECT cd.category_id, SUM(cd.loans) AS loans
+        FROM category_loans_daily cd
+        WHERE cd.loan_day BETWEEN p_from AND p_to
+        GROUP BY cd.category_id
+    ) d
+    JOIN categories c ON c.category_id = d.category_id
+    ORDER BY d.loans DESC, c.category_id;
+$$ LANGUAGE sql STABLE PARALLEL SAFE;
+
+-- Динамика выдач по категориям: итоги по дням, неделям или месяцам
+-- (p_bucket — 'day', 'week', 'month'), для одной категории или всех
+CREATE OR REPLACE FUNCTION loan_trend(
+    p_from DATE,
+    p_to DATE DEFAULT CURRENT_DATE,
+    p_bucket TEXT DEFAULT 'week',
+    p_category_id INTEGER DEFAULT NULL
+) RETURNS TABLE(
+    bucket_start DATE,
+    category_id INTEGER,
+    category_name VARCHAR(100),
+    loans BIGINT
+) AS $$
+    SELECT date_trunc(p_bucket, cd.loan_day)::DATE, c.category_id, c.name, SUM(cd.loans)
+    FROM category_loans_daily cd
+    JOIN categories c ON c.category_id = cd.category_id
+    WHERE cd.loan_day BETWEEN p_from AND p_to
+      AND (p_category_id IS NULL OR cd.category_id = p_category_id)
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2;
+$$ LANGUAGE sql STABLE PARALLEL SAFE;
+
+-- Постановка заявок в очередь loan_requests; возвращают request_id, по
+-- которому клиент опрашивает заявку или ждет уведомления
+-- library_loan_request_done
+CREATE OR REPLACE FUNCTION request_issue(
+    p_reader_id INTEGER,
+    p_book_id INTEGER,
+    p_notes TEXT DEFAULT NULL
+) RETURNS BIGINT AS $$
+    INSERT INTO loan_requests (operation, reader_id, book_id, notes)
+    VALUES ('выдача', p_reader_id, p_book_id, p_notes)
+    RETURNING request_id;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION request_return(
+    p_loan_id INTEGER,
+    p_return_date DATE DEFAULT CURRENT_DATE
+) RETURNS BIGINT AS $$
+    INSERT INTO loan_requests (operation, loan_id, return_date)
+    VALUES ('возврат', p_loan_id, p_return_date)
+    RETURNING request_id;
+$$ LANGUAGE sql;
+
+-- Удаление обработанных заявок старше p_older_than; возвращает их число
+CREATE OR REPLACE FUNCTION purge_loan_requests(p_older_than INTERVAL DEFAULT '7 days')
+RETURNS INTEGER AS $$
+    WITH purged AS (
+        DELETE FROM loan_requests
+        WHERE status != 'ожидает' AND processed_at < CURRENT_TIMESTAMP - p_older_than
+        RETURNING 1
+    )
+    SELECT COUNT(*)::INTEGER FROM purged;
+$$ LANGUAGE sql;
+"""
+
+# Функции триггеров
+TRIGGER_FUNCTIONS_SQL = """
 -- =====================================================================
 -- ТРИГГЕРЫ ДЛЯ АВТОМАТИЗАЦИИ
 -- =====================================================================
 
--- Триггер для автоматического обновления количества доступных книг
+-- Триггер учета экземпляров уровня оператора: выдачи оператора INSERT
+-- занимают свободные экземпляры в book_copies одним запросом, возвраты
+-- оператора UPDATE освобождают их одним UPDATE. Строка books не меняется.
+-- Выдачи и возвраты берутся из таблиц переходов new_loans/old_loans
 CREATE OR REPLACE FUNCTION update_book_availability()
 RETURNS TRIGGER AS $$
+DECLARE
+    missing RECORD;
 BEGIN
     IF TG_OP = 'INSERT' THEN
-        -- Уменьшаем количество доступных книг при выдаче
-        UPDATE books 
-        SET copies_available = copies_available - 1
-        WHERE book_id = NEW.book_id AND copies_available > 0;
-        
-        IF NOT FOUND THEN
-            RAISE EXCEPTION 'Книга с ID % недоступна для выдачи', NEW.book_id;
-        END IF;
+        -- Занимаем экземпляры, не заблокированные другими выдачами: по
+        -- книге сразу столько, сколько выдач на нее в операторе
+        WITH wanted AS (
+            SELECT book_id, array_agg(loan_id ORDER BY loan_id) AS loan_ids
+            FROM new_loans
+            GROUP BY book_id
+        ),
+        free AS (
+            SELECT w.book_id, w.loan_ids, f.copy_no,
+                   row_number() OVER (PARTITION BY w.book_id ORDER BY f.copy_no) AS n
+            FROM wanted w
+            CROSS JOIN LATERAL (
+                SELECT c.copy_no FROM book_copies c
+                WHERE c.book_id = w.book_id AND c.loan_id IS NULL
+                LIMIT cardinality(w.loan_ids)
+                FOR UPDATE SKIP LOCKED
+            ) f
+        )
+        UPDATE book_copies c
+        SET loan_id = f.loan_ids[f.n]
+        FROM free f
+        WHERE c.book_id = f.book_id AND c.copy_no = f.copy_no;
         
-        RETURN NEW;
-        
-    ELSIF TG_OP = 'UPDATE' THEN
-        -- Увеличиваем количество при возврате
-        IF OLD.status != 'возвращена' AND NEW.status = 'возвращена' THEN
-            UPDATE books 
-            SET copies_available = copies_available + 1
-            WHERE book_id = NEW.book_id;
+        -- Выдачи, которым не хватило свободных незаблокированных экземпляров
+        FOR missing IN
+            SELECT n.loan_id, n.book_id
+            FROM new_loans n
+            WHERE NOT EXISTS (SELECT 1 FROM book_copies c WHERE c.loan_id = n.loan_id)
+            ORDER BY n.loan_id
+        LOOP
+            -- Все свободные экземпляры заблокированы незавершенными выдачами:
+            -- ждем их, экземпляр освободится, если одна из них откатится
+            UPDATE book_copies c
+            SET loan_id = missing.loan_id
+            FROM (SELECT copy_no FROM book_copies
+                  WHERE book_id = missing.book_id AND loan_id IS NULL
+                  LIMIT 1
+                  FOR UPDATE) free
+            WHERE c.book_id = missing.book_id AND c.copy_no = free.copy_no;
             
-            -- Устанавливаем дату возврата, если не указана
-            IF NEW.return_date IS NULL THEN
-                NEW.return_date := CURRENT_DATE;
+            IF NOT FOUND THEN
+                RAISE EXCEPTION 'Книга с ID % недоступна для выдачи', missing.book_id;
             END IF;
-        END IF;
+        END LOOP;
         
-        -- Автоматически меняем статус на "просрочена" если срок истек
-        IF OLD.status = 'выдана' AND NEW.due_date < CURRENT_DATE AND NEW.status = 'выдана' THEN
-            NEW.status := 'просрочена';
-        END IF;
-        
-        RETURN NEW;
+    ELSIF TG_OP = 'UPDATE' THEN
+        -- Освобождаем экземпляры возвращенных выдач
+        UPDATE book_copies c
+        SET loan_id = NULL
+        FROM old_loans o
+        JOIN new_loans n ON n.loan_id = o.loan_id
+        WHERE c.loan_id = n.loan_id
+          AND o.status != 'возвращена' AND n.status = 'возвращена';
     END IF;
     
     RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
-CREATE TRIGGER tr_update_book_availability
-    AFTER INSERT OR UPDATE ON loans
-    FOR EACH ROW
-    EXECUTE FUNCTION update_book_availability();
+-- Дата возврата и статус «просрочена» при изменении выдачи. Вызывается
+-- только для строк, прошедших условие WHEN триггера
+CREATE OR REPLACE FUNCTION set_loan_status()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- Устанавливаем дату возврата, если не указана
+    IF OLD.status != 'возвращена' AND NEW.status = 'возвращена' AND NEW.return_date IS NULL THEN
+        NEW.return_date := CURRENT_DATE;
+    END IF;
+    
+    -- Автоматически меняем статус на "просрочена" если срок истек
+    IF OLD.status = 'выдана' AND NEW.due_date < CURRENT_DATE AND NEW.status = 'выдана' THEN
+        NEW.status := 'просрочена';
+    END IF;
+    
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Экземпляры при добавлении книги и изменении copies_total. Списать
+-- можно только экземпляры на полке с номерами больше нового copies_total
+CREATE OR REPLACE FUNCTION maintain_book_copies()
+RETURNS TRIGGER AS $$
+DECLARE
+    old_total INTEGER := CASE WHEN TG_OP = 'UPDATE' THEN OLD.copies_total ELSE 0 END;
+BEGIN
+    IF NEW.copies_total > old_total THEN
+        INSERT INTO book_copies (book_id, copy_no)
+        SELECT NEW.book_id, n
+        FROM generate_series(old_total + 1, NEW.copies_total) AS n;
+    ELSIF NEW.copies_total < old_total THEN
+        DELETE FROM book_copies
+        WHERE book_id = NEW.book_id AND copy_no > NEW.copies_total AND loan_id IS NULL;
+        
+        IF EXISTS (SELECT 1 FROM book_copies
+                   WHERE book_id = NEW.book_id AND copy_no > NEW.copies_total) THEN
+            RAISE EXCEPTION 'Нельзя списать выданные экземпляры книги %', NEW.book_id;
+        END IF;
+    END IF;
+    
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
 
 -- Триггер для автоматического расчета срока возврата
 CREATE OR REPLACE FUNCTION set_loan_due_date()
@@ -487,17 +1481,406 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Инкрементное обновление reader_loan_stats: прибавляет разницу счетчиков
+CREATE OR REPLACE FUNCTION reader_stats_add(
+    p_reader_id INTEGER,
+    d_total INTEGER,
+    d_active INTEGER,
+    d_overdue INTEGER,
+    d_returned INTEGER,
+    d_fines DECIMAL(12,2),
+    d_unpaid DECIMAL(12,2)
+) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO reader_loan_stats AS s (reader_id, total_loans, active_loans, overdue_loans,
+                                        returned_loans, total_fines, unpaid_fines)
+    VALUES (p_reader_id, d_total, d_active, d_overdue, d_returned, d_fines, d_unpaid)
+    ON CONFLICT (reader_id) DO UPDATE SET
+        total_loans = s.total_loans + EXCLUDED.total_loans,
+        active_loans = s.active_loans + EXCLUDED.active_loans,
+        overdue_loans = s.overdue_loans + EXCLUDED.overdue_loans,
+        returned_loans = s.returned_loans + EXCLUDED.returned_loans,
+        total_fines = s.total_fines + EXCLUDED.total_fines,
+        unpaid_fines = s.unpaid_fines + EXCLUDED.unpaid_fines;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггер выдач: вычитает старое состояние строки и прибавляет новое.
+-- Удаление обрабатывается BEFORE DELETE, пока штраф выдачи еще не
+-- удален каскадом и его сумму можно списать со счетчиков читателя
+CREATE OR REPLACE FUNCTION maintain_reader_stats_loans()
+RETURNS TRIGGER AS $$
+DECLARE
+    fine_amount DECIMAL(12,2) := 0;
+    fine_unpaid DECIMAL(12,2) := 0;
+BEGIN
+    -- Перенос выдачи в loans_history не меняет статистику читателя
+    IF TG_OP = 'DELETE' AND current_setting('library.archiving', true) = 'on' THEN
+        RETURN OLD;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        IF TG_OP = 'DELETE' OR OLD.reader_id IS DISTINCT FROM NEW.reader_id THEN
+            SELECT COALESCE(SUM(amount), 0), COALESCE(SUM(amount) FILTER (WHERE paid = FALSE), 0)
+            INTO fine_amount, fine_unpaid
+            FROM fines WHERE loan_id = OLD.loan_id;
+        END IF;
+        PERFORM reader_stats_add(OLD.reader_id, -1,
+            -(OLD.status IS NOT DISTINCT FROM 'выдана')::INTEGER,
+            -(OLD.status IS NOT DISTINCT FROM 'просрочена')::INTEGER,
+            -(OLD.status IS NOT DISTINCT FROM 'возвращена')::INTEGER,
+            -fine_amount, -fine_unpaid);
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+
+    PERFORM reader_stats_add(NEW.reader_id, 1,
+        (NEW.status IS NOT DISTINCT FROM 'выдана')::INTEGER,
+        (NEW.status IS NOT DISTINCT FROM 'просрочена')::INTEGER,
+        (NEW.status IS NOT DISTINCT FROM 'возвращена')::INTEGER,
+        fine_amount, fine_unpaid);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггер штрафов: сумма переносится на читателя выдачи.
+-- Если выдача уже удалена (каскад), ее штраф списан триггером выдач
+CREATE OR REPLACE FUNCTION maintain_reader_stats_fines()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_reader_id INTEGER;
+BEGIN
+    -- Перенос штрафов в fines_history не меняет статистику читателя
+    IF current_setting('library.archiving', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT reader_id INTO v_reader_id FROM loans
+        WHERE loan_id = OLD.loan_id AND loan_date = OLD.loan_date;
+        IF FOUND THEN
+            PERFORM reader_stats_add(v_reader_id, 0, 0, 0, 0,
+                -OLD.amount, -CASE WHEN OLD.paid THEN 0 ELSE OLD.amount END);
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT reader_id INTO v_reader_id FROM loans
+        WHERE loan_id = NEW.loan_id AND loan_date = NEW.loan_date;
+        IF FOUND THEN
+            PERFORM reader_stats_add(v_reader_id, 0, 0, 0, 0,
+                NEW.amount, CASE WHEN NEW.paid THEN 0 ELSE NEW.amount END);
+        END IF;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Итоги выдач: прибавляет p_delta к дневным итогам книги и ее текущей
+-- категории и к общему итогу книги
+CREATE OR REPLACE FUNCTION loan_rollups_add(
+    p_book_id INTEGER,
+    p_loan_day DATE,
+    p_delta INTEGER
+) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO book_loans_daily AS d (loan_day, book_id, loans)
+    VALUES (p_loan_day, p_book_id, p_delta)
+    ON CONFLICT (loan_day, book_id) DO UPDATE SET loans = d.loans + EXCLUDED.loans;
+
+    INSERT INTO book_loan_totals AS t (book_id, loans)
+    VALUES (p_book_id, p_delta)
+    ON CONFLICT (book_id) DO UPDATE SET loans = t.loans + EXCLUDED.loans;
+
+    INSERT INTO category_loans_daily AS d (loan_day, category_id, loans)
+    SELECT p_loan_day, b.category_id, p_delta
+    FROM books b WHERE b.book_id = p_book_id
+    ON CONFLICT (loan_day, category_id) DO UPDATE SET loans = d.loans + EXCLUDED.loans;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггер выдач для book_loans_daily, category_loans_daily и
+-- book_loan_totals. Перенос в архив итоги не меняет: архивные выдачи
+-- остаются в статистике
+CREATE OR REPLACE FUNCTION maintain_loan_rollups()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' AND current_setting('library.archiving', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM loan_rollups_add(OLD.book_id, OLD.loan_date, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM loan_rollups_add(NEW.book_id, NEW.loan_date, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Строка авторов книги при изменении состава авторов
+CREATE OR REPLACE FUNCTION maintain_authors_display_links()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM rebuild_book_authors_display(OLD.book_id);
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.book_id <> OLD.book_id) THEN
+        PERFORM rebuild_book_authors_display(NEW.book_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Строка авторов всех книг автора при изменении его ФИО
+CREATE OR REPLACE FUNCTION maintain_authors_display_names()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_book_id INTEGER;
+BEGIN
+    FOR v_book_id IN
+        SELECT book_id FROM book_authors WHERE author_id = NEW.author_id
+    LOOP
+        PERFORM rebuild_book_authors_display(v_book_id);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Поисковый вектор при изменении самой книги
+CREATE OR REPLACE FUNCTION set_book_search_vector()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.search_vector := book_search_document(
+        NEW.title,
+        (SELECT STRING_AGG(author_full_name(a.last_name, a.first_name, a.middle_name),
+                           ' ' ORDER BY ba.author_id)
+         FROM book_authors ba
+         JOIN authors a ON a.author_id = ba.author_id
+         WHERE ba.book_id = NEW.book_id),
+        (SELECT name FROM categories WHERE category_id = NEW.category_id),
+        NEW.isbn);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Поисковый вектор при изменении связей книга-автор
+CREATE OR REPLACE FUNCTION maintain_search_vector_links()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM rebuild_book_search_vector(OLD.book_id);
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.book_id <> OLD.book_id) THEN
+        PERFORM rebuild_book_search_vector(NEW.book_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Поисковый вектор книг автора при изменении его имени
+CREATE OR REPLACE FUNCTION maintain_search_vector_names()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_book_id INTEGER;
+BEGIN
+    FOR v_book_id IN
+        SELECT book_id FROM book_authors WHERE author_id = NEW.author_id
+    LOOP
+        PERFORM rebuild_book_search_vector(v_book_id);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Поисковый вектор книг категории при ее переименовании
+CREATE OR REPLACE FUNCTION maintain_search_vector_categories()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM rebuild_book_search_vector(NULL, NEW.category_id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Уведомление кэшей приложений (library_client.BookCache) об изменении
+-- книги, ее авторов или выдач: NOTIFY library_book_changed с book_id.
+-- Одинаковые уведомления одной транзакции доставляются один раз
+CREATE OR REPLACE FUNCTION notify_book_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- Архивируются только возвращенные выдачи: наличие книг не меняется
+    IF current_setting('library.archiving', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM pg_notify('library_book_changed', OLD.book_id::TEXT);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM pg_notify('library_book_changed', NEW.book_id::TEXT);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Очередь заявок: новые заявки будят воркеров (library_loan_requests, один
+-- раз на оператор), обработанная заявка сообщает свой request_id
+-- клиентам (library_loan_request_done)
+CREATE OR REPLACE FUNCTION notify_loan_requests()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM pg_notify('library_loan_requests', '');
+    ELSE
+        PERFORM pg_notify('library_loan_request_done', NEW.request_id::TEXT);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# Триггеры (подключаются после функций; при массовой загрузке — после данных)
+TRIGGERS_SQL = """
+-- Подключение триггеров к таблице выдач. Учет экземпляров — на уровне
+-- оператора: список столбцов (UPDATE OF) с таблицами переходов не
+-- допускается, поэтому правка примечаний стоит один вызов на оператор,
+-- а не на строку
+CREATE TRIGGER tr_update_book_availability_insert
+    AFTER INSERT ON loans
+    REFERENCING NEW TABLE AS new_loans
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_book_availability();
+
+CREATE TRIGGER tr_update_book_availability_update
+    AFTER UPDATE ON loans
+    REFERENCING OLD TABLE AS old_loans NEW TABLE AS new_loans
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_book_availability();
+
+CREATE TRIGGER tr_set_loan_status
+    BEFORE UPDATE OF status, due_date ON loans
+    FOR EACH ROW
+    WHEN ((OLD.status != 'возвращена' AND NEW.status = 'возвращена' AND NEW.return_date IS NULL)
+          OR (OLD.status = 'выдана' AND NEW.status = 'выдана' AND NEW.due_date < CURRENT_DATE))
+    EXECUTE FUNCTION set_loan_status();
+
 CREATE TRIGGER tr_set_loan_due_date
     BEFORE INSERT ON loans
     FOR EACH ROW
     EXECUTE FUNCTION set_loan_due_date();
 
+-- Экземпляры книги (book_copies)
+CREATE TRIGGER tr_book_copies
+    AFTER INSERT OR UPDATE OF copies_total ON books
+    FOR EACH ROW
+    EXECUTE FUNCTION maintain_book_copies();
+
+-- Сводная статистика читателей (reader_loan_stats)
+CREATE TRIGGER tr_reader_stats_loans
+    AFTER INSERT OR UPDATE OF reader_id, status ON loans
+    FOR EACH ROW
+    EXECUTE FUNCTION maintain_reader_stats_loans();
+
+CREATE TRIGGER tr_reader_stats_loans_delete
+    BEFORE DELETE ON loans
+    FOR EACH ROW
+    EXECUTE FUNCTION maintain_reader_stats_loans();
+
+CREATE TRIGGER tr_reader_stats_fines
+    AFTER INSERT OR UPDATE OF loan_id, loan_date, amount, paid_date OR DELETE ON fines
+    FOR EACH ROW
+    EXECUTE FUNCTION maintain_reader_stats_fines();
+
+-- Итоги выдач (book_loans_daily, category_loans_daily, book_loan_totals)
+CREATE TRIGGER tr_loan_rollups
+    AFTER INSERT OR DELETE ON loans
+    FOR EACH ROW
+    EXECUTE FUNCTION maintain_loan_rollups();
+
+CREATE TRIGGER tr_loan_rollups_update
+    AFTER UPDATE OF book_id, loan_date ON loans
+    FOR EACH ROW
+    WHEN (OLD.book_id IS DISTINCT FROM NEW.book_id OR OLD.loan_date IS DISTINCT FROM NEW.loan_date)
+    EXECUTE FUNCTION maintain_loan_rollups();
+
+-- Строка авторов книги (books.authors_display)
+CREATE TRIGGER tr_authors_display_links
+    AFTER INSERT OR UPDATE OR DELETE ON book_authors
+    FOR EACH ROW
+    EXECUTE FUNCTION maintain_authors_display_links();
+
+CREATE TRIGGER tr_authors_display_names
+    AFTER UPDATE OF last_name, first_name, middle_name ON authors
+    FOR EACH ROW
+    WHEN (OLD.last_name IS DISTINCT FROM NEW.last_name
+          OR OLD.first_name IS DISTINCT FROM NEW.first_name
+          OR OLD.middle_name IS DISTINCT FROM NEW.middle_name)
+    EXECUTE FUNCTION maintain_authors_display_names();
+
+-- Поисковый вектор каталога (books.search_vector)
+CREATE TRIGGER tr_book_search_vector
+    BEFORE INSERT OR UPDATE OF title, isbn, category_id ON books
+    FOR EACH ROW
+    EXECUTE FUNCTION set_book_search_vector();
+
+CREATE TRIGGER tr_search_vector_links
+    AFTER INSERT OR UPDATE OR DELETE ON book_authors
+    FOR EACH ROW
+    EXECUTE FUNCTION maintain_search_vector_links();
+
+CREATE TRIGGER tr_search_vector_names
+    AFTER UPDATE OF last_name, first_name, middle_name ON authors
+    FOR EACH ROW
+    WHEN (OLD.last_name IS DISTINCT FROM NEW.last_name
+          OR OLD.first_name IS DISTINCT FROM NEW.first_name
+          OR OLD.middle_name IS DISTINCT FROM NEW.middle_name)
+    EXECUTE FUNCTION maintain_search_vector_names();
+
+CREATE TRIGGER tr_search_vector_categories
+    AFTER UPDATE OF name ON categories
+    FOR EACH ROW
+    WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION maintain_search_vector_categories();
+
+-- Уведомления кэшей о книгах (канал library_book_changed)
+CREATE TRIGGER tr_notify_books
+    AFTER INSERT OR UPDATE OR DELETE ON books
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_book_changed();
+
+CREATE TRIGGER tr_notify_loans
+    AFTER INSERT OR UPDATE OF book_id, status OR DELETE ON loans
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_book_changed();
+
+CREATE TRIGGER tr_notify_book_authors
+    AFTER INSERT OR UPDATE OR DELETE ON book_authors
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_book_changed();
+
+-- Очередь заявок (каналы library_loan_requests, library_loan_request_done)
+CREATE TRIGGER tr_loan_requests_new
+    AFTER INSERT ON loan_requests
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_loan_requests();
+
+CREATE TRIGGER tr_loan_requests_done
+    AFTER UPDATE OF status ON loan_requests
+    FOR EACH ROW
+    WHEN (OLD.status = 'ожидает' AND NEW.status != 'ожидает')
+    EXECUTE FUNCTION notify_loan_requests();
+"""
+
+# Примеры запросов
+EXAMPLES_SQL = """
 -- =====================================================================
 -- ПРИМЕРЫ ПОЛЕЗНЫХ ЗАПРОСОВ
 -- =====================================================================
 
--- 1. Поиск книг по автору (с использованием полнотекстового поиска)
--- SELECT * FROM v_books_detailed WHERE authors ILIKE '%Толстой%';
+-- 1. Поиск книг по автору, названию, категории или ISBN (полнотекстовый индекс)
+-- SELECT * FROM search_books('Толстой');
 
 -- 2. Читатели с просроченными книгами
 -- SELECT reader_full_name, book_title, days_overdue, phone, email
@@ -506,11 +1889,8 @@ CREATE TRIGGER tr_set_loan_due_date
 -- ORDER BY days_overdue DESC;
 
 -- 3. Самые популярные книги за последний месяц
--- SELECT title, authors, category_name, loans_last_month
--- FROM v_book_popularity 
--- WHERE loans_last_month > 0
--- ORDER BY loans_last_month DESC
--- LIMIT 10;
+-- SELECT title, authors, category_name, loans
+-- FROM top_books_between(CURRENT_DATE - 30, CURRENT_DATE, 10);
 
 -- 4. Читатели с наибольшими штрафами
 -- SELECT reader_name, reader_type, total_fines, unpaid_fines, reader_status
@@ -518,19 +1898,31 @@ CREATE TRIGGER tr_set_loan_due_date
 -- WHERE total_fines > 0
 -- ORDER BY unpaid_fines DESC;
 
--- 5. Статистика по категориям книг
+-- 5. Статистика по категориям книг (наличие по экземплярам, выдачи с архивом)
 -- SELECT 
 --     c.name AS category_name,
 --     COUNT(b.book_id) AS total_books,
---     SUM(b.copies_total) AS total_copies,
---     SUM(b.copies_available) AS available_copies,
---     COUNT(l.loan_id) AS total_loans
+--     COALESCE(SUM(b.copies_total), 0) AS total_copies,
+--     COALESCE(SUM(s.copies_available), 0) AS available_copies,
+--     COALESCE(SUM(t.loans), 0) AS total_loans
 -- FROM categories c
 -- LEFT JOIN books b ON c.category_id = b.category_id
--- LEFT JOIN loans l ON b.book_id = l.book_id
+-- LEFT JOIN v_book_stock s ON s.book_id = b.book_id
+-- LEFT JOIN book_loan_totals t ON t.book_id = b.book_id
 -- GROUP BY c.category_id, c.name
 -- ORDER BY total_loans DESC;
 
+-- 6. Поиск читателя или автора по имени с опечаткой
+-- SELECT * FROM search_readers('Иваноф Петр');
+-- SELECT * FROM search_authors('Дастоевский');
+
+-- 7. Самые выдаваемые книги и динамика по категориям за семестр
+-- SELECT * FROM top_books_between(DATE '2024-09-01', DATE '2024-12-31', 10);
+-- SELECT * FROM loan_trend(DATE '2024-09-01', DATE '2024-12-31', 'week');
+"""
+
+# Процедуры
+PROCEDURES_SQL = """
 -- =====================================================================
 -- СОЗДАНИЕ ПРОЦЕДУР ДЛЯ АДМИНИСТРИРОВАНИЯ
 -- =====================================================================
@@ -539,7 +1931,8 @@ CREATE TRIGGER tr_set_loan_due_date
 CREATE OR REPLACE PROCEDURE issue_book(
     p_reader_id INTEGER,
     p_book_id INTEGER,
-    p_librarian_notes TEXT DEFAULT NULL
+    p_librarian_notes TEXT DEFAULT NULL,
+    INOUT loan_id INTEGER DEFAULT NULL
 )
 LANGUAGE plpgsql
 AS $$
@@ -547,35 +1940,70 @@ DECLARE
     book_available BOOLEAN;
     reader_active BOOLEAN;
     overdue_count INTEGER;
+    on_hand_count INTEGER;
+    unpaid_total DECIMAL(12,2);
+    max_active INTEGER;
+    max_unpaid DECIMAL(10,2);
 BEGIN
-    -- Проверяем активность читателя
-    SELECT is_active INTO reader_active
-    FROM readers WHERE reader_id = p_reader_id;
+    -- Читатель, его счетчики и лимиты его типа — чтение по первичным
+    -- ключам, без просмотра истории выдач
+    SELECT r.is_active,
+           COALESCE(s.overdue_loans, 0),
+           COALESCE(s.active_loans + s.overdue_loans, 0),
+           COALESCE(s.unpaid_fines, 0),
+           t.max_active_loans,
+           t.max_unpaid_fines
+    INTO reader_active, overdue_count, on_hand_count, unpaid_total, max_active, max_unpaid
+    FROM readers r
+    LEFT JOIN reader_loan_stats s ON s.reader_id = r.reader_id
+    LEFT JOIN reader_type_limits t ON t.reader_type = r.reader_type
+    WHERE r.reader_id = p_reader_id;
+    
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Читатель с ID % не найден', p_reader_id;
+    END IF;
     
     IF NOT reader_active THEN
         RAISE EXCEPTION 'Читатель с ID % неактивен', p_reader_id;
     END IF;
     
     -- Проверяем наличие просроченных книг
-    SELECT COUNT(*) INTO overdue_count
-    FROM loans 
-    WHERE reader_id = p_reader_id AND status = 'просрочена';
-    
     IF overdue_count > 0 THEN
         RAISE EXCEPTION 'У читателя есть % просроченных книг. Выдача запрещена.', overdue_count;
     END IF;
     
+    IF unpaid_total > max_unpaid THEN
+        RAISE EXCEPTION 'Неоплаченные штрафы читателя (% руб.) превышают лимит % руб.',
+            unpaid_total, max_unpaid;
+    END IF;
+    
+    IF on_hand_count >= max_active THEN
+        RAISE EXCEPTION 'У читателя на руках % книг при лимите %', on_hand_count, max_active;
+    END IF;
+    
     -- Проверяем доступность книги
-    SELECT (copies_available > 0) INTO book_available
-    FROM books WHERE book_id = p_book_id;
+    SELECT available INTO book_available
+    FROM check_book_availability(p_book_id);
     
     IF NOT book_available THEN
         RAISE EXCEPTION 'Книга с ID % недоступна', p_book_id;
     END IF;
     
-    -- Выдаем книгу
+    -- Выдаем книгу; номер выдачи возвращается в loan_id
     INSERT INTO loans (reader_id, book_id, notes)
-    VALUES (p_reader_id, p_book_id, p_librarian_notes);
+    VALUES (p_reader_id, p_book_id, p_librarian_notes)
+    RETURNING loans.loan_id INTO issue_book.loan_id;
+    
+    -- Параллельные выдачи тому же читателю прошли проверку по одному
+    -- снимку; строка счетчиков заблокирована триггером до конца транзакции,
+    -- поэтому повторное чтение видит их все
+    IF max_active IS NOT NULL THEN
+        SELECT active_loans + overdue_loans INTO on_hand_count
+        FROM reader_loan_stats WHERE reader_id = p_reader_id;
+        IF on_hand_count > max_active THEN
+            RAISE EXCEPTION 'У читателя на руках % книг при лимите %', on_hand_count - 1, max_active;
+        END IF;
+    END IF;
     
     RAISE NOTICE 'Книга успешно выдана читателю %', p_reader_id;
 END;
@@ -590,11 +2018,12 @@ LANGUAGE plpgsql
 AS $$
 DECLARE
     loan_status VARCHAR(20);
+    loan_date_value DATE;
     days_overdue INTEGER;
     fine_amount DECIMAL(10,2);
 BEGIN
-    -- Получаем статус выдачи
-    SELECT status INTO loan_status
+    -- Получаем статус выдачи (и ключ секции для следующих обращений)
+    SELECT status, loan_date INTO loan_status, loan_date_value
     FROM loans WHERE loan_id = p_loan_id;
     
     IF loan_status = 'возвращена' THEN
@@ -604,17 +2033,17 @@ BEGIN
     -- Обновляем статус выдачи
     UPDATE loans 
     SET status = 'возвращена', return_date = p_return_date
-    WHERE loan_id = p_loan_id;
+    WHERE loan_id = p_loan_id AND loan_date = loan_date_value;
     
-    -- Проверяем просрочку и начисляем штраф
-    SELECT GREATEST(0, p_return_date - due_date) INTO days_overdue
-    FROM loans WHERE loan_id = p_loan_id;
+    -- Проверяем просрочку и начисляем штраф на дату возврата
+    SELECT GREATEST(0, p_return_date - due_date), overdue_fine_amount(due_date, p_return_date)
+    INTO days_overdue, fine_amount
+    FROM loans WHERE loan_id = p_loan_id AND loan_date = loan_date_value;
     
     IF days_overdue > 0 THEN
-        fine_amount := calculate_overdue_fine(p_loan_id);
         
-        INSERT INTO fines (loan_id, amount, fine_type)
-        VALUES (p_loan_id, fine_amount, 'просрочка')
+        INSERT INTO fines (loan_id, loan_date, amount, fine_type)
+        VALUES (p_loan_id, loan_date_value, fine_amount, 'просрочка')
         ON CONFLICT (loan_id) DO UPDATE SET amount = fine_amount;
         
         RAISE NOTICE 'Книга возвращена с просрочкой % дней. Штраф: % руб.', days_overdue, fine_amount;
@@ -624,6 +2053,404 @@ BEGIN
 END;
 $$;
 
+-- Ночная обработка просрочек: пачками по p_batch_size выдач одним
+-- оператором переводит истекшие выдачи в 'просрочена' и начисляет или
+-- доначисляет штрафы (INSERT ... ON CONFLICT). Оплаченные штрафы и штрафы
+-- за порчу или утерю не меняются. После каждой пачки — COMMIT, поэтому
+-- блокировки держатся недолго, а процедуру нужно вызывать вне явного BEGIN:
+--     CALL sweep_overdue_loans();            -- пачки по 10000
+--     CALL sweep_overdue_loans(5000);
+CREATE OR REPLACE PROCEDURE sweep_overdue_loans(
+    p_batch_size INTEGER DEFAULT 10000,
+    INOUT marked_count INTEGER DEFAULT 0,
+    INOUT fined_count INTEGER DEFAULT 0
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    batch_marked INTEGER;
+    batch_fined INTEGER;
+    batch_selected INTEGER;
+BEGIN
+    marked_count := 0;
+    fined_count := 0;
+    LOOP
+        WITH batch AS (
+            SELECT l.loan_id, l.loan_date, l.due_date, l.status
+            FROM loans l
+            LEFT JOIN fines f ON f.loan_id = l.loan_id
+            WHERE l.status IN ('выдана', 'просрочена')
+              AND l.due_date < CURRENT_DATE
+              AND (l.status = 'выдана'
+                   OR f.loan_id IS NULL
+                   OR (f.paid_date IS NULL AND f.fine_type = 'просрочка'
+                       AND f.amount < overdue_fine_amount(l.due_date)))
+            LIMIT p_batch_size
+            FOR UPDATE OF l SKIP LOCKED
+        ),
+        marked AS (
+            UPDATE loans l
+            SET status = 'просрочена'
+            FROM batch b
+            WHERE l.loan_id = b.loan_id AND l.loan_date = b.loan_date
+              AND b.status = 'выдана'
+            RETURNING l.loan_id
+        ),
+        fined AS (
+            INSERT INTO fines (loan_id, loan_date, amount, fine_date, fine_type)
+            SELECT b.loan_id, b.loan_date, overdue_fine_amount(b.due_date), CURRENT_DATE, 'просрочка'
+            FROM batch b
+            ON CONFLICT (loan_id) DO UPDATE SET amount = EXCLUDED.amount
+                WHERE fines.paid_date IS NULL AND fines.fine_type = 'просрочка'
+                  AND fines.amount < EXCLUDED.amount
+            RETURNING fines.loan_id
+        )
+        SELECT (SELECT COUNT(*) FROM batch), (SELECT COUNT(*) FROM marked), (SELECT COUNT(*) FROM fined)
+        INTO batch_selected, batch_marked, batch_fined;
+
+        EXIT WHEN batch_selected = 0;
+        marked_count := marked_count + batch_marked;
+        fined_count := fined_count + batch_fined;
+        COMMIT;
+    END LOOP;
+
+    RAISE NOTICE 'Просрочено выдач: %, начислено или обновлено штрафов: %', marked_count, fined_count;
+END;
+$$;
+
+-- Перенос в архив возвращенных выдач, закрытых раньше p_older_than назад,
+-- вместе с их штрафами. Выдача с неоплаченным штрафом остается в loans,
+-- пока штраф не оплачен, поэтому fines_history только пополняется, а
+-- каждый штраф ссылается на выдачу в своей таблице (fines -> loans,
+-- fines_history -> loans_history). Пачки по p_batch_size вставляются в
+-- порядке loan_date (для BRIN) с COMMIT после каждой; вызывать вне явного
+-- BEGIN, затем VACUUM loans, чтобы освободить место в секциях и индексах:
+--     CALL archive_returned_loans();                 -- старше года
+--     CALL archive_returned_loans(INTERVAL '6 months', 5000);
+CREATE OR REPLACE PROCEDURE archive_returned_loans(
+    p_older_than INTERVAL DEFAULT INTERVAL '1 year',
+    p_batch_size INTEGER DEFAULT 10000,
+    INOUT archived_loans INTEGER DEFAULT 0,
+    INOUT archived_fines INTEGER DEFAULT 0
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    cutoff DATE := (CURRENT_DATE - p_older_than)::DATE;
+    batch_loans INTEGER;
+    batch_fines INTEGER;
+BEGIN
+    archived_loans := 0;
+    archived_fines := 0;
+    LOOP
+        -- Статистика читателей и уведомления кэша не меняются (см. триггеры)
+        PERFORM set_config('library.archiving', 'on', true);
+
+        WITH batch AS (
+            SELECT l.loan_id, l.loan_date
+            FROM loans l
+            WHERE l.status = 'возвращена'
+              AND l.return_date < cutoff
+              AND NOT EXISTS (SELECT 1 FROM fines f
+                              WHERE f.loan_id = l.loan_id AND f.paid_date IS NULL)
+            ORDER BY l.loan_date, l.loan_id
+            LIMIT p_batch_size
+            FOR UPDATE OF l SKIP LOCKED
+        ),
+        moved_fines AS (
+            DELETE FROM fines f
+            USING batch b
+            WHERE f.loan_id = b.loan_id AND f.loan_date = b.loan_date
+            RETURNING f.fine_id, f.loan_id, f.loan_date, f.amount, f.fine_date, f.paid_date, f.fine_type
+        ),
+        moved_loans AS (
+            DELETE FROM loans l
+            USING batch b
+            WHERE l.loan_id = b.loan_id AND l.loan_date = b.loan_date
+            RETURNING l.loan_id, l.reader_id, l.book_id, l.loan_date, l.due_date,
+                      l.return_date, l.status, l.librarian_id, l.notes
+        ),
+        inserted_loans AS (
+            INSERT INTO loans_history (loan_id, reader_id, book_id, loan_date, due_date,
+                                       return_date, status, librarian_id, notes)
+            SELECT * FROM moved_loans
+            ORDER BY loan_date, loan_id
+            RETURNING loan_id
+        ),
+        inserted_fines AS (
+            INSERT INTO fines_history (fine_id, loan_id, loan_date, amount, fine_date, paid_date, fine_type)
+            SELECT * FROM moved_fines
+            ORDER BY fine_date, fine_id
+            RETURNING fine_id
+        )
+        SELECT (SELECT COUNT(*) FROM inserted_loans), (SELECT COUNT(*) FROM inserted_fines)
+        INTO batch_loans, batch_fines;
+
+        EXIT WHEN batch_loans = 0;
+        archived_loans := archived_loans + batch_loans;
+        archived_fines := archived_fines + batch_fines;
+        COMMIT;
+    END LOOP;
+
+    RAISE NOTICE 'Перенесено в архив выдач: %, штрафов: %', archived_loans, archived_fines;
+END;
+$$;
+
+-- Пакетная выдача: p_requests — JSONB-массив вида
+--     [{"reader_id": 1, "book_id": 2, "notes": "..."}, ...]
+-- Проверки (читатель, просрочки, лимиты типа читателя, наличие экземпляров)
+-- выполняются для всего пакета сразу, выдачи вставляются одним INSERT.
+-- Ошибка в одной позиции не отменяет остальные: для каждой позиции
+-- возвращается loan_id или текст ошибки. Если экземпляров меньше, чем
+-- запросов, выдаются первые по порядку. Счетчики читателей пакета
+-- блокируются на время транзакции, поэтому лимит на руках соблюдается и
+-- при одновременных пакетах и вызовах issue_book.
+--     SELECT * FROM issue_books('[{"reader_id": 1, "book_id": 1}]');
+CREATE OR REPLACE FUNCTION issue_books(p_requests JSONB)
+RETURNS TABLE(
+    item_no INTEGER,
+    reader_id INTEGER,
+    book_id INTEGER,
+    loan_id INTEGER,
+    success BOOLEAN,
+    message TEXT
+) AS $$
+#variable_conflict use_column
+BEGIN
+    -- Счетчики читателей пакета блокируются до конца транзакции (по
+    -- порядку reader_id): параллельные пакеты и issue_book тех же
+    -- читателей ждут, и лимиты проверяются по актуальным значениям.
+    -- Строка счетчиков создается заранее, чтобы было что блокировать и у
+    -- читателя без выдач
+    INSERT INTO reader_loan_stats (reader_id)
+    SELECT r.reader_id
+    FROM readers r
+    WHERE r.reader_id IN (SELECT (i->>'reader_id')::INTEGER FROM jsonb_array_elements(p_requests) i)
+    ORDER BY r.reader_id
+    ON CONFLICT (reader_id) DO NOTHING;
+
+    PERFORM 1
+    FROM reader_loan_stats s
+    WHERE s.reader_id IN (SELECT (i->>'reader_id')::INTEGER FROM jsonb_array_elements(p_requests) i)
+    ORDER BY s.reader_id
+    FOR UPDATE;
+
+    RETURN QUERY
+    WITH items AS (
+        SELECT i.ord::INTEGER AS item_no,
+               (i.r->>'reader_id')::INTEGER AS reader_id,
+               (i.r->>'book_id')::INTEGER AS book_id,
+               i.r->>'notes' AS notes
+        FROM jsonb_array_elements(p_requests) WITH ORDINALITY AS i(r, ord)
+    ),
+    wanted AS (
+        SELECT it.book_id, COUNT(*) AS copies_wanted
+        FROM items it
+        GROUP BY it.book_id
+    ),
+    -- Резервируем свободные экземпляры, как это делает триггер выдачи:
+    -- SKIP LOCKED не ждет чужих выдач той же книги, а зарезервированные
+    -- строки достанутся триггеру при вставке
+    reserved AS (
+        SELECT w.book_id, COUNT(f.copy_no) AS copies_available
+        FROM wanted w
+        LEFT JOIN LATERAL (
+            SELECT c.copy_no
+            FROM book_copies c
+            WHERE c.book_id = w.book_id AND c.loan_id IS NULL
+            LIMIT w.copies_wanted
+            FOR UPDATE SKIP LOCKED
+        ) f ON TRUE
+        GROUP BY w.book_id
+    ),
+    -- Проверки читателя и книги по счетчикам reader_loan_stats
+    checked AS (
+        SELECT it.*, r.reader_type, rs.copies_available,
+               COALESCE(st.active_loans + st.overdue_loans, 0) AS on_hand,
+               lt.max_active_loans,
+               CASE
+                   WHEN r.reader_id IS NULL THEN 'Читатель не найден'
+                   WHEN NOT r.is_active THEN 'Читатель неактивен'
+                   WHEN st.overdue_loans > 0
+                       THEN 'У читателя есть просроченные книги. Выдача запрещена'
+                   WHEN st.unpaid_fines > lt.max_unpaid_fines
+                       THEN 'Неоплаченные штрафы читателя превышают лимит ' || lt.max_unpaid_fines || ' руб.'
+                   WHEN b.book_id IS NULL THEN 'Книга не найдена'
+               END AS error
+        FROM items it
+        LEFT JOIN readers r ON r.reader_id = it.reader_id
+        LEFT JOIN reader_loan_stats st ON st.reader_id = it.reader_id
+        LEFT JOIN reader_type_limits lt ON lt.reader_type = r.reader_type
+        LEFT JOIN books b ON b.book_id = it.book_id
+        LEFT JOIN reserved rs ON rs.book_id = it.book_id
+    ),
+    ranked AS (
+        SELECT c.*,
+               c.error IS NULL
+               AND row_number() OVER (PARTITION BY c.book_id, c.error IS NULL ORDER BY c.item_no)
+                   <= c.copies_available AS has_copy
+        FROM checked c
+    ),
+    -- Лимит на руках занимают по порядку только позиции, прошедшие
+    -- проверки и получившие экземпляр: отказ по другой причине не
+    -- блокирует следующие позиции читателя. Экземпляр позиции, отклоненной
+    -- по лимиту, в этом пакете другим позициям не передается
+    limited AS (
+        SELECT rk.*,
+               rk.has_copy
+               AND rk.on_hand + row_number() OVER (PARTITION BY rk.reader_id, rk.has_copy
+                                                   ORDER BY rk.item_no)
+                   > rk.max_active_loans AS over_limit
+        FROM ranked rk
+    ),
+    decided AS (
+        SELECT l.item_no, l.reader_id, l.book_id, l.notes, l.reader_type,
+               CASE WHEN l.over_limit
+                    THEN 'Превышен лимит книг на руках (' || l.max_active_loans || ')'
+                    ELSE l.error
+               END AS error,
+               -- loan_id выделяется заранее, чтобы сопоставить выдачу с позицией пакета
+               CASE WHEN l.has_copy AND l.over_limit IS NOT TRUE
+                    THEN nextval(pg_get_serial_sequence('loans', 'loan_id'))::INTEGER
+               END AS loan_id
+        FROM limited l
+    ),
+    inserted AS (
+        INSERT INTO loans (loan_id, reader_id, book_id, due_date, notes)
+        SELECT d.loan_id, d.reader_id, d.book_id, calculate_due_date(d.reader_type), d.notes
+        FROM decided d
+        WHERE d.loan_id IS NOT NULL
+        RETURNING loans.loan_id
+    )
+    SELECT d.item_no, d.reader_id, d.book_id, ins.loan_id,
+           ins.loan_id IS NOT NULL,
+           CASE WHEN ins.loan_id IS NOT NULL THEN 'Книга выдана'
+                ELSE COALESCE(d.error, 'Книга с ID ' || d.book_id || ' недоступна')
+           END
+    FROM decided d
+    LEFT JOIN inserted ins ON ins.loan_id = d.loan_id
+    ORDER BY d.item_no;
+END;
+$$ LANGUAGE plpgsql;
+
+-- То же для параллельных массивов читателей, книг и примечаний:
+--     SELECT * FROM issue_books(ARRAY[1, 2, 3], ARRAY[10, 10, 11]);
+CREATE OR REPLACE FUNCTION issue_books(
+    p_reader_ids INTEGER[],
+    p_book_ids INTEGER[],
+    p_notes TEXT[] DEFAULT NULL
+)
+RETURNS TABLE(
+    item_no INTEGER,
+    reader_id INTEGER,
+    book_id INTEGER,
+    loan_id INTEGER,
+    success BOOLEAN,
+    message TEXT
+) AS $$
+    SELECT * FROM issue_books((
+        SELECT COALESCE(jsonb_agg(jsonb_build_object('reader_id', u.r, 'book_id', u.b, 'notes', u.n)
+                                  ORDER BY u.ord), '[]')
+        FROM unnest(p_reader_ids, p_book_ids, p_notes) WITH ORDINALITY AS u(r, b, n, ord)
+    ));
+$$ LANGUAGE sql;
+
+-- Пакетный возврат: p_requests — JSONB-массив вида
+--     [{"loan_id": 1, "return_date": "2024-09-01"}, ...]
+-- (return_date необязательна, по умолчанию CURRENT_DATE). Выдачи
+-- закрываются одним UPDATE, штрафы за просрочку начисляются одним
+-- INSERT ... ON CONFLICT по дате возврата. Для каждой позиции
+-- возвращается результат и сумма штрафа.
+CREATE OR REPLACE FUNCTION return_books(p_requests JSONB)
+RETURNS TABLE(
+    item_no INTEGER,
+    loan_id INTEGER,
+    fine_amount DECIMAL(10,2),
+    success BOOLEAN,
+    message TEXT
+) AS $$
+#variable_conflict use_column
+BEGIN
+    PERFORM 1
+    FROM loans l
+    WHERE l.loan_id IN (SELECT (r->>'loan_id')::INTEGER FROM jsonb_array_elements(p_requests) r)
+    ORDER BY l.loan_id
+    FOR UPDATE;
+
+    RETURN QUERY
+    WITH items AS (
+        SELECT i.ord::INTEGER AS item_no,
+               (i.r->>'loan_id')::INTEGER AS loan_id,
+               COALESCE((i.r->>'return_date')::DATE, CURRENT_DATE) AS return_date,
+               row_number() OVER (PARTITION BY (i.r->>'loan_id')::INTEGER ORDER BY i.ord) AS dup_no
+        FROM jsonb_array_elements(p_requests) WITH ORDINALITY AS i(r, ord)
+    ),
+    checked AS (
+        SELECT it.item_no, it.loan_id, it.return_date, l.loan_date, l.due_date,
+               CASE
+                   WHEN l.loan_id IS NULL THEN 'Выдача не найдена'
+                   WHEN it.dup_no > 1 THEN 'Выдача повторяется в пакете'
+                   WHEN l.status = 'возвращена' THEN 'Книга уже возвращена'
+                   WHEN it.return_date < l.loan_date THEN 'Дата возврата раньше даты выдачи'
+               END AS error
+        FROM items it
+        LEFT JOIN loans l ON l.loan_id = it.loan_id
+    ),
+    returned AS (
+        UPDATE loans l
+        SET status = 'возвращена', return_date = c.return_date
+        FROM checked c
+        WHERE c.error IS NULL
+          AND l.loan_id = c.loan_id AND l.loan_date = c.loan_date
+        RETURNING l.loan_id
+    ),
+    fined AS (
+        INSERT INTO fines (loan_id, loan_date, amount, fine_date, fine_type)
+        SELECT c.loan_id, c.loan_date, overdue_fine_amount(c.due_date, c.return_date),
+               c.return_date, 'просрочка'
+        FROM checked c
+        WHERE c.error IS NULL AND c.return_date > c.due_date
+        ON CONFLICT (loan_id) DO UPDATE SET amount = EXCLUDED.amount
+            WHERE fines.paid_date IS NULL AND fines.fine_type = 'просрочка'
+        RETURNING fines.loan_id, fines.amount
+    )
+    SELECT c.item_no, c.loan_id, f.amount,
+           ret.loan_id IS NOT NULL,
+           CASE WHEN ret.loan_id IS NULL THEN c.error
+                WHEN c.return_date > c.due_date
+                    THEN 'Книга возвращена с просрочкой ' || (c.return_date - c.due_date) || ' дней'
+                ELSE 'Книга возвращена в срок'
+           END
+    FROM checked c
+    LEFT JOIN returned ret ON ret.loan_id = c.loan_id AND c.error IS NULL
+    LEFT JOIN fined f ON f.loan_id = c.loan_id AND c.error IS NULL
+    ORDER BY c.item_no;
+END;
+$$ LANGUAGE plpgsql;
+
+-- То же для массива выдач с общей датой возврата:
+--     SELECT * FROM return_books(ARRAY[101, 102, 103]);
+CREATE OR REPLACE FUNCTION return_books(
+    p_loan_ids INTEGER[],
+    p_return_date DATE DEFAULT CURRENT_DATE
+)
+RETURNS TABLE(
+    item_no INTEGER,
+    loan_id INTEGER,
+    fine_amount DECIMAL(10,2),
+    success BOOLEAN,
+    message TEXT
+) AS $$
+    SELECT * FROM return_books((
+        SELECT COALESCE(jsonb_agg(jsonb_build_object('loan_id', u.id, 'return_date', p_return_date)
+                                  ORDER BY u.ord), '[]')
+        FROM unnest(p_loan_ids) WITH ORDINALITY AS u(id, ord)
+    ));
+$$ LANGUAGE sql;
+"""
+
+# Анализ нормализации и статистика
+ANALYSIS_SQL = """
 -- =====================================================================
 -- АНАЛИЗ СООТВЕТСТВИЯ НОРМАЛЬНЫМ ФОРМАМ
 -- =====================================================================
@@ -659,7 +2486,19 @@ INSERT INTO normalization_analysis VALUES
 
 ('fines', '1НФ', TRUE, 'Все атрибуты атомарны'),
 ('fines', '2НФ', TRUE, 'Все атрибуты зависят от fine_id'),
-('fines', '3НФ', TRUE, 'Связь с loans через внешний ключ, нет транзитивных зависимостей');
+('fines', '3НФ', TRUE, 'Связь с loans через внешний ключ, нет транзитивных зависимостей'),
+
+('book_copies', '1НФ', TRUE, 'Строка на экземпляр вместо счетчика в books'),
+('book_copies', '2НФ', TRUE, 'loan_id зависит от полного ключа (book_id, copy_no)'),
+('book_copies', '3НФ', TRUE, 'Нет транзитивных зависимостей'),
+
+('reader_type_limits', '3НФ', TRUE, 'Лимиты зависят только от типа читателя (ключа)'),
+('loan_requests', '3НФ', TRUE, 'Заявка хранит только свои аргументы и результат; ссылки на выдачу и читателя проверяют процедуры'),
+
+('reader_loan_stats', '3НФ', FALSE, 'Намеренная денормализация: счетчики выводятся из loans и fines, поддерживаются триггерами'),
+('book_loans_daily', '3НФ', FALSE, 'Намеренная денормализация: дневные итоги выдач, поддерживаются триггерами'),
+('category_loans_daily', '3НФ', FALSE, 'Намеренная денормализация: итоги выдач по категории книги на момент выдачи'),
+('book_loan_totals', '3НФ', FALSE, 'Намеренная денормализация: общий итог выдач книги, поддерживается триггерами');
 
 -- =====================================================================
 -- СОЗДАНИЕ ОТЧЕТОВ ДЛЯ АНАЛИЗА
@@ -714,24 +2553,106 @@ SELECT 'База данных "Система управления библио
        'Созданы индексы, представления, функции и триггеры' as "Дополнительно";
 """
 
-# Сохраняем полный SQL-скрипт
-with open('library_postgresql_full.sql', 'w', encoding='utf-8') as f:
-    f.write(postgres_normalization_script)
-
-print("=== СОЗДАН ПОЛНЫЙ SQL-СКРИПТ С ДЕМОНСТРАЦИЕЙ НОРМАЛИЗАЦИИ ===")
-print("Файл: library_postgresql_full.sql")
-print("\nСодержимое скрипта:")
-print("✓ Демонстрация ненормализованной таблицы (антипример)")
-print("✓ Пошаговое приведение к 1НФ, 2НФ, 3НФ с комментариями")
-print("✓ Полная схема PostgreSQL с ограничениями целостности")
-print("✓ Индексы для оптимизации производительности")
-print("✓ Тестовые данные для всех таблиц") 
-print("✓ Представления для анализа и отчетности")
-print("✓ Функции и процедуры для автоматизации")
-print("✓ Триггеры для поддержания целостности")
-print("✓ Анализ соответствия нормальным формам")
-print("✓ Примеры полезных запросов")
-print("✓ Процедуры администрирования")
-print("✓ Статистика созданных объектов")
-print("\nРазмер файла: ~15KB, ~600 строк кода")
-print("Готов для использования в PostgreSQL 12+")
\ No newline at end of file
+# Перестроение таблиц, поддерживаемых триггерами, по уже загруженным данным
+REFRESH_DERIVED_SQL = """
+-- Заполнение производных таблиц по данным, вставленным до создания триггеров
+SELECT rebuild_book_copies() AS book_copies_built;
+SELECT sync_books_availability() AS books_availability_fixed;
+SELECT rebuild_reader_stats() AS reader_stats_fixed;
+SELECT rebuild_loan_rollups() AS loan_rollups_fixed;
+SELECT rebuild_book_authors_display() AS authors_display_fixed;
+SELECT rebuild_book_search_vector() AS search_vectors_fixed;
+"""
+
+# Пересчет производных данных после массовой загрузки (идемпотентен)
+POST_LOAD_SQL = """
+-- =====================================================================
+-- ПЕРЕСЧЕТ ПРОИЗВОДНЫХ ДАННЫХ ПОСЛЕ ЗАГРУЗКИ
+-- Выполняется одним проходом по таблицам вместо построчных триггеров
+-- =====================================================================
+
+-- Последовательности продолжают нумерацию после загруженных ключей
+SELECT setval(pg_get_serial_sequence('categories', 'category_id'), COALESCE(MAX(category_id), 0) + 1, false) FROM categories;
+SELECT setval(pg_get_serial_sequence('readers', 'reader_id'), COALESCE(MAX(reader_id), 0) + 1, false) FROM readers;
+SELECT setval(pg_get_serial_sequence('authors', 'author_id'), COALESCE(MAX(author_id), 0) + 1, false) FROM authors;
+SELECT setval(pg_get_serial_sequence('books', 'book_id'), COALESCE(MAX(book_id), 0) + 1, false) FROM books;
+SELECT setval(pg_get_serial_sequence('loans', 'loan_id'), COALESCE(MAX(loan_id), 0) + 1, false) FROM loans;
+SELECT setval(pg_get_serial_sequence('fines', 'fine_id'), COALESCE(MAX(fine_id), 0) + 1, false) FROM fines;
+""" + REFRESH_DERIVED_SQL
+
+# Полный скрипт: разделы в учебном порядке
+postgres_normalization_script = (
+    HEADER_SQL + SCHEMA_SQL + TABLES_SQL + PARTITIONS_SQL + FOREIGN_KEYS_SQL + INDEXES_SQL
+    + SAMPLE_DATA_SQL + VIEWS_SQL + FUNCTIONS_SQL + TRIGGER_FUNCTIONS_SQL
+    + TRIGGERS_SQL + REFRESH_DERIVED_SQL + EXAMPLES_SQL + PROCEDURES_SQL + ANALYSIS_SQL
+)
+
+# ---------------------------------------------------------------------
+# РЕЖИМ МАССОВОЙ ЗАГРУЗКИ
+# Порядок: голые таблицы -> COPY данных -> экземпляры и производные данные ->
+# индексы (параллельно, по одному оператору на соединение) -> внешние
+# ключи и триггеры. Так строки не платят за триггеры и обслуживание
+# индексов при загрузке. Запуск фаз — bulk_load.py.
+# ---------------------------------------------------------------------
+
+BULK_LOAD_SEARCH_PATH = "SET search_path TO library, public;\n"
+
+bulk_load_scripts = {
+    # Фаза 1: таблицы без индексов, внешних ключей и триггеров; представления
+    # раньше функций — тела SQL-функций проверяются при создании
+    'library_bulk_load_1_schema.sql': (
+        SCHEMA_SQL + TABLES_SQL + PARTITIONS_SQL + VIEWS_SQL + FUNCTIONS_SQL
+        + TRIGGER_FUNCTIONS_SQL + PROCEDURES_SQL
+    ),
+    # Фаза 2 — COPY данных (data_generator.py --bare или выгрузка старой системы)
+    # Фаза 3: пересчет производных данных
+    'library_bulk_load_3_post_load.sql': BULK_LOAD_SEARCH_PATH + POST_LOAD_SQL,
+    # Фаза 4: индексы; операторы независимы и строятся параллельно
+    'library_bulk_load_4_indexes.sql': BULK_LOAD_SEARCH_PATH + INDEXES_SQL,
+    # Фаза 5: внешние ключи, триггеры и статистика планировщика
+    'library_bulk_load_5_constraints.sql': (
+        BULK_LOAD_SEARCH_PATH + FOREIGN_KEYS_SQL + TRIGGERS_SQL + "\nANALYZE;\n"
+    ),
+}
+
+
+def sql_statements(sql):
+    """Разбивает раздел без $$-тел на отдельные операторы (для параллельного запуска)."""
+    text = '\n'.join(line for line in sql.split('\n') if not line.lstrip().startswith('--'))
+    return [stmt.strip() + ';' for stmt in text.split(';') if stmt.strip()]
+
+
+def write_sql(path, sql):
+    # Строки из одних пробелов не сохраняем
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(re.sub(r'(?m)^[ \t]+$', '', sql))
+
+
+if __name__ == '__main__':
+    # Сохраняем полный SQL-скрипт
+    write_sql('library_postgresql_full.sql', postgres_normalization_script)
+    for path, sql in bulk_load_scripts.items():
+        write_sql(path, sql)
+
+    print("=== СОЗДАН ПОЛНЫЙ SQL-СКРИПТ С ДЕМОНСТРАЦИЕЙ НОРМАЛИЗАЦИИ ===")
+    print("Файл: library_postgresql_full.sql")
+    print("\nСодержимое скрипта:")
+    print("✓ Демонстрация ненормализованной таблицы (антипример)")
+    print("✓ Пошаговое приведение к 1НФ, 2НФ, 3НФ с комментариями")
+    print("✓ Полная схема PostgreSQL с ограничениями целостности")
+    print("✓ Индексы для оптимизации производительности")
+    print("✓ Секционирование выдач по месяцам и архив старых секций")
+    print("✓ Тестовые данные для всех таблиц") 
+    print("✓ Представления для анализа и отчетности")
+    print("✓ Функции и процедуры для автоматизации")
+    print("✓ Триггеры для поддержания целостности")
+    print("✓ Анализ соответствия нормальным формам")
+    print("✓ Примеры полезных запросов")
+    print("✓ Процедуры администрирования")
+    print("✓ Статистика созданных объектов")
+    print("\nРазмер файла: ~15KB, ~600 строк кода")
+    print("Готов для использования в PostgreSQL 13+ (секционированная таблица выдач)")
+
+    print("\nРежим массовой загрузки:")
+    for path in bulk_load_scripts:
+        print(f"✓ {path}")
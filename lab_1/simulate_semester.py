@@ -0,0 +1,384 @@
+# Имитация семестра библиотеки с дискретными событиями
+#
+# Семестр из --days дней проигрывается в сжатом времени (--wall-minutes
+# минут реального времени) через процедуры схемы:
+#   - выдачи (CALL issue_book): читатели каждого reader_type, книги по
+#     закону Ципфа, сезонность — пик первых двух недель, недельный цикл,
+#     часы работы 9–21 с обеденным и вечерним пиками;
+#   - возвраты (CALL return_book): срок выдачи из calculate_due_date,
+#     доля и длительность просрочек по типу читателя (как в
+#     data_generator.py); за две недели до конца семестра студенты
+#     сдают книги волной;
+#   - отчеты: самые выдаваемые книги месяца (top_books_between),
+#     v_active_loans и v_reader_statistics параллельно с выдачами.
+# События исполняют --desks соединений («кафедры выдачи»). Отдельный поток
+# опрашивает pg_stat_activity и собирает ожидания блокировок.
+#
+# В конце печатаются гистограммы задержек по видам операций и сводка по
+# неделям семестра: операции, отказы, ожидания блокировок, отставание
+# от расписания. Даты в базе не сдвигаются: выдачи получают CURRENT_DATE,
+# возвраты — CURRENT_DATE плюс длительность выдачи в днях симуляции.
+# Запускайте на отдельной базе (например, library_bench_* из
+# bench_procedures.py --keep). Пример:
+#     python simulate_semester.py --dsn "dbname=library_bench_medium" \
+#         --days 120 --wall-minutes 10 --checkouts-per-day 3000 --desks 8 -o sim.json
+#
+# Требуется psycopg 3 (pip install psycopg).
+
+import argparse
+import heapq
+import itertools
+import json
+import queue
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+import psycopg
+
+from bench_procedures import percentile
+from data_generator import (MEAN_DAYS_LATE, OVERDUE_RATE, READER_TYPES, WEEKDAY_FACTOR,
+                            zipf_cum_weights)
+
+DAY = 86_400
+OPEN_HOURS = range(9, 21)
+# Посещаемость по часам работы: обеденный и вечерний пики
+HOUR_WEIGHTS = [0.6, 0.9, 1.2, 1.5, 1.4, 1.0, 0.9, 1.0, 1.3, 1.4, 1.0, 0.6]
+STORM_DAYS = 14          # пик выдач в начале семестра
+STORM_FACTOR = 3.0
+RETURN_WAVE_DAYS = 14    # волна возвратов в конце семестра
+
+# Границы корзин гистограммы задержек, мс
+HISTOGRAM_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+REPORTS = [
+    'SELECT * FROM top_books_between(CURRENT_DATE - 30, CURRENT_DATE, 20)',
+    'SELECT * FROM v_active_loans WHERE days_overdue > 0 LIMIT 50',
+    'SELECT * FROM v_reader_statistics WHERE reader_id = %s',
+]
+
+# Номер выдачи возвращается в INOUT loan_id
+ISSUE = "CALL issue_book(%s, %s, 'semester-sim')"
+RETURN = 'CALL return_book(%s, CURRENT_DATE + %s)'
+
+LOCK_WAITS = """
+SELECT wait_event, COUNT(*)
+FROM pg_stat_activity
+WHERE datname = current_database() AND wait_event_type = 'Lock'
+GROUP BY wait_event
+"""
+
+
+class Stats:
+    """Задержки и исходы операций, ожидания блокировок по дням симуляции."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)        # операция -> [с]
+        self.outcomes = defaultdict(Counter)       # операция -> {ok, отказ, ошибка}
+        self.daily_ops = defaultdict(Counter)      # день -> {операция: n}
+        self.daily_rejects = Counter()
+        self.daily_lag = defaultdict(list)         # день -> [отставание, с]
+        self.lock_samples = defaultdict(list)      # день -> [ожидающих сеансов]
+        self.lock_events = Counter()               # wait_event -> выборок
+
+    def record(self, op, day, latency, outcome, lag):
+        with self.lock:
+            self.latencies[op].append(latency)
+            self.outcomes[op][outcome] += 1
+            self.daily_ops[day][op] += 1
+            if outcome != 'ok':
+                self.daily_rejects[day] += 1
+            self.daily_lag[day].append(lag)
+
+
+class Simulation:
+    def __init__(self, args):
+        self.args = args
+        # Случайные величины тянет только диспетчер (и load до старта):
+        # кафедры получают их в событиях, поэтому --seed воспроизводит
+        # календарь независимо от порядка работы потоков
+        self.rng = random.Random(args.seed)
+        self.speed = args.days * DAY / (args.wall_minutes * 60)
+        self.events = []
+        self.events_lock = threading.Lock()
+        self.seq = itertools.count()
+        self.work = queue.Queue(maxsize=args.desks * 64)
+        self.stats = Stats()
+        self.started = None
+        self.stop = threading.Event()
+        # Плановые возвраты: loan_id -> (время, день выдачи, тип читателя); волна
+        # возвратов переносит их, старые события по версии пропускаются
+        self.returns = {}
+        self.returns_lock = threading.Lock()
+
+    # --- подготовка ---
+
+    def load(self, conn):
+        rows = conn.execute("SELECT reader_id, reader_type FROM readers WHERE is_active").fetchall()
+        self.readers = rows
+        books = [row[0] for row in conn.execute(
+            "SELECT book_id FROM v_book_stock WHERE copies_total > 0 ORDER BY book_id").fetchall()]
+        self.rng.shuffle(books)  # ранг популярности не совпадает с book_id
+        self.books = books
+        self.book_weights = zipf_cum_weights(len(books), self.args.zipf)
+        self.loan_days = dict(conn.execute(
+            "SELECT t, calculate_due_date(t, CURRENT_DATE) - CURRENT_DATE "
+            "FROM unnest(%s::varchar[]) AS t", (READER_TYPES,)).fetchall())
+        if not self.readers or not self.books:
+            raise SystemExit('В базе нет активных читателей или книг с экземплярами')
+
+    # --- календарь событий ---
+
+    def schedule(self, at, kind, payload=None):
+        with self.events_lock:
+            heapq.heappush(self.events, (at, next(self.seq), kind, payload))
+
+    def time_of_day(self, day):
+        hour = self.rng.choices(OPEN_HOURS, weights=HOUR_WEIGHTS)[0]
+        return day * DAY + hour * 3600 + self.rng.uniform(0, 3600)
+
+    def plan_day(self, day):
+        factor = WEEKDAY_FACTOR[day % 7]
+        if day < STORM_DAYS:
+            factor *= STORM_FACTOR
+        elif day >= self.args.days - RETURN_WAVE_DAYS:
+            factor *= 0.5
+        for _ in range(int(self.rng.gauss(1, 0.1) * self.args.checkouts_per_day * factor)):
+            reader_id, reader_type = self.rng.choice(self.readers)
+            book_id = self.books[self.rng.choices(range(len(self.books)),
+                                                  cum_weights=self.book_weights)[0]]
+            self.schedule(self.time_of_day(day), 'issue',
+                          (reader_id, reader_type, book_id, self.draw_return(reader_type)))
+        for _ in range(int(self.args.reports_per_day * WEEKDAY_FACTOR[day % 7])):
+            report = self.rng.randrange(len(REPORTS))
+            self.schedule(self.time_of_day(day), 'report',
+                          (report, self.rng.choice(self.readers)[0]))
+        if day + 1 < self.args.days:
+            self.schedule((day + 1) * DAY, 'day')
+        if day == self.args.days - RETURN_WAVE_DAYS:
+            self.return_wave(day)
+
+    def draw_return(self, reader_type):
+        """Срок возврата будущей выдачи: (дней после выдачи, секунда дня)."""
+        period = self.loan_days[reader_type]
+        if self.rng.random() < OVERDUE_RATE[reader_type]:
+            days = period + 1 + int(self.rng.expovariate(1.0 / MEAN_DAYS_LATE[reader_type]))
+        else:
+            days = self.rng.randrange(1, period + 1)
+        return days, self.time_of_day(0)
+
+    def plan_return(self, loan_id, reader_type, issued_at, due):
+        days, second = due
+        at = (int(issued_at // DAY) + days) * DAY + second
+        with self.returns_lock:
+            self.returns[loan_id] = (at, int(issued_at // DAY), reader_type)
+        self.schedule(at, 'return', (loan_id, at))
+
+    def return_wave(self, day):
+        """Студенты сдают книги до конца семестра."""
+        end = self.args.days * DAY
+        with self.returns_lock:
+            moved = [(loan_id, issued_day) for loan_id, (at, issued_day, reader_type)
+                     in self.returns.items() if at >= end and reader_type == 'студент']
+        for loan_id, issued_day in moved:
+            at = self.time_of_day(day + self.rng.randrange(RETURN_WAVE_DAYS))
+            with self.returns_lock:
+                self.returns[loan_id] = (at, issued_day, 'студент')
+            self.schedule(at, 'return', (loan_id, at))
+
+    # --- исполнение ---
+
+    def wall_target(self, at):
+        return self.started + at / self.speed
+
+    def dispatch(self):
+        self.schedule(0, 'day')
+        end = self.args.days * DAY
+        while True:
+            with self.events_lock:
+                if not self.events:
+                    break
+                at, _, kind, payload = self.events[0]
+                if at >= end:
+                    break
+                wait = self.wall_target(at) - time.perf_counter()
+                if wait <= 0:
+                    heapq.heappop(self.events)
+            if wait > 0:
+                time.sleep(min(wait, 0.05))
+                continue
+            if kind == 'day':
+                self.plan_day(int(at // DAY))
+            else:
+                self.work.put((at, kind, payload))
+        for _ in range(self.args.desks):
+            self.work.put(None)
+
+    def desk(self):
+        with psycopg.connect(self.args.dsn, autocommit=True, prepare_threshold=0) as conn:
+            conn.execute('SET search_path TO library, public')
+            while True:
+                item = self.work.get()
+                if item is None:
+                    return
+                at, kind, payload = item
+                lag = time.perf_counter() - self.wall_target(at)
+                if kind == 'return':
+                    loan_id, planned = payload
+                    with self.returns_lock:
+                        current = self.returns.get(loan_id)
+                        if current is None or current[0] != planned:
+                            continue  # перенесен волной возвратов
+                        del self.returns[loan_id]
+                    op = 'return_book'
+                    statement, params = RETURN, (loan_id, int(at // DAY) - current[1])
+                elif kind == 'issue':
+                    reader_id, reader_type, book_id, due = payload
+                    op, statement, params = 'issue_book', ISSUE, (reader_id, book_id)
+                else:
+                    op = 'report'
+                    report, reader_id = payload
+                    statement = REPORTS[report]
+                    params = (reader_id,) if '%s' in statement else None
+                started = time.perf_counter()
+                outcome = 'ok'
+                try:
+                    cur = conn.execute(statement, params)
+                    if op == 'issue_book':
+                        loan_id = cur.fetchone()[0]
+                except psycopg.errors.RaiseException:
+                    outcome = 'отказ'
+                except psycopg.Error:
+                    outcome = 'ошибка'
+                latency = time.perf_counter() - started
+                self.stats.record(op, int(at // DAY), latency, outcome, lag)
+                if op == 'issue_book' and outcome == 'ok':
+                    self.plan_return(loan_id, reader_type, at, due)
+
+    def monitor(self):
+        with psycopg.connect(self.args.dsn, autocommit=True) as conn:
+            while not self.stop.wait(self.args.sample_ms / 1000):
+                day = int((time.perf_counter() - self.started) * self.speed // DAY)
+                rows = conn.execute(LOCK_WAITS).fetchall()
+                with self.stats.lock:
+                    self.stats.lock_samples[day].append(sum(n for _, n in rows))
+                    for event, n in rows:
+                        self.stats.lock_events[event] += n
+
+    def run(self):
+        with psycopg.connect(self.args.dsn, autocommit=True) as conn:
+            conn.execute('SET search_path TO library, public')
+            self.load(conn)
+        desks = [threading.Thread(target=self.desk) for _ in range(self.args.desks)]
+        for t in desks:
+            t.start()
+        self.started = time.perf_counter()
+        monitor = threading.Thread(target=self.monitor, daemon=True)
+        monitor.start()
+        self.dispatch()
+        for t in desks:
+            t.join()
+        self.stop.set()
+        monitor.join()
+
+
+# ---------------------------------------------------------------------
+# ОТЧЕТ
+# ---------------------------------------------------------------------
+
+def histogram(latencies):
+    counts = [0] * (len(HISTOGRAM_MS) + 1)
+    for value in latencies:
+        ms = value * 1000
+        counts[next((i for i, bound in enumerate(HISTOGRAM_MS) if ms <= bound), -1)] += 1
+    labels = [f'≤{bound} мс' for bound in HISTOGRAM_MS] + [f'>{HISTOGRAM_MS[-1]} мс']
+    return list(zip(labels, counts))
+
+
+def summarize(sim):
+    stats = sim.stats
+    report = {'operations': {}, 'weeks': [], 'lock_wait_events': dict(stats.lock_events)}
+    for op, values in sorted(stats.latencies.items()):
+        values.sort()
+        report['operations'][op] = {
+            'count': len(values),
+            'outcomes': dict(stats.outcomes[op]),
+            'p50_ms': round(percentile(values, 50) * 1000, 3),
+            'p95_ms': round(percentile(values, 95) * 1000, 3),
+            'p99_ms': round(percentile(values, 99) * 1000, 3),
+            'histogram': histogram(values),
+        }
+    for week in range((sim.args.days + 6) // 7):
+        days = range(week * 7, min(sim.args.days, week * 7 + 7))
+        ops = Counter()
+        for day in days:
+            ops.update(stats.daily_ops[day])
+        lags = sorted(x for day in days for x in stats.daily_lag[day])
+        samples = [x for day in days for x in stats.lock_samples[day]]
+        report['weeks'].append({
+            'week': week + 1,
+            'operations': dict(ops),
+            'rejected_or_failed': sum(stats.daily_rejects[day] for day in days),
+            'lock_waiters_avg': round(sum(samples) / len(samples), 2) if samples else 0,
+            'lock_waiters_max': max(samples, default=0),
+            'lag_p95_s': round(percentile(lags, 95), 3),
+        })
+    return report
+
+
+def print_report(report):
+    print('=== ЗАДЕРЖКИ ПО ОПЕРАЦИЯМ ===')
+    for op, data in report['operations'].items():
+        outcomes = ', '.join(f'{k}: {v}' for k, v in data['outcomes'].items())
+        print(f'\n{op}: {data["count"]} ({outcomes}); p50 {data["p50_ms"]} мс, '
+              f'p95 {data["p95_ms"]} мс, p99 {data["p99_ms"]} мс')
+        peak = max((n for _, n in data['histogram']), default=0) or 1
+        for label, n in data['histogram']:
+            print(f'  {label:>10} {n:>8} {"█" * round(40 * n / peak)}')
+    print('\n=== ПО НЕДЕЛЯМ СЕМЕСТРА ===')
+    print(f'{"нед.":>4} {"выдачи":>8} {"возвраты":>9} {"отчеты":>7} {"отказы":>7} '
+          f'{"блок. ср":>9} {"блок. макс":>10} {"отст. p95, с":>12}')
+    for w in report['weeks']:
+        ops = w['operations']
+        print(f'{w["week"]:>4} {ops.get("issue_book", 0):>8} {ops.get("return_book", 0):>9} '
+              f'{ops.get("report", 0):>7} {w["rejected_or_failed"]:>7} '
+              f'{w["lock_waiters_avg"]:>9} {w["lock_waiters_max"]:>10} {w["lag_p95_s"]:>12}')
+    if report['lock_wait_events']:
+        print('\nОжидания блокировок по типам:',
+              ', '.join(f'{k}: {v}' for k, v in sorted(report['lock_wait_events'].items())))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Имитация семестра библиотеки')
+    parser.add_argument('--dsn', required=True, help='строка подключения PostgreSQL')
+    parser.add_argument('--days', type=int, default=120, help='длина семестра в днях')
+    parser.add_argument('--wall-minutes', type=float, default=10.0,
+                        help='реальная длительность прогона всего семестра, мин')
+    parser.add_argument('--checkouts-per-day', type=int, default=2000,
+                        help='средняя дневная выдача вне пиков')
+    parser.add_argument('--reports-per-day', type=int, default=200)
+    parser.add_argument('--desks', type=int, default=8, help='параллельных соединений')
+    parser.add_argument('--zipf', type=float, default=1.07)
+    parser.add_argument('--sample-ms', type=float, default=200.0,
+                        help='период опроса pg_stat_activity, мс')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('-o', '--output', help='сохранить сводку в JSON')
+    args = parser.parse_args(argv)
+    if args.days <= RETURN_WAVE_DAYS or args.desks < 1 or args.wall_minutes <= 0:
+        parser.error(f'нужны --days > {RETURN_WAVE_DAYS}, --desks >= 1 и --wall-minutes > 0')
+
+    sim = Simulation(args)
+    sim.run()
+    report = summarize(sim)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'\n✓ Сводка: {args.output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()